@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Run color detection over a directory of images or a video file, offline.
+
+For tuning lab_config.yaml without driving the robot around: every frame
+goes through the same VisionPipeline main_loop() uses (resize to the
+processing resolution, blur, threshold, open/close, contours), built from
+--lab_config at quality level --quality (see hiwonder_common/governor.py),
+and one row per frame and color is written out:
+
+    source, frame, color, detected, area, x, y, w, h
+
+area is the largest blob's, and (x, y, w, h) its bounding box, both in
+pixels at the processing resolution. detected is area > the robot's
+minimum target area, scaled to the processing resolution.
+
+Frames are decoded and detected in a pool of --workers processes, a
+--chunk of frames per task: each worker reads its own chunk of image files,
+or seeks to its own span of the video. (A video that doesn't report its
+length is read by one worker.)
+
+Output is CSV, Parquet (if the path ends in .parquet and pyarrow is
+installed) or a .npz of one array per column.
+
+Examples:
+python3 batch_detect.py frames/ --lab_config lab_config.yaml --out detections.csv
+python3 batch_detect.py run1.mp4 run2.mp4 --colors green red --out detections.parquet
+"""
+
+import os
+import csv
+import sys
+import time
+import argparse
+import pathlib as pl
+import multiprocessing as mp
+
+import cv2
+import numpy as np
+
+from hiwonder_common import config
+from hiwonder_common import vision
+from hiwonder_common import colorlut
+from hiwonder_common import governor
+from hiwonder_common import remap
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CAMERA_SIZE = (640, 480)
+MIN_TARGET_AREA = 300  # pixels at 640x480, as in milling_controller.py
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+COLUMNS = ('source', 'frame', 'color', 'detected', 'area', 'x', 'y', 'w', 'h')
+
+_worker = None  # the worker process's Detector
+
+
+class Detector:
+    def __init__(self, lab_data, colors, level, lut=None, undistort=None):
+        self.colors = colors
+        w, h = level.size
+        self.min_area = MIN_TARGET_AREA * (w * h) / (CAMERA_SIZE[0] * CAMERA_SIZE[1])
+        self.undistort = undistort
+        self.pipe = vision.VisionPipeline.from_config(
+            lab_data, size=level.size, blur_ksize=level.blur_ksize, lut=lut,
+            remap=undistort.resized(level.size) if undistort else None)
+
+    def rows(self, source, index, image):
+        if self.undistort is not None and image.shape[1::-1] != CAMERA_SIZE:
+            image = cv2.resize(image, CAMERA_SIZE, interpolation=cv2.INTER_NEAREST)  # what the maps expect
+        for color in self.colors:
+            found = self.pipe.find_target(image, color)
+            if found:
+                contour, area = found[0]
+                yield (source, index, color, area > self.min_area, area) + cv2.boundingRect(contour)
+            else:
+                yield source, index, color, False, 0.0, 0, 0, 0, 0
+
+
+def init_worker(detector):
+    global _worker
+    cv2.setNumThreads(1)  # one process per core already
+    _worker = detector
+
+
+def image_files(directory):
+    return sorted(p for p in pl.Path(directory).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def make_tasks(paths, chunk):
+    # ('images', source, first index, [paths]) or ('video', source, first index, count or None)
+    for path in map(pl.Path, paths):
+        if path.is_dir():
+            files = image_files(path)
+            for start in range(0, len(files), chunk):
+                yield 'images', str(path), start, [str(f) for f in files[start:start + chunk]]
+            continue
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            raise SystemExit(f"Can't read {path}")
+        n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        if n <= 0:
+            yield 'video', str(path), 0, None  # unknown length, so it can't be split
+            continue
+        for start in range(0, n, chunk):
+            yield 'video', str(path), start, min(chunk, n - start)
+
+
+def read_chunk(kind, source, start, what):
+    if kind == 'images':
+        for i, path in enumerate(what, start):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                yield pl.Path(path).name, i, image
+        return
+    cap = cv2.VideoCapture(source)
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        i = start
+        while what is None or i < start + what:
+            ok, image = cap.read()
+            if not ok:
+                break
+            yield source, i, image
+            i += 1
+    finally:
+        cap.release()
+
+
+def detect_chunk(task):
+    """(rows, frames read) for one task, in a worker process."""
+    rows = []
+    n = 0
+    for source, index, image in read_chunk(*task):
+        rows.extend(_worker.rows(source, index, image))
+        n += 1
+    return rows, n
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+def write_columns(path, rows):
+    columns = dict(zip(COLUMNS, map(list, zip(*rows)))) if rows else {name: [] for name in COLUMNS}
+    if path.endswith('.npz'):
+        np.savez(path, **{name: np.asarray(values) for name, values in columns.items()})
+    else:
+        pyarrow.parquet.write_table(pyarrow.table(columns), path)
+
+
+def write(path, rows):
+    if path.endswith('.parquet') and pyarrow is None:
+        print("pyarrow isn't installed, so writing CSV instead.", file=sys.stderr)
+        path = path[:-len('.parquet')] + '.csv'
+    if path.endswith(('.parquet', '.npz')):
+        write_columns(path, rows)
+    else:
+        write_csv(path, rows)
+    return path
+
+
+def get_parser(parser, subparsers=None):
+    parser.add_argument("inputs", nargs='+', help="directories of images, or video files")
+    parser.add_argument("--lab_config", default='/home/pi/TurboPi/lab_config.yaml')
+    parser.add_argument("--colors", nargs='+', default=['green'], help="colors from the lab config to detect")
+    parser.add_argument("--quality", type=int, default=0,
+                        help="processing quality level, 0 (full) to "
+                             f"{len(governor.DEFAULT_LADDER) - 1}, see hiwonder_common/governor.py")
+    parser.add_argument("--no_lut", action='store_true', help="threshold with cvtColor() + inRange()")
+    parser.add_argument("--calibration", default=None,
+                        help="undistort with this camera calibration first, as the robot does")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=64, help="frames per task")
+    parser.add_argument("--out", default='detections.csv', help=".csv, .parquet or .npz")
+    return parser, subparsers
+
+
+def main(args):
+    lab_data = config.load_yaml(args.lab_config)
+    missing = [color for color in args.colors if color not in lab_data]
+    if missing:
+        print(f"{args.lab_config} has no {', '.join(missing)}", file=sys.stderr)
+        return 2
+    level = governor.DEFAULT_LADDER[args.quality]
+    # built (or loaded from their caches) once, here, and inherited by the forked workers
+    lut = None if args.no_lut else colorlut.ColorLUT.from_config(lab_data)
+    undistort = None
+    if args.calibration:
+        undistort = remap.UndistortRemap.from_calibration(args.calibration, CAMERA_SIZE, level.size)
+    detector = Detector(lab_data, args.colors, level, lut, undistort)
+
+    rows = []
+    n_frames = 0
+    t0 = time.perf_counter()
+    with mp.get_context('fork').Pool(args.workers, init_worker, (detector,)) as pool:
+        for chunk_rows, n in pool.imap(detect_chunk, make_tasks(args.inputs, args.chunk)):
+            rows.extend(chunk_rows)
+            n_frames += n
+    elapsed = time.perf_counter() - t0
+    if not n_frames:
+        print("No frames could be read.", file=sys.stderr)
+        return 1
+
+    path = write(args.out, rows)
+    print(f"{n_frames} frames in {elapsed:.1f} s ({n_frames / elapsed * 60:.0f} frames/min) "
+          f"with {args.workers} workers, at {level.size[0]}x{level.size[1]}. Wrote {path}")
+    for color in args.colors:
+        detected = sum(row[3] for row in rows if row[2] == color)
+        print(f"{color}: detected in {detected} frames ({detected / n_frames:.1%})")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Detect colors in recorded frames, in parallel.")
+    get_parser(parser)
+    sys.exit(main(parser.parse_args()))
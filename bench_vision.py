@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Benchmark the vision hot path, reproducibly, on any Linux box.
+
+Runs a fixed set of frames through each detection path and reports per-stage
+timings, fps, p50/p95/p99 frame latency and bytes allocated per frame, as
+JSON. Hardware modules (Camera, HiwonderSDK, RPi.GPIO) are replaced with
+hiwonder_common.standins, so nothing moves.
+
+Paths:
+- legacy: the original main_loop sequence (copy, resize, blur, cvtColor,
+  inRange, morphology, findContours, sort, draw), as the reference point.
+- vision / vision_nolut: hiwonder_common.vision.VisionPipeline with and
+  without the color lookup table.
+- main_loop: BinaryProgram.main_loop() end to end, including control().
+
+Frames are synthetic (the stand-in camera's scene, plus --specks of noise) or
+recorded (--frames: a video file or a directory of images).
+
+Examples:
+python3 bench_vision.py --out bench.json
+python3 bench_vision.py --frames recording.avi --baseline bench.json  # exits 1 on regression
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import pathlib as pl
+
+import cv2
+import yaml
+import numpy as np
+
+from hiwonder_common import standins
+from hiwonder_common import vision
+from hiwonder_common import colorlut
+from hiwonder_common import render
+from hiwonder_common import frames
+
+# TurboPi's stock lab_config.yaml
+DEFAULT_LAB_CONFIG = {
+    'red': {'min': [0, 150, 130], 'max': [255, 255, 255]},
+    'green': {'min': [47, 0, 135], 'max': [255, 110, 255]},
+    'blue': {'min': [0, 0, 0], 'max': [255, 146, 110]},
+    'black': {'min': [0, 0, 0], 'max': [56, 255, 255]},
+    'white': {'min': [193, 0, 0], 'max': [255, 255, 255]},
+}
+CAMERA_SIZE = (640, 480)
+PATHS = ('legacy', 'vision', 'vision_nolut', 'main_loop')
+
+
+class StageTimer:
+    """Per-stage perf_counter_ns deltas for every frame."""
+
+    def __init__(self):
+        self.stages = {}
+        self.totals = []
+        self._t = None
+        self._t_frame = None
+
+    def start(self):
+        self._t = self._t_frame = time.perf_counter_ns()
+
+    def lap(self, stage):
+        t = time.perf_counter_ns()
+        self.stages.setdefault(stage, []).append(t - self._t)
+        self._t = t
+
+    def stop(self):
+        self.totals.append(time.perf_counter_ns() - self._t_frame)
+
+
+class NullTimer:
+    def start(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def stop(self):
+        pass
+
+
+def percentiles_ms(ns):
+    ns = np.asarray(ns, np.float64) / 1E6
+    p50, p95, p99 = np.percentile(ns, (50, 95, 99))
+    return {'mean': float(ns.mean()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+def synthetic_frames(count, specks=0, seed=0):
+    camera = standins.StandInCamera.__new__(standins.StandInCamera)  # just for render(), no capture thread
+    camera.width, camera.height = CAMERA_SIZE
+    camera.target_bgr, camera.background_bgr = (40, 200, 40), (128, 128, 128)
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(count):
+        img = camera.render(i)
+        if specks:
+            ys = rng.integers(0, camera.height - 2, specks)
+            xs = rng.integers(0, camera.width - 2, specks)
+            for y, x in zip(ys, xs):
+                img[y:y + 2, x:x + 2] = camera.target_bgr
+        out.append(img)
+    return out
+
+
+def recorded_frames(path, count):
+    path = pl.Path(path)
+    if path.is_dir():
+        images = (cv2.imread(str(p)) for p in sorted(path.iterdir()))
+        images = [img for img in images if img is not None]
+    else:
+        cap = cv2.VideoCapture(str(path))
+        images = []
+        while len(images) < count:
+            ok, img = cap.read()
+            if not ok:
+                break
+            images.append(img)
+        cap.release()
+    if not images:
+        raise SystemExit(f"No frames could be read from {path}")
+    images = [cv2.resize(img, CAMERA_SIZE, interpolation=cv2.INTER_NEAREST) for img in images]
+    return [images[i % len(images)] for i in range(count)]  # loop short recordings
+
+
+def legacy_detect(raw, thresholds, kernel, timer, draw=True):
+    # the original main_loop, stage by stage
+    img = raw.copy()
+    timer.lap('copy')
+    resized = cv2.resize(img, CAMERA_SIZE, interpolation=cv2.INTER_NEAREST)
+    timer.lap('resize')
+    blurred = cv2.GaussianBlur(resized, (3, 3), 3)
+    timer.lap('blur')
+    lab = cv2.cvtColor(blurred, cv2.COLOR_BGR2LAB)
+    timer.lap('cvtColor')
+    mask = cv2.inRange(lab, *thresholds['green'])
+    timer.lap('inRange')
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    timer.lap('morphology')
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
+    timer.lap('findContours')
+    ranked = sorted(((c, abs(cv2.contourArea(c))) for c in contours), key=lambda ca: ca[1], reverse=True)
+    timer.lap('sort')
+    if draw:
+        if ranked and ranked[0][1] > 300:
+            box = np.intp(cv2.boxPoints(cv2.minAreaRect(ranked[0][0])))
+            cv2.drawContours(img, [box], -1, (0, 255, 0), 2)
+        cv2.putText(img, "Color: green", (10, img.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (0, 255, 0), 2)
+        cv2.putText(img, "fps: 30.0", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.65, (0, 0, 0), 2)
+        cv2.resize(img, (320, 240))
+        timer.lap('draw')
+    return ranked[0] if ranked else (None, 0)
+
+
+def vision_detect(raw, pipe, renderer, timer, draw=True):
+    blurred = pipe.prepare(raw)
+    timer.lap('prepare')
+    mask = pipe.threshold(blurred, 'green')
+    timer.lap('threshold')
+    mask = pipe.clean(mask)
+    timer.lap('morphology')
+    found = vision.find_contours(mask)
+    timer.lap('findContours')
+    if draw:
+        canvas = renderer.canvas(raw)
+        if found and found[0][1] > 300:
+            box = np.intp(cv2.boxPoints(cv2.minAreaRect(found[0][0])) * renderer.scale)
+            cv2.drawContours(canvas, [box], -1, (0, 255, 0), 2)
+        renderer.publish(canvas)
+        timer.lap('draw')
+    return found[0] if found else (None, 0)
+
+
+class NullConsumer:
+    active = True
+
+    def consume(self, image):
+        pass
+
+
+def make_runner(path, lab_data, draw, cfg_dir):
+    """Return detect(raw, timer) for one path."""
+    thresholds = colorlut.lab_thresholds(lab_data)
+    kernel = np.ones((3, 3), np.uint8)
+    renderer = render.Renderer((320, 240), CAMERA_SIZE)
+    renderer.subscribe(NullConsumer())
+    if path == 'legacy':
+        return lambda raw, timer: legacy_detect(raw, thresholds, kernel, timer, draw)
+    if path in ('vision', 'vision_nolut'):
+        lut = colorlut.ColorLUT.from_config(lab_data) if path == 'vision' else None
+        pipe = vision.VisionPipeline(thresholds, size=CAMERA_SIZE, open_kernel=kernel, close_kernel=kernel, lut=lut)
+        return lambda raw, timer: vision_detect(raw, pipe, renderer, timer, draw)
+    if path == 'main_loop':
+        import milling_controller as mc
+        lab_path, servo_path = cfg_dir / 'lab_config.yaml', cfg_dir / 'servo_config.yaml'
+        program = mc.BinaryProgram(lab_cfg_path=lab_path, servo_cfg_path=servo_path, startup_beep=False,
+                                   exit_on_stop=False, standin_camera=True)
+        program.renderer.consumers = []  # no window, even if this machine could show one
+        if draw:
+            program.renderer.subscribe(NullConsumer())
+        program.frames = frames.FrameSource()
+
+        def detect(raw, timer):
+            program.frames.publish(raw)
+            timer.lap('publish')
+            program.main_loop()
+            timer.lap('main_loop')
+        return detect
+    raise ValueError(path)
+
+
+def bench_path(path, images, lab_data, args, cfg_dir):
+    detect = make_runner(path, lab_data, not args.no_draw, cfg_dir)
+    null = NullTimer()
+    for raw in images[:args.warmup]:
+        detect(raw, null)
+
+    timer = StageTimer()
+    t0 = time.perf_counter_ns()
+    for raw in images:
+        timer.start()
+        detect(raw, timer)
+        timer.stop()
+    elapsed = (time.perf_counter_ns() - t0) / 1E9
+
+    # separate pass, since tracemalloc slows everything down
+    allocated = []
+    tracemalloc.start()
+    for raw in images[:args.alloc_frames]:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        detect(raw, null)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return {
+        'frames': len(images),
+        'fps': len(images) / elapsed,
+        'latency_ms': percentiles_ms(timer.totals),
+        'stages_ms': {stage: percentiles_ms(ns) for stage, ns in timer.stages.items()},
+        'alloc_bytes_per_frame': {'median': float(np.median(allocated)), 'max': int(max(allocated))},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change from baseline for each path. Returns a list of regressions."""
+    regressions = []
+    for path, now in results['paths'].items():
+        then = baseline.get('paths', {}).get(path)
+        if then is None:
+            continue
+        checks = [
+            ('fps', then['fps'], now['fps'], -1),  # lower is worse
+            ('p95 ms', then['latency_ms']['p95'], now['latency_ms']['p95'], 1),
+            ('alloc B', then['alloc_bytes_per_frame']['median'], now['alloc_bytes_per_frame']['median'], 1),
+        ]
+        for name, old, new, worse in checks:
+            change = (new - old) / old if old else 0.0
+            flag = ''
+            if worse * change > tolerance and not (name == 'alloc B' and new - old < 1024):
+                flag = '  <-- REGRESSION'
+                regressions.append(f"{path} {name}: {old:.4g} -> {new:.4g}")
+            print(f"{path:>13} {name:>8}: {old:10.4g} -> {new:10.4g} ({change:+.1%}){flag}")
+    return regressions
+
+
+def print_results(results):
+    for path, r in results['paths'].items():
+        lat = r['latency_ms']
+        print(f"{path}: {r['fps']:.1f} fps, latency p50 {lat['p50']:.2f} p95 {lat['p95']:.2f} "
+              f"p99 {lat['p99']:.2f} ms, {r['alloc_bytes_per_frame']['median']:.0f} B allocated/frame")
+        for stage, s in r['stages_ms'].items():
+            print(f"    {stage:>13}: {s['mean']:7.3f} ms mean, {s['p95']:7.3f} p95")
+
+
+def get_parser(parser, subparsers=None):
+    parser.add_argument("--paths", nargs='+', choices=PATHS, default=list(PATHS))
+    parser.add_argument("--frames", default=None, help="video file or directory of images (default: synthetic)")
+    parser.add_argument("--count", type=int, default=300, help="frames to time per path")
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--alloc_frames", type=int, default=50, help="frames to trace allocations over")
+    parser.add_argument("--specks", type=int, default=0, help="noise specks per synthetic frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lab_config", default=None, help="lab_config.yaml (default: TurboPi's stock config)")
+    parser.add_argument("--no_draw", action='store_true', help="leave out annotation, as when headless")
+    parser.add_argument("--out", default=None, help="write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against results from a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change that counts as a regression")
+    return parser, subparsers
+
+
+def main(args):
+    standins.install(force=True)  # never drive real motors from a benchmark
+    cv2.setRNGSeed(args.seed)
+    if args.lab_config:
+        with open(args.lab_config, 'r', encoding='utf-8') as f:
+            lab_data = yaml.safe_load(f)
+    else:
+        lab_data = DEFAULT_LAB_CONFIG
+    if args.frames:
+        images = recorded_frames(args.frames, args.count)
+    else:
+        images = synthetic_frames(args.count, args.specks, args.seed)
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cv2': cv2.__version__,
+            'numpy': np.__version__,
+            'cv2_threads': cv2.getNumThreads(),
+            'frames': args.frames or f"synthetic, {args.specks} specks, seed {args.seed}",
+            'count': args.count,
+            'draw': not args.no_draw,
+        },
+        'paths': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg_dir = pl.Path(tmp)
+        with open(cfg_dir / 'lab_config.yaml', 'w') as f:
+            yaml.safe_dump(lab_data, f)
+        with open(cfg_dir / 'servo_config.yaml', 'w') as f:
+            yaml.safe_dump({'servo1': 1500, 'servo2': 1500}, f)
+        for path in args.paths:
+            results['paths'][path] = bench_path(path, images, lab_data, args, cfg_dir)
+
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the vision hot path.")
+    get_parser(parser)
+    sys.exit(main(parser.parse_args()))
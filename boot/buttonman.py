@@ -18,6 +18,10 @@ try:
     import statemachine
 except ImportError:
     statemachine = None
+try:
+    import zygote
+except ImportError:
+    zygote = None
 
 import RPi.GPIO as GPIO
 
@@ -80,6 +84,33 @@ def try_script(path):
     subprocess.Popen(path)
 
 
+zygote_process = None
+
+
+def start_zygote():
+    # Keep a prewarmed process to fork programs from, if zygote.json says which. See zygote.py
+    # (Re)starts it if it isn't running. Returns the zygote config, or None if there isn't one.
+    global zygote_process
+    config = zygote.load_config() if zygote else None
+    if config is not None and (zygote_process is None or zygote_process.poll() is not None):
+        zygote_process = zygote.start()
+    return config
+
+
+def launch_program(name):
+    # Start /home/pi/{name}.sh, or fork it from the zygote if it's configured there.
+    config = start_zygote()
+    if config is not None and name in config.get('programs', {}):
+        try:
+            pid = zygote.spawn(name)
+        except (OSError, RuntimeError) as err:  # e.g. still preloading
+            print(f"Couldn't start {name} from the zygote ({err}). Running {name}.sh instead.")
+        else:
+            print(f"Started {name} from the zygote as pid {pid}")
+            return
+    try_script(f"/home/pi/{name}.sh")
+    print(f"Started {name}.sh")
+
 
 class ProcessMismatchError(Exception):
     pass
@@ -398,12 +429,10 @@ class ActionMachine(statemachine.StateMachine):
     enable = lambda: None  # noqa: E731
 
     def do_1c(self):
-        try_script("/home/pi/program1.sh")
-        print("Started program1.sh")
+        launch_program("program1")
 
     def do_2c(self):
-        try_script("/home/pi/program2.sh")
-        print("Started program2.sh")
+        launch_program("program2")
 
     def do_3c(self):
         # subprocess.Popen("sudo python3 /home/pi/boot/battchk.py".split(' '))
@@ -448,12 +477,10 @@ class ActionMachine(statemachine.StateMachine):
         ButtonManager.ap_beep()
 
     def do_5c(self):
-        try_script("/home/pi/program5.sh")
-        print("Started program5.sh")
+        launch_program("program5")
 
     def do_6c(self):
-        try_script("/home/pi/program6.sh")
-        print("Started program6.sh")
+        launch_program("program6")
 
 
 class ButtonManager:
@@ -620,6 +647,7 @@ class ButtonManager:
 
 if __name__ == "__main__":
     manager = ButtonManager()
+    start_zygote()  # preloads while we do the bootup check
     manager.bootup_check()
     manager.initialize_edge_listeners()
     try:
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Prewarmed launcher for buttonman's programs.
+
+Starting a program from a button press normally means a shell script
+starting a fresh interpreter, which then spends seconds importing cv2,
+numpy and the SDK. The zygote does all of that once, at boot, then waits on
+a unix socket. When buttonman asks for a program, the zygote forks, and the
+child calls the program's entry point right away. Children share the
+zygote's memory pages until they write to them; gc.freeze() keeps the
+garbage collector from writing to all of them.
+
+Programs are configured in zygote.json (see zygote.example.json). Without
+it there's no zygote, and buttonman runs the scripts as before:
+
+{
+    "sys_path": ["/home/pi/TurboPi/", "/home/pi/boot/", "/home/pi/"],
+    "preload": ["numpy", "cv2", "HiwonderSDK.Board"],
+    "programs": {
+        "program1": {"entry": "milling_controller:cli", "argv": ["--startpaused"], "cwd": "/home/pi"}
+    }
+}
+
+An entry point is "module:callable", called as callable(argv). Entry
+modules are imported by the zygote too, so they should have no side effects
+at import (no threads, no opened hardware) beyond importing.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import importlib
+import subprocess
+
+CONFIG_PATH = '/home/pi/boot/zygote.json'
+SOCKET_PATH = '/tmp/buttonman/.zygote.sock'  # dotfile, so TaskManager.close_all_registered() skips it
+
+
+def load_config(path=CONFIG_PATH):
+    # None if there's no config, which means no zygote
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def resolve(entry):
+    # "module:attr.attr" -> the object
+    module_name, _, attr = entry.partition(':')
+    obj = importlib.import_module(module_name)
+    for name in attr.split('.') if attr else ('main',):
+        obj = getattr(obj, name)
+    return obj
+
+
+def preload(config):
+    for path in config.get('sys_path', []):
+        if path not in sys.path:
+            sys.path.append(path)
+    names = list(config.get('preload', []))
+    names += [program['entry'].partition(':')[0] for program in config.get('programs', {}).values()]
+    for name in dict.fromkeys(names):  # in order, once each
+        t = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as err:  # the program will fail (and say why) when it's started instead
+            print(f"zygote: couldn't preload {name}: {type(err).__name__}: {err}")
+        else:
+            print(f"zygote: preloaded {name} in {time.perf_counter() - t:.2f}s")
+
+
+def reap():
+    # collect exited children, so they don't linger as zombies
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def reply(conn, **message):
+    try:
+        conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    except OSError:
+        pass
+
+
+def serve(config, socket_path=SOCKET_PATH):
+    # Fork programs on request, until our parent (buttonman) goes away.
+    # Returns (name, program config) in a forked child, which should then run it. Returns None in the zygote.
+    programs = config.get('programs', {})
+    parent = os.getppid()
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    inode = os.stat(socket_path).st_ino
+    server.listen(4)
+    server.settimeout(1.0)
+    gc.freeze()  # everything loaded so far is never collected, so the GC won't dirty the shared pages
+    print(f"zygote: ready at {socket_path}", flush=True)
+
+    try:
+        while os.getppid() == parent:
+            reap()
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                conn.settimeout(1.0)
+                try:
+                    name = json.loads(conn.makefile('r', encoding='utf-8').readline())['program']
+                    program = programs[name]
+                except (OSError, ValueError, KeyError, TypeError) as err:
+                    reply(conn, error=f"bad request: {type(err).__name__}: {err}")
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    return name, program  # (closing the server socket on the way out)
+                print(f"zygote: started {name} as pid {pid}", flush=True)
+                reply(conn, pid=pid)
+    finally:
+        server.close()
+    # don't remove a newer zygote's socket
+    try:
+        if os.stat(socket_path).st_ino == inode:
+            os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def run(name, program):
+    # in the forked child
+    os.setsid()  # signals to the zygote's process group shouldn't reach us
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if program.get('cwd'):
+        os.chdir(program['cwd'])
+    argv = [str(arg) for arg in program.get('argv', [])]
+    sys.argv = [program.get('argv0', name)] + argv
+    return resolve(program['entry'])(argv)
+
+
+def start(config_path=CONFIG_PATH, socket_path=SOCKET_PATH):
+    # start a zygote process, which will be ready once it's done preloading
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--config', config_path, '--socket', socket_path])
+
+
+def spawn(name, socket_path=SOCKET_PATH, timeout=2.0):
+    # Ask the zygote to start program name. Returns its pid.
+    # Raises OSError if there's no zygote (yet), or RuntimeError if it couldn't start the program.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_path)
+        s.sendall(json.dumps({'program': name}).encode('utf-8') + b'\n')
+        line = s.makefile('r', encoding='utf-8').readline()
+    try:
+        response = json.loads(line)
+    except ValueError:
+        raise RuntimeError(f"zygote gave no answer for {name}") from None
+    if 'pid' not in response:
+        raise RuntimeError(response.get('error', f"zygote couldn't start {name}"))
+    return response['pid']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if config is None:
+        print(f"zygote: no config at {args.config}")
+        return 1
+    os.makedirs(os.path.dirname(args.socket), exist_ok=True)
+    preload(config)
+    child = serve(config, args.socket)
+    if child is None:
+        return 0
+    # In the child. We've returned all the way out of serve(), so the program runs on a clean stack
+    # and exits like any other: atexit handlers run, and non-daemon threads are waited for.
+    return run(*child)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
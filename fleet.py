@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Send a command to a whole fleet of robots at once, and make sure it landed.
+
+Commands go out to every robot concurrently over the binary command protocol
+(see hiwonder_common/commands.py), and are resent to any robot that hasn't
+acknowledged them within --timeout, up to --retries times. Each robot's
+round-trip time (from the last send to its ack) is reported, with
+percentiles over --repeat rounds.
+
+Robots are given as host or host:port (default port 27272), or found with
+--discover, which listens for their telemetry (see swarm_monitor.py; robots
+only send it when started with --telemetry_rate).
+
+--stress measures how many commands per second each robot's command server
+absorbs: it keeps --window pings in flight per robot for that many seconds,
+without retries, and reports acks per second, losses and round-trip times.
+
+--at SECONDS has every robot pause or resume at the same instant, that many
+seconds from now, instead of whenever the command happens to arrive. First
+each robot's clock offset is estimated from --samples CLOCK round trips,
+then each is sent the time on its own clock (see
+hiwonder_common/clocksync.py). The clock command just prints the offsets.
+
+--local N starts N stand-in command servers on loopback, in this process,
+and adds them to the targets, for trying all of this without robots.
+
+Examples:
+python3 fleet.py pause 192.168.1.50 192.168.1.51
+python3 fleet.py --discover 3 stop
+python3 fleet.py --repeat 100 ping robot1 robot2
+python3 fleet.py --at 3 resume robot1 robot2 robot3
+python3 fleet.py --local 4 --stress 5 ping
+"""
+
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import itertools
+from typing import NamedTuple
+
+import numpy as np
+
+from hiwonder_common import commands
+from hiwonder_common import clocksync
+from hiwonder_common import telemetry
+
+DEFAULT_PORT = 27272
+SCHEDULED = {commands.RESUME: commands.RESUME_AT, commands.PAUSE: commands.PAUSE_AT}
+
+
+class Result(NamedTuple):
+    addr: tuple
+    status: int  # commands.OK etc, or None if never acknowledged
+    payload: bytes
+    rtt: float  # seconds from the last send to the ack, or None
+    attempts: int
+
+
+class Fleet(asyncio.DatagramProtocol):
+    def __init__(self, magic=commands.MAGIC, timeout=0.2, retries=5):
+        self.magic = magic
+        self.timeout = timeout
+        self.retries = retries
+        self.transport = None
+        self.pending = {}  # (addr, seq) -> future of (status, payload, ack time)
+        self.seq = itertools.count(int(time.time() * 1000) & 0xFFFFFFF)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            _, status, seq, payload = commands.decode(data, self.magic)
+        except ValueError:
+            return
+        future = self.pending.pop((addr[:2], seq), None)
+        if future is not None and not future.done():
+            future.set_result((status, payload, time.perf_counter()))
+
+    async def send(self, addr, opcode, payload=b'', retries=None):
+        """Send a command to addr until it's acknowledged. Never raises; see Result."""
+        retries = self.retries if retries is None else retries
+        seq = next(self.seq) & 0xFFFFFFFF
+        data = commands.encode(opcode, seq, payload, self.magic)
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        try:
+            for attempt in range(1, retries + 2):
+                future = self.pending[(addr, seq)] = loop.create_future()
+                t_sent = time.perf_counter()
+                self.transport.sendto(data, addr)
+                try:
+                    status, reply, t_ack = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+                return Result(addr, status, reply, t_ack - t_sent, attempt)
+        finally:
+            self.pending.pop((addr, seq), None)
+        return Result(addr, None, b'', None, attempt)
+
+    async def fan_out(self, targets, opcode, payload=b''):
+        return await asyncio.gather(*(self.send(addr, opcode, payload) for addr in targets))
+
+
+def resolve(target):
+    host, _, port = target.rpartition(':') if ':' in target else (target, '', '')
+    port = int(port) if port else DEFAULT_PORT
+    info = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)
+    return info[0][4][:2]
+
+
+def discover(seconds, port=DEFAULT_PORT):
+    # robots announce themselves with telemetry. Returns [(ip, port)]
+    receiver = telemetry.TelemetryReceiver()
+    found = {}
+    deadline = time.monotonic() + seconds
+    try:
+        while (remaining := deadline - time.monotonic()) > 0:
+            addr, status = receiver.recv(timeout=remaining)
+            if status is not None and addr[0] not in found:
+                found[addr[0]] = status.name
+                print(f"Found {status.name} at {addr[0]}")
+    finally:
+        receiver.close()
+    return [(ip, port) for ip in found]
+
+
+class StandIn:
+    # a robot's command server on loopback, that answers every command and keeps the time
+    def __init__(self):
+        self.scheduler = clocksync.Scheduler().start()
+        self.fired = []  # time.time_ns() when each scheduled command ran
+        handlers = {opcode: (lambda payload: None) for opcode in commands.OPCODES.values()}
+        handlers[commands.CLOCK] = clocksync.clock_reply
+        handlers[commands.RESUME_AT] = handlers[commands.PAUSE_AT] = self.schedule
+        self.server = commands.CommandServer(handlers, 0, '127.0.0.1').start()
+        self.addr = ('127.0.0.1', self.server.port)
+
+    def schedule(self, payload):
+        in_ns = self.scheduler.at(clocksync.decode_time(payload), lambda: self.fired.append(time.time_ns()))
+        return {'in_ms': round(in_ns / 1E6, 3)}
+
+    def close(self):
+        self.server.close()
+        self.scheduler.close()
+
+
+def percentiles(rtts):
+    ms = np.array(rtts) * 1000
+    p50, p90, p99 = np.percentile(ms, (50, 90, 99))
+    return f"rtt p50 {p50:.2f} p90 {p90:.2f} p99 {p99:.2f} max {ms.max():.2f} ms"
+
+
+def describe(result):
+    if result.status is None:
+        return f"no ack after {result.attempts} tries"
+    text = 'ok' if result.status == commands.OK else f"status {result.status}"
+    text += f" in {result.rtt * 1000:.2f} ms" + (f" ({result.attempts} tries)" if result.attempts > 1 else '')
+    if result.payload:
+        text += f": {result.payload.decode('utf-8', 'replace')}"
+    return text
+
+
+async def measure_clock(fleet, addr, samples):
+    """The clocksync.Sample with the shortest round trip, or None if the robot didn't answer."""
+    found = []
+    for _ in range(samples):
+        t_sent = time.time_ns()
+        # no resends: a resent CLOCK would be answered from the server's reply cache, with a stale time
+        result = await fleet.send(addr, commands.CLOCK, retries=0)
+        if result.status == commands.OK:
+            t_remote = clocksync.decode_time(result.payload)
+            found.append(clocksync.sample(t_sent, t_remote, t_sent + int(result.rtt * 1E9)))
+    return clocksync.best(found) if found else None
+
+
+async def measure_clocks(fleet, targets, samples):
+    clocks = await asyncio.gather(*(measure_clock(fleet, addr, samples) for addr in targets))
+    for addr, clock in zip(targets, clocks):
+        if clock is None:
+            print(f"{addr[0]}:{addr[1]}: no answer, clock unknown")
+        else:
+            print(f"{addr[0]}:{addr[1]}: clock offset {clock.offset / 1E6:+.2f} ms, round trip {clock.delay / 1E6:.2f} ms")
+    return dict(zip(targets, clocks))
+
+
+async def scheduled(fleet, targets, opcode, delay, samples, standins):
+    # every robot runs opcode at the same instant, delay seconds from now
+    clocks = await measure_clocks(fleet, targets, samples)
+    reachable = [addr for addr in targets if clocks[addr] is not None]
+    t_at = time.time_ns() + int(delay * 1E9)
+    results = await asyncio.gather(*(
+        fleet.send(addr, SCHEDULED[opcode], clocksync.encode_time(t_at + clocks[addr].offset))
+        for addr in reachable))
+    for result in results:
+        print(f"{result.addr[0]}:{result.addr[1]}: {describe(result)}")
+    if standins:
+        await asyncio.sleep(max(0.0, (t_at - time.time_ns()) / 1E9) + 0.05)
+        fired = [t - t_at for standin in standins for t in standin.fired]
+        if fired:
+            print(f"stand-ins ran it {(max(fired) - min(fired)) / 1E6:.3f} ms apart, "
+                  f"{np.mean(fired) / 1E6:.3f} ms after the target time on average")
+    return len(reachable) == len(targets) and all(r.status == commands.OK for r in results)
+
+
+async def run_rounds(fleet, targets, opcode, repeat, verbose):
+    results = {addr: [] for addr in targets}
+    for _ in range(repeat):
+        for result in await fleet.fan_out(targets, opcode):
+            results[result.addr].append(result)
+    all_acked = True
+    for addr, rs in results.items():
+        acked = [r for r in rs if r.status is not None]
+        all_acked &= len(acked) == len(rs)
+        name = f"{addr[0]}:{addr[1]}"
+        if repeat == 1 or verbose:
+            for r in rs:
+                print(f"{name}: {describe(r)}")
+        if repeat > 1:
+            tries = sum(r.attempts for r in rs)
+            summary = percentiles([r.rtt for r in acked]) if acked else "no acks"
+            print(f"{name}: {len(acked)}/{len(rs)} acked ({tries} sent), {summary}")
+    return all_acked
+
+
+async def stress(fleet, targets, opcode, seconds, window):
+    stats = {addr: {'acked': 0, 'lost': 0, 'rtts': []} for addr in targets}
+    deadline = time.perf_counter() + seconds
+
+    async def worker(addr):
+        s = stats[addr]
+        while time.perf_counter() < deadline:
+            result = await fleet.send(addr, opcode, retries=0)
+            if result.status is None:
+                s['lost'] += 1
+            else:
+                s['acked'] += 1
+                s['rtts'].append(result.rtt)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(addr) for addr in targets for _ in range(window)))
+    elapsed = time.perf_counter() - t0
+    total = 0
+    for addr, s in stats.items():
+        total += s['acked']
+        summary = percentiles(s['rtts']) if s['rtts'] else "no acks"
+        print(f"{addr[0]}:{addr[1]}: {s['acked'] / elapsed:.0f} commands/s, {s['lost']} lost, {summary}")
+    print(f"fleet: {total / elapsed:.0f} commands/s over {len(targets)} robots, {window} in flight each")
+    return all(s['lost'] == 0 for s in stats.values())
+
+
+async def amain(args, targets, standins=()):
+    loop = asyncio.get_running_loop()
+    transport, fleet = await loop.create_datagram_endpoint(
+        lambda: Fleet(timeout=args.timeout, retries=args.retries), local_addr=('0.0.0.0', 0))
+    try:
+        opcode = commands.OPCODES[args.command]
+        if opcode == commands.CLOCK:
+            clocks = await measure_clocks(fleet, targets, args.samples)
+            return all(clock is not None for clock in clocks.values())
+        if args.at is not None:
+            return await scheduled(fleet, targets, opcode, args.at, args.samples, standins)
+        if args.stress:
+            return await stress(fleet, targets, opcode, args.stress, args.window)
+        return await run_rounds(fleet, targets, opcode, args.repeat, args.verbose)
+    finally:
+        transport.close()
+
+
+def get_parser(parser, subparsers=None):
+    # the *_at commands are what --at sends
+    parser.add_argument("command", choices=sorted(name for name in commands.OPCODES if not name.endswith('_at')))
+    parser.add_argument("targets", nargs='*', help="robots, as host or host:port")
+    parser.add_argument("--discover", type=float, default=None,
+                        help="also add robots heard from over telemetry within this many seconds")
+    parser.add_argument("--local", type=int, default=0, help="start this many stand-in robots on loopback")
+    parser.add_argument("--timeout", type=float, default=0.2, help="seconds to wait for an ack before resending")
+    parser.add_argument("--retries", type=int, default=5, help="resends before giving up on a robot")
+    parser.add_argument("--repeat", type=int, default=1, help="rounds, for round-trip percentiles")
+    parser.add_argument("--stress", type=float, default=None, help="send as fast as acked for this many seconds")
+    parser.add_argument("--window", type=int, default=8, help="with --stress, commands in flight per robot")
+    parser.add_argument("--at", type=float, default=None,
+                        help="with pause or resume, every robot does it at once, this many seconds from now")
+    parser.add_argument("--samples", type=int, default=8, help="round trips for estimating each robot's clock")
+    parser.add_argument("--verbose", action='store_true', help="print every reply, not just summaries")
+    return parser, subparsers
+
+
+def main(args):
+    if args.at is not None and commands.OPCODES[args.command] not in SCHEDULED:
+        print("Only pause and resume can be scheduled with --at.", file=sys.stderr)
+        return 2
+    targets = [resolve(target) for target in args.targets]
+    if args.discover:
+        targets += [addr for addr in discover(args.discover) if addr not in targets]
+    standins = [StandIn() for _ in range(args.local)]
+    targets += [standin.addr for standin in standins]
+    if not targets:
+        print("No robots to send to.", file=sys.stderr)
+        return 2
+    try:
+        ok = asyncio.run(amain(args, targets, standins))
+    finally:
+        for standin in standins:
+            standin.close()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    get_parser(parser)
+    sys.exit(main(parser.parse_args()))
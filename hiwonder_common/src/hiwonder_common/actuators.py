@@ -0,0 +1,142 @@
+"""
+Coalesced writes to the chassis motors and the expansion board's RGB LEDs.
+
+The control loop says what the actuators should be doing every frame, but
+that rarely changes from one frame to the next. Every set_velocity() is an
+I2C write to the motor driver, and every LED update is two setPixelColor()
+calls and a show(). Those writes take loop time and bus bandwidth that the
+vision path could use. The wrappers here sit in front of the hardware and:
+
+- drop writes that wouldn't change anything (but repeat the current command
+  every `refresh` seconds, in case a write was lost),
+- send at most one write per `min_interval` seconds per device. A change
+  that comes too soon is held, and the newest held command goes out on the
+  next call after the interval, or on flush(). Callers should flush() while
+  they aren't sending anything, so a held command isn't left unsent,
+- always send stop commands straight away, ahead of anything held. Repeated
+  stops are dropped like any other repeat, unless forced.
+
+They're safe to call from several threads.
+
+Example:
+chassis = CoalescingChassis(mecanum.MecanumChassis())
+chassis.set_velocity(100, 90, 0.5)  # written
+chassis.set_velocity(100, 90, 0.5)  # dropped
+chassis.stop()  # written, however recently the last command was
+leds = CoalescingPixels(Board)
+leds.set_all((0, 255, 0))
+"""
+
+import time
+import threading
+
+STOP = (0, 0, 0)
+
+
+class Coalescer:
+    """Send the newest command to a device, skipping repeats and limiting the write rate."""
+
+    def __init__(self, write, min_interval=0.0, refresh=None):
+        """
+        write: called as write(command) to send a command to the device
+        min_interval: minimum seconds between writes, except forced ones
+        refresh: resend an unchanged command after this many seconds (None: never)
+        """
+        self.write = write
+        self.min_interval = min_interval
+        self.refresh = refresh
+        self.sent = None  # the last command written, None until the first
+        self.pending = None  # newest command not yet written
+        self.writes = self.dropped = self.deferred = 0
+        self._t_sent = float('-inf')
+        self._lock = threading.Lock()
+
+    def submit(self, command, force=False, urgent=False):
+        """
+        Ask for command to be sent. Returns True if it was written now.
+
+        force: write it now, even if it's a repeat
+        urgent: write it now unless it's a repeat, ignoring the rate limit
+        """
+        with self._lock:
+            self.pending = command
+            return self._flush(time.monotonic(), force, urgent)
+
+    def flush(self, force=False):
+        """Write the held command, if there is one and it's time. Returns True if it was written."""
+        with self._lock:
+            return self._flush(time.monotonic(), force)
+
+    def _flush(self, now, force, urgent=False):
+        command = self.pending
+        if command is None:
+            return False
+        if not force:
+            since = now - self._t_sent
+            if command == self.sent and (self.refresh is None or since < self.refresh):
+                self.pending = None
+                self.dropped += 1
+                return False
+            if since < self.min_interval and not urgent:
+                self.deferred += 1  # stays pending
+                return False
+        self.write(command)
+        self.sent, self.pending, self._t_sent = command, None, now
+        self.writes += 1
+        return True
+
+    def stats(self):
+        return {'writes': self.writes, 'dropped': self.dropped, 'deferred': self.deferred}
+
+
+class CoalescingChassis:
+    """In front of a HiwonderSDK.mecanum.MecanumChassis."""
+
+    def __init__(self, chassis, min_interval=0.03, refresh=0.5):
+        self.chassis = chassis
+        self.coalescer = Coalescer(lambda command: chassis.set_velocity(*command), min_interval, refresh)
+
+    def set_velocity(self, velocity, direction, angular_rate):
+        if not velocity and not angular_rate:
+            return self.stop()
+        return self.coalescer.submit((velocity, direction, angular_rate))
+
+    def stop(self, force=False):
+        """Stop the motors now, rate limit or not. Unless forced, only if they might be moving."""
+        return self.coalescer.submit(STOP, force, urgent=True)
+
+    def flush(self):
+        return self.coalescer.flush()
+
+    def stats(self):
+        return self.coalescer.stats()
+
+
+class CoalescingPixels:
+    """In front of a HiwonderSDK.Board's RGB LEDs."""
+
+    def __init__(self, board, n=2, min_interval=0.1, refresh=None):
+        self.board = board
+        self.n = n
+        self.coalescer = Coalescer(self._write, min_interval, refresh)
+
+    def _write(self, colors):
+        sent = self.coalescer.sent
+        changed_only = sent is not None and sent != colors  # a refresh or forced write sets them all
+        for i, (r, g, b) in enumerate(colors):
+            if not changed_only or sent[i] != colors[i]:
+                self.board.RGB.setPixelColor(i, self.board.PixelColor(r, g, b))
+        self.board.RGB.show()
+
+    def set(self, colors, force=False):
+        """colors: an (r, g, b) for each LED"""
+        return self.coalescer.submit(tuple(tuple(color) for color in colors), force)
+
+    def set_all(self, rgb, force=False):
+        return self.set((rgb,) * self.n, force)
+
+    def flush(self):
+        return self.coalescer.flush()
+
+    def stats(self):
+        return self.coalescer.stats()
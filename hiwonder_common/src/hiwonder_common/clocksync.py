@@ -0,0 +1,136 @@
+"""
+Scheduled commands, synchronized across the fleet.
+
+A command that's acted on when it arrives (like RESUME) reaches each robot
+after a different network delay. Instead, a coordinator (fleet.py --at)
+estimates each robot's clock offset, and tells every robot to act at the
+same instant, converted to that robot's own clock (RESUME_AT, PAUSE_AT).
+
+Offsets are estimated NTP-style over the command protocol: the coordinator
+notes its clock when it sends a CLOCK command (t0) and when the reply
+arrives (t1), and the robot replies with its clock when it got the command.
+If the two legs of the round trip took equally long, the robot read its
+clock at our (t0 + t1) / 2. The error is at most half the round trip, so
+take several samples and keep the one with the shortest round trip.
+
+Robots run scheduled actions from a Scheduler thread, which sleeps until
+each one is due (no polling).
+
+Example:
+# on the robot
+scheduler = Scheduler().start()
+handlers = {CLOCK: clock_reply, RESUME_AT: lambda payload: scheduler.at(decode_time(payload), resume)}
+# on the coordinator
+t0 = time.time_ns()
+t_robot = decode_time(client.send(CLOCK))
+s = sample(t0, t_robot, time.time_ns())
+client.send(RESUME_AT, encode_time(t_start + s.offset))
+"""
+
+import time
+import heapq
+import struct
+import itertools
+import threading
+from typing import NamedTuple
+
+TIME = struct.Struct('!q')  # time.time_ns()
+
+
+def encode_time(ns):
+    return TIME.pack(int(ns))
+
+
+def decode_time(payload):
+    if len(payload) != TIME.size:
+        raise ValueError(f"expected a {TIME.size} byte time, got {len(payload)} bytes")
+    return TIME.unpack(payload)[0]
+
+
+def clock_reply(payload=b''):
+    """The handler for CLOCK commands: our clock, now."""
+    return encode_time(time.time_ns())
+
+
+class Sample(NamedTuple):
+    offset: int  # their clock minus ours, ns
+    delay: int  # round trip, ns
+
+
+def sample(t_sent, t_remote, t_received):
+    """A Sample from our clock when we asked (t_sent) and got the answer (t_received), and theirs in between."""
+    return Sample(t_remote - (t_sent + t_received) // 2, t_received - t_sent)
+
+
+def best(samples):
+    # NTP's clock filter: the shortest round trip has the least room for asymmetry
+    return min(samples, key=lambda s: s.delay)
+
+
+class Scheduler:
+    """Run actions at given times, in a thread of their own."""
+
+    def __init__(self):
+        self._queue = []  # heap of (monotonic_ns due, tiebreak, action)
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self.late_ns = 0  # how late the last action started
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def at(self, time_ns, action):
+        """
+        Run action() when time.time_ns() reaches time_ns (at once if it already has).
+        Returns the ns until then (negative if it's already late).
+        """
+        # Wall clocks can be stepped, so wait on the monotonic clock from here on.
+        remaining = time_ns - time.time_ns()
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic_ns() + remaining, next(self._order), action))
+            self._cond.notify()
+        return remaining
+
+    def cancel(self):
+        """Drop everything that's still waiting. Returns how many were dropped."""
+        with self._cond:
+            dropped = len(self._queue)
+            self._queue.clear()
+            self._cond.notify()
+        return dropped
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    remaining = self._queue[0][0] - time.monotonic_ns()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining / 1E9)
+                if self._closed:
+                    return
+                due, _, action = heapq.heappop(self._queue)
+            self.late_ns = time.monotonic_ns() - due
+            try:
+                action()
+            except Exception as err:  # keep the rest of the schedule
+                print(f"Scheduled {action}: {type(err).__name__}: {err}")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
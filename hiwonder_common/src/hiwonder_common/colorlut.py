@@ -0,0 +1,184 @@
+"""
+Precomputed BGR -> color-mask lookup tables.
+
+Converting every frame to LAB and running cv2.inRange() once per color is
+one of the most expensive things we do per frame on the Pi. Since the LAB
+thresholds almost never change, we can instead evaluate every threshold for
+every (quantized) BGR value once, and store the result as a bitmask per color:
+
+    table[b, g, r] & (1 << i)  is set iff  BGR(b, g, r) in LAB is within color i
+
+Then thresholding a frame is a single vectorized indexing pass, which
+also gives us every color at once.
+
+Tables are cached on disk as .npy files keyed by a hash of the thresholds,
+and loaded memory-mapped, so restarts skip the rebuild. Each is 16 MB, and
+tuning the thresholds makes a new one every time, so only the KEEP_TABLES
+most recently used are kept.
+
+Example:
+lut = ColorLUT.from_config(get_yaml_data('lab_config.yaml'))
+mask = lut.mask(blurred_bgr_frame, 'green')  # same as inRange() on the LAB frame
+"""
+
+import os
+import json
+import hashlib
+import pathlib as pl
+
+import cv2
+import numpy as np
+
+KEEP_TABLES = 4  # cached tables to keep, most recently used first
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return pl.Path(base) / 'turbopi'
+
+
+def prune_cache(cache_dir, pattern, keep):
+    """Delete all but the keep most recently modified files matching pattern in cache_dir."""
+    def mtime(path):
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0  # deleted by someone else meanwhile
+    paths = sorted(pl.Path(cache_dir).glob(pattern), key=mtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            print(f"Couldn't remove old cache file {path}: {err}")
+
+
+def lab_thresholds(lab_data):
+    """Pick the {'min': [...], 'max': [...]} entries out of lab_config.yaml data, sorted by name."""
+    thresholds = {}
+    for name in sorted(lab_data):
+        entry = lab_data[name]
+        if isinstance(entry, dict) and 'min' in entry and 'max' in entry:
+            thresholds[name] = (tuple(int(x) for x in entry['min']),
+                                tuple(int(x) for x in entry['max']))
+    return thresholds
+
+
+def config_hash(thresholds, bits):
+    # cv2 version is included in case its BGR->LAB conversion ever changes
+    key = json.dumps([thresholds, bits, cv2.__version__], sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def mask_dtype(n_colors):
+    # cv2 has no unsigned 32-bit type, so we stop at 16 colors
+    for dtype in (np.uint8, np.uint16):
+        if n_colors <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"Can't fit {n_colors} colors in a lookup table (max 16).")
+
+
+def build_table(thresholds, bits=8):
+    """
+    Evaluate every LAB threshold for every quantized BGR value.
+
+    With bits=8 (default) the table covers every BGR value and gives exactly
+    the same masks as cvtColor() + inRange(). Fewer bits make a smaller table
+    (better for the cache) at the cost of evaluating each bin at its center.
+    """
+    levels = 1 << bits
+    shift = 8 - bits
+    values = ((np.arange(levels, dtype=np.uint16) << shift) + ((1 << shift) >> 1)).astype(np.uint8)
+    table = np.zeros((levels, levels, levels), mask_dtype(len(thresholds)))
+
+    # build one B plane at a time to keep memory use low on the Pi
+    plane = np.empty((levels, levels, 3), np.uint8)
+    plane[..., 1] = values[:, None]
+    plane[..., 2] = values[None, :]
+    lab = np.empty_like(plane)
+    hit = np.empty((levels, levels), np.uint8)
+    for bi, b in enumerate(values):
+        plane[..., 0] = b
+        cv2.cvtColor(plane, cv2.COLOR_BGR2LAB, dst=lab)
+        out = table[bi]
+        for i, (lo, hi) in enumerate(thresholds.values()):
+            cv2.inRange(lab, lo, hi, dst=hit)
+            out[hit != 0] |= 1 << i
+    return table
+
+
+class ColorLUT:
+    def __init__(self, table, colors, bits=8):
+        self.table = table
+        self.flat = table.reshape(-1)
+        self.colors = tuple(colors)
+        self.bits = bits
+        self.shift = 8 - bits
+        self.bit_of = {color: 1 << i for i, color in enumerate(self.colors)}
+
+    @classmethod
+    def from_config(cls, lab_data, bits=8, cache_dir=None):
+        """Load the table for this config from the disk cache, building it if needed."""
+        thresholds = lab_thresholds(lab_data)
+        cache_dir = default_cache_dir() if cache_dir is None else pl.Path(cache_dir)
+        path = cache_dir / f"lablut-{config_hash(thresholds, bits)}.npy"
+        try:
+            table = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError, OSError):
+            table = build_table(thresholds, bits)
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmp, 'wb') as f:
+                    np.save(f, table)
+                os.replace(tmp, path)  # atomic, so a half-written table is never loaded
+                prune_cache(cache_dir, 'lablut-*.npy', KEEP_TABLES)
+            except OSError as err:
+                print(f"Couldn't cache color lookup table to {path}: {err}")
+        else:
+            try:
+                os.utime(path)  # used, so it's kept over older tables
+            except OSError:
+                pass
+        return cls(table, thresholds.keys(), bits)
+
+    def __contains__(self, color):
+        return color in self.bit_of
+
+    def codes(self, frame, out=None, index=None, scratch=None):
+        """
+        Return the per-pixel color bitmask for a BGR frame.
+
+        out, index and scratch are optional preallocated buffers shaped like
+        one channel of frame. out has the table's dtype; index and scratch are
+        np.intp, since np.take() would convert any other index type.
+        """
+        shape = frame.shape[:2]
+        index = np.empty(shape, np.intp) if index is None else index
+        scratch = np.empty(shape, np.intp) if scratch is None else scratch
+        # index = ((b << bits | g) << bits) | r, built in place. Channels are widened
+        # with copyto() instead of inside the ufuncs, which would allocate casting buffers.
+        np.copyto(index, frame[..., 0])
+        if self.shift:
+            np.right_shift(index, self.shift, out=index)
+        for channel in (1, 2):
+            np.copyto(scratch, frame[..., channel])
+            if self.shift:
+                np.right_shift(scratch, self.shift, out=scratch)
+            np.left_shift(index, self.bits, out=index)
+            np.bitwise_or(index, scratch, out=index)
+        return self.flat.take(index, out=out, mode='clip')
+
+    def mask(self, frame, color, codes=None, out=None, scratch=None):
+        """
+        Return a 0/255 mask of pixels within the threshold for color.
+
+        Pass precomputed codes (from codes()) to avoid another indexing pass.
+        out and scratch are optional preallocated buffers shaped like codes,
+        of dtype uint8 and the table's dtype respectively.
+        """
+        if codes is None:
+            codes = self.codes(frame)
+        bits = np.bitwise_and(codes, self.bit_of[color], out=scratch)
+        return cv2.compare(bits, 0, cv2.CMP_NE, dst=out)
@@ -0,0 +1,274 @@
+"""
+UDP remote control: a compact binary command protocol, with acknowledgements.
+
+Every datagram starts with the fleet's MAGIC bytes, then a fixed header:
+
+    command:  MAGIC | version (B) | opcode (B) | seq (I) | payload
+    reply:    MAGIC | version (B) | status (B) | seq (I) | payload
+
+all in network byte order. The reply echoes the command's sequence number,
+so the sender knows which command landed, and can resend until it does:
+a CommandServer remembers its recent replies to its most recent senders,
+and answers a repeated (sender, seq) with the same reply instead of running
+the command again. Query commands (spans, latency, ...) reply with JSON payloads.
+
+The older text format (MAGIC + b"cmd:\\n" + words) still works, without
+sequence numbers or acknowledgements, so existing scripts keep working.
+
+The server is an asyncio datagram endpoint running in its own thread, so
+closing it is immediate, and handlers run as soon as a command arrives.
+Handlers should be quick: they hold up the commands behind them.
+
+See fleet.py for sending a command to many robots at once, or at the same time.
+
+Example:
+server = CommandServer({PAUSE: lambda payload: program.pause()}, port=27272)
+server.start()
+...
+with CommandClient(('192.168.1.50', 27272)) as client:
+    client.send(PAUSE)  # returns the reply payload once acknowledged, or raises TimeoutError
+"""
+
+import json
+import time
+import socket
+import struct
+import asyncio
+import threading
+import collections
+
+MAGIC = b'pi__F00#VML'
+VERSION = 1
+HEADER = struct.Struct('!BBI')  # version, opcode (or status in replies), seq
+LEGACY_PREFIX = b'cmd:\n'
+
+# opcodes
+PING, PAUSE, RESUME, STOP, SPANS, DUMPSPANS, LATENCY = range(7)
+# synchronized scheduling, see clocksync.py. Payloads are clocksync.encode_time()s.
+CLOCK, RESUME_AT, PAUSE_AT = range(7, 10)
+OPCODES = {
+    'ping': PING, 'pause': PAUSE, 'resume': RESUME, 'stop': STOP,
+    'spans': SPANS, 'dumpspans': DUMPSPANS, 'latency': LATENCY,
+    'clock': CLOCK, 'resume_at': RESUME_AT, 'pause_at': PAUSE_AT,
+}
+# (word, opcode) for the legacy text format, in the order they were matched (so b'unpause' isn't b'pause')
+LEGACY_WORDS = (
+    (b'dumpspans', DUMPSPANS), (b'latency', LATENCY), (b'spans', SPANS),
+    (b'halt', STOP), (b'stop', STOP), (b'unpause', RESUME), (b'resume', RESUME), (b'pause', PAUSE),
+)
+
+# reply statuses
+OK, UNKNOWN, ERROR, BAD_VERSION = range(4)
+
+
+class CommandError(Exception):
+    """The server got the command, but couldn't carry it out."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode(code, seq, payload=b'', magic=MAGIC):
+    """A command (code is an opcode) or a reply (code is a status)."""
+    return magic + HEADER.pack(VERSION, code, seq & 0xFFFFFFFF) + payload
+
+
+def decode(data, magic=MAGIC):
+    """(version, code, seq, payload). Raises ValueError if data isn't one of ours."""
+    if not data.startswith(magic) or len(data) < len(magic) + HEADER.size:
+        raise ValueError("not a command datagram")
+    version, code, seq = HEADER.unpack_from(data, len(magic))
+    return version, code, seq, data[len(magic) + HEADER.size:]
+
+
+def parse_legacy(data, magic=MAGIC):
+    """The opcode for a legacy text command, or None if data isn't one."""
+    if not data.startswith(magic + LEGACY_PREFIX):
+        return None
+    words = data[len(magic) + len(LEGACY_PREFIX):]
+    for word, opcode in LEGACY_WORDS:
+        if word in words:
+            return opcode
+    return None
+
+
+def to_payload(result):
+    # handlers may return None, bytes, str, or anything JSON can encode
+    if result is None:
+        return b''
+    if isinstance(result, bytes):
+        return result
+    if isinstance(result, str):
+        return result.encode('utf-8')
+    return json.dumps(result, separators=(',', ':')).encode('utf-8')
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.received(data, addr)
+
+
+class CommandServer:
+    def __init__(self, handlers, port, host='', magic=MAGIC, remember=64, senders=256):
+        """
+        handlers: {opcode: handler}, called as handler(payload) in the server's thread.
+            Returns the reply payload (see to_payload()), or None for an empty one.
+        port: UDP port to listen on (0 for any free port, see self.port)
+        remember: replies to keep per sender, for answering resent commands
+        senders: senders to keep replies for. The one heard from least recently is forgotten first.
+        """
+        self.handlers = dict(handlers)
+        self.address = (host or '0.0.0.0', port)
+        self.magic = magic
+        self.remember = remember
+        self.senders = senders
+        self.transport = None
+        self.loop = None
+        self.replies = collections.OrderedDict()  # sender -> {seq: reply}, least recently heard from first
+        self.received_count = self.duplicates = 0
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    @property
+    def port(self):
+        return self.transport.get_extra_info('sockname')[1] if self.transport else self.address[1]
+
+    def start(self):
+        """Start serving in a background thread. Returns once the socket is bound (raises if it can't be)."""
+        self._thread = threading.Thread(target=self._serve, name='command-server', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def _serve(self):
+        self.loop = loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(loop.create_datagram_endpoint(lambda: _Protocol(self), local_addr=self.address))
+        except OSError as err:
+            self._error = err
+            self._ready.set()
+            loop.close()
+            return
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self.transport.close()
+            loop.run_until_complete(asyncio.sleep(0))  # let the transport finish closing
+            loop.close()
+
+    def close(self):
+        if self.loop is not None and self._thread is not None and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def run(self, opcode, payload):
+        handler = self.handlers.get(opcode)
+        if handler is None:
+            return UNKNOWN, f"unknown opcode {opcode}".encode('utf-8')
+        try:
+            return OK, to_payload(handler(payload))
+        except Exception as err:  # tell the sender, and keep serving
+            return ERROR, f"{type(err).__name__}: {err}".encode('utf-8')
+
+    def received(self, data, addr):
+        self.received_count += 1
+        opcode = parse_legacy(data, self.magic)
+        if opcode is not None:
+            # legacy: no seq, no ack, and no reply unless the command returns something (a query, in practice),
+            # which is sent back bare, with no header. Errors and unknown commands get no reply at all.
+            status, payload = self.run(opcode, b'')
+            if status == OK and payload:
+                self.transport.sendto(payload, addr)
+            return
+        try:
+            version, opcode, seq, payload = decode(data, self.magic)
+        except ValueError:
+            return  # not for us
+        recent = self.replies.get(addr)
+        if recent is None:
+            recent = self.replies[addr] = collections.OrderedDict()
+            while len(self.replies) > self.senders:
+                self.replies.popitem(last=False)
+        else:
+            self.replies.move_to_end(addr)
+        reply = recent.get(seq)
+        if reply is not None:
+            self.duplicates += 1  # our ack got lost. Say the same thing again, but don't do it twice.
+        else:
+            if version != VERSION:
+                status, payload = BAD_VERSION, f"protocol version {VERSION}".encode('utf-8')
+            else:
+                status, payload = self.run(opcode, payload)
+            reply = recent[seq] = encode(status, seq, payload, self.magic)
+            while len(recent) > self.remember:
+                recent.popitem(last=False)
+        self.transport.sendto(reply, addr)
+
+
+class CommandClient:
+    def __init__(self, address, magic=MAGIC, timeout=0.2, retries=5, seq=None):
+        """
+        address: (host, port) of the CommandServer
+        timeout: seconds to wait for an ack before resending
+        retries: resends before giving up
+        """
+        self.address = address
+        self.magic = magic
+        self.timeout = timeout
+        self.retries = retries
+        # start somewhere random-ish, so a restarted client isn't mistaken for a resend
+        self.seq = int(time.time() * 1000) & 0xFFFFFFFF if seq is None else seq
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.attempts = 0  # datagrams sent by the last send()
+
+    def send(self, opcode, payload=b''):
+        """Send a command until it's acknowledged. Returns the reply payload. Raises TimeoutError or CommandError."""
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        seq = self.seq
+        data = encode(opcode, seq, payload, self.magic)
+        self.attempts = 0
+        for _ in range(self.retries + 1):
+            self.sock.sendto(data, self.address)
+            self.attempts += 1
+            deadline = time.monotonic() + self.timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                self.sock.settimeout(remaining)
+                try:
+                    reply = self.sock.recv(65536)
+                except socket.timeout:
+                    break
+                try:
+                    _, status, reply_seq, reply_payload = decode(reply, self.magic)
+                except ValueError:
+                    continue
+                if reply_seq != seq:
+                    continue  # a late ack for an earlier command
+                if status != OK:
+                    raise CommandError(status, reply_payload.decode('utf-8', 'replace'))
+                return reply_payload
+        raise TimeoutError(f"no ack from {self.address} after {self.attempts} tries")
+
+    def query(self, opcode, payload=b''):
+        """send(), with the reply decoded from JSON."""
+        return json.loads(self.send(opcode, payload) or b'null')
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
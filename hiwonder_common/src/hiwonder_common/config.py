@@ -0,0 +1,132 @@
+"""
+Fast YAML config loading, and watching config files for changes.
+
+yaml.FullLoader is pure Python, and lab_config.yaml takes it a noticeable
+fraction of a second on the Pi. load_yaml() parses with libyaml's
+CFullLoader when PyYAML was built with it, and caches the parsed data as a
+pickle keyed by the file's path, size and mtime, so a file that hasn't
+changed since it was last parsed isn't parsed again. Only the latest version
+of each file is kept.
+
+A ConfigWatcher polls a few files' mtimes from a background thread and
+calls back with the path of any that changed, so thresholds can be tuned
+while the program runs.
+
+Example:
+lab_data = load_yaml('lab_config.yaml')  # parsed once, then from the cache
+watcher = ConfigWatcher(['lab_config.yaml'], lambda path: print(f"{path} changed"))
+watcher.start()
+"""
+
+import os
+import pickle
+import hashlib
+import threading
+
+import yaml
+
+from .colorlut import default_cache_dir, prune_cache
+
+# libyaml is several times faster, but PyYAML may have been built without it
+Loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+def file_stamp(path):
+    """(mtime_ns, size) of path, or None if it doesn't exist. Changes whenever the file is rewritten."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def parse_yaml(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return yaml.load(file, Loader=Loader)
+
+
+def load_yaml(path, cache_dir=None):
+    """
+    Load a YAML file, from the parsed-data cache if it hasn't changed since it was last parsed.
+
+    cache_dir: where to keep parsed files (default: colorlut.default_cache_dir()), or False for no cache
+    """
+    stamp = file_stamp(path)
+    if stamp is None or cache_dir is False:
+        return parse_yaml(path)  # raises FileNotFoundError if it's missing
+    cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+    path_key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    version_key = hashlib.sha1(f"{stamp[0]}:{stamp[1]}:{yaml.__version__}".encode('utf-8')).hexdigest()[:16]
+    cached = os.path.join(cache_dir, f"yaml-{path_key}-{version_key}.pickle")
+    try:
+        with open(cached, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    data = parse_yaml(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cached)  # atomic, so half-written caches are never loaded
+        prune_cache(cache_dir, f"yaml-{path_key}-*.pickle", 1)  # older versions of this file
+    except OSError as err:
+        print(f"Couldn't cache parsed {path} to {cached}: {err}")
+    return data
+
+
+class ConfigWatcher:
+    def __init__(self, paths, callback, interval=1.0, settle=0.2, stamps=None):
+        """
+        paths: files to watch
+        callback: called as callback(path) from the watcher thread when a file changes
+        interval: seconds between checks
+        settle: seconds a change must hold still before the callback, so half-saved files aren't loaded
+        stamps: {path: file_stamp()} taken when the files were loaded, so an edit between loading
+            and watching is still picked up. Paths without one are stamped now.
+        """
+        self.paths = list(paths)
+        self.callback = callback
+        self.interval = interval
+        self.settle = settle
+        stamps = stamps or {}
+        self.stamps = {path: stamps[path] if path in stamps else file_stamp(path) for path in self.paths}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Call back for every file that changed since the last check. Returns the changed paths."""
+        changed = []
+        for path in self.paths:
+            stamp = file_stamp(path)
+            if stamp == self.stamps[path]:
+                continue
+            if self.settle and self._stop.wait(self.settle):
+                break
+            if file_stamp(path) != stamp:
+                continue  # still being written. Next time.
+            self.stamps[path] = stamp
+            if stamp is None:
+                continue  # deleted, or mid-rename. Keep the config we have.
+            changed.append(path)
+            try:
+                self.callback(path)
+            except Exception as err:  # a bad edit shouldn't kill the watcher (or the program)
+                print(f"Couldn't reload {path}: {type(err).__name__}: {err}")
+        return changed
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='config-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + self.settle + 1)
+            self._thread = None
@@ -0,0 +1,176 @@
+"""
+Sequence-numbered, timestamped frame handoff.
+
+Camera.Camera just overwrites its .frame attribute from its capture thread,
+so a consumer has to poll it, can't tell a new frame from one it has already
+processed, and has to copy it to be safe. A FrameSource fixes that:
+
+- Every published frame is a Frame(image, seq, t_capture). The image is a
+  read-only view, so it can be shared without copying.
+- seq increases by one per frame, and consumers can block in wait_next()
+  until there's a frame newer than the last one they saw.
+- t_capture is time.monotonic_ns() when the frame was published, for
+  latency measurement.
+
+Producers that can write into a buffer take one from the source's pool
+with acquire(), fill it and publish it, so nothing is allocated per frame.
+A buffer is only handed out again once nothing else refers to it: not a
+Frame, and not a view of its image. So a consumer can keep a frame (or a
+crop of it) as long as it likes, and the pool grows if every buffer is
+still in use. Anything else published is copied into a pool buffer, unless
+the producer hands it over with copy=False.
+
+publishing_camera() wraps a Camera.Camera-like class so its capture thread
+publishes straight into a FrameSource, with no polling. Camera.Camera
+allocates a new image for every capture and never touches it again, so its
+images are handed over as they are, without a copy.
+
+Example:
+camera = publishing_camera(Camera.Camera)()
+camera.camera_open()
+frame = None
+while True:
+    frame = camera.frame_source.wait_next(frame.seq if frame else None, timeout=1.0)
+    if frame is not None:
+        process(frame.image)
+"""
+
+import sys
+import time
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+# sys.getrefcount() of a pool buffer nobody else is using: the pool's list, the loop variable and the call's argument
+_UNUSED_REFS = 3
+
+
+class Frame(NamedTuple):
+    image: np.ndarray  # read-only
+    seq: int
+    t_capture: int  # time.monotonic_ns()
+
+
+class FrameSource:
+    def __init__(self, pool_size=4):
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self.closed = False
+        self.pool_size = pool_size
+        self._pool = []
+
+    @property
+    def latest(self):
+        return self._latest
+
+    @property
+    def seq(self):
+        """Sequence number of the newest frame so far (0 if none yet)."""
+        return self._seq
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Return a writable buffer from the pool that nothing else refers to.
+
+        The pool starts with pool_size buffers, and grows if they're all in use.
+        Call from the one thread that publishes.
+        """
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        if not self._pool or self._pool[0].shape != shape or self._pool[0].dtype != dtype:
+            # buffers of the old shape are left to whoever still holds them
+            self._pool = [np.empty(shape, dtype) for _ in range(self.pool_size)]
+        for buf in self._pool:
+            if sys.getrefcount(buf) <= _UNUSED_REFS:
+                break
+        else:
+            buf = np.empty(shape, dtype)
+            self._pool.append(buf)
+        buf.flags.writeable = True
+        return buf
+
+    def pooled(self, image):
+        """Is image one of the pool's buffers (from acquire())?"""
+        return any(image is buf for buf in self._pool)
+
+    def publish(self, image, t_capture=None, copy=True):
+        """
+        Hand out image as the newest frame. If it's from acquire(), the source takes it back:
+        don't write to it afterwards. Otherwise it's copied into the pool, unless copy is False,
+        which hands it over as it is: the producer mustn't write to it afterwards either.
+        """
+        if copy and not self.pooled(image):
+            buf = self.acquire(image.shape, image.dtype)
+            np.copyto(buf, image)
+            image = buf
+        if t_capture is None:
+            t_capture = time.monotonic_ns()
+        image.flags.writeable = False
+        with self._cond:
+            self._seq += 1
+            frame = Frame(image, self._seq, t_capture)
+            self._latest = frame
+            self._cond.notify_all()
+        return frame
+
+    def clear(self):
+        """There's no current frame (e.g. the camera was closed)."""
+        self._latest = None
+
+    def wait_next(self, after_seq=None, timeout=None):
+        """
+        Return the newest frame with seq > after_seq, blocking up to timeout seconds for one.
+
+        Returns None on timeout, or once the source is closed.
+        """
+        after_seq = 0 if after_seq is None else after_seq
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self.closed or (self._latest is not None and self._latest.seq > after_seq),
+                timeout)
+            if not ready or self.closed:
+                return None
+            return self._latest
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+_publishing_classes = {}
+
+
+def publishing_camera(base):
+    """
+    Return a subclass of the camera class base whose captured frames go to a FrameSource.
+
+    base's capture thread assigns each new image to self.frame. The subclass
+    turns that attribute into a property that publishes the image to
+    self.frame_source instead, and reads back the newest image, so existing
+    code that reads camera.frame keeps working.
+    """
+    if base in _publishing_classes:
+        return _publishing_classes[base]
+
+    class PublishingCamera(base):
+        def __init__(self, *args, **kwargs):
+            self.frame_source = FrameSource()  # must exist before base.__init__ sets self.frame
+            super().__init__(*args, **kwargs)
+
+        @property
+        def frame(self):
+            latest = self.frame_source.latest
+            return None if latest is None else latest.image
+
+        @frame.setter
+        def frame(self, image):
+            if image is None:
+                self.frame_source.clear()
+            else:
+                self.frame_source.publish(image, copy=False)  # a new image every capture, see above
+
+    PublishingCamera.__name__ = PublishingCamera.__qualname__ = f"Publishing{base.__name__}"
+    _publishing_classes[base] = PublishingCamera
+    return PublishingCamera
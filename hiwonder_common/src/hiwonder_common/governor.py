@@ -0,0 +1,188 @@
+"""
+Adaptive quality-of-service for the vision loop.
+
+When the Pi gets hot it throttles, and a loop that was comfortably keeping up
+suddenly isn't: frames queue up, detections get stale, and control falls
+apart. A QualityGovernor watches the loop rate and capture-to-detection
+latency (and the SoC temperature, if it can read it) against a target, and
+walks a ladder of quality levels:
+
+- Over budget (or too hot) for a whole window of frames: step down a level
+  (lower processing resolution, smaller blur, tighter ROI padding).
+- Comfortably within the latency budget for up_after windows in a row (and
+  keeping up): step back up. Headroom is judged by latency alone, since the
+  loop rate can't show it: that's capped by the camera's frame rate, which
+  may well be under target_fps / headroom.
+
+Every change is returned as a Decision (and printed), so the caller can apply
+it and the logs show why quality changed.
+
+Example:
+governor = QualityGovernor(target_fps=20, latency_budget=0.1)
+while True:
+    frame = camera.frame_source.wait_next(...)
+    ...detect...
+    decision = governor.record(time.monotonic_ns() - frame.t_capture)
+    if decision:
+        apply(decision.level)
+"""
+
+import time
+import collections
+from typing import NamedTuple
+
+from .statistics_tools import mean
+
+THERMAL_PATH = '/sys/class/thermal/thermal_zone0/temp'
+
+
+class Level(NamedTuple):
+    size: tuple  # (width, height) processing resolution
+    blur_ksize: tuple  # Gaussian blur kernel, or None to skip the blur
+    roi_pad: float  # RoiTracker padding, as a fraction of the target size
+
+
+# best first
+DEFAULT_LADDER = (
+    Level((640, 480), (3, 3), 0.5),
+    Level((480, 360), (3, 3), 0.5),
+    Level((320, 240), (3, 3), 0.4),
+    Level((320, 240), None, 0.3),
+    Level((240, 180), None, 0.25),
+)
+
+
+class Decision(NamedTuple):
+    index: int  # index of the new level in the ladder
+    level: Level
+    reason: str
+    fps: float  # measured over the last window
+    latency: float  # seconds, worst in the last window
+    temperature: float  # degrees C, or None if unknown
+
+
+def read_temperature(path=THERMAL_PATH):
+    """SoC temperature in degrees C, or None if it can't be read."""
+    try:
+        with open(path) as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+class QualityGovernor:
+    def __init__(self,
+        target_fps=20.0,
+        latency_budget=0.1,
+        ladder=DEFAULT_LADDER,
+        start=0,
+        window=30,
+        up_after=3,
+        headroom=0.75,
+        temperature_limit=75.0,
+        temperature_hysteresis=5.0,
+        thermal_path=THERMAL_PATH,
+        verbose=True,
+    ):
+        """
+        target_fps: loop rate to keep up. Must be below the camera's frame rate, which caps the loop's.
+        latency_budget: seconds from capture to detection that we'll tolerate
+        window: frames per evaluation
+        up_after: consecutive evaluations with headroom before stepping back up
+        headroom: fraction of the latency budget we must be under to count as having headroom
+        temperature_limit: step down when the SoC is hotter than this (degrees C)
+        thermal_path: where to read the SoC temperature, or None to ignore it
+        """
+        self.target_period = 1 / target_fps
+        self.latency_budget = latency_budget
+        self.ladder = tuple(ladder)
+        self.index = start
+        self.window = window
+        self.up_after = up_after
+        self.headroom = headroom
+        self.temperature_limit = temperature_limit
+        self.temperature_hysteresis = temperature_hysteresis
+        self.thermal_path = thermal_path
+        self.verbose = verbose
+        self.history = []  # every Decision so far
+        self._periods = collections.deque(maxlen=window)
+        self._latencies = collections.deque(maxlen=window)
+        self._t_last = None
+        self._good = 0  # consecutive windows with headroom
+        self._temperature = None
+        self._t_temperature = 0
+
+    @property
+    def level(self):
+        return self.ladder[self.index]
+
+    def temperature(self):
+        """SoC temperature, read at most once a second."""
+        if self.thermal_path is None:
+            return None
+        now = time.monotonic()
+        if now - self._t_temperature >= 1.0:
+            self._temperature = read_temperature(self.thermal_path)
+            self._t_temperature = now
+        return self._temperature
+
+    def reset(self):
+        """Forget the measurements so far, e.g. after changing level or being paused."""
+        self._periods.clear()
+        self._latencies.clear()
+        self._t_last = None
+
+    def record(self, latency_ns):
+        """
+        Record a processed frame and its capture-to-detection latency in nanoseconds.
+
+        Returns a Decision if the level should change, else None.
+        """
+        now = time.monotonic_ns()
+        if self._t_last is not None:
+            self._periods.append((now - self._t_last) / 1E9)
+        self._t_last = now
+        self._latencies.append(latency_ns / 1E9)
+        if len(self._latencies) < self.window:
+            return None
+        return self.evaluate()
+
+    def evaluate(self):
+        period = mean(self._periods) if self._periods else 0.0
+        latency = max(self._latencies)
+        temperature = self.temperature()
+        fps = 1 / period if period else 0.0
+        hot = temperature is not None and temperature > self.temperature_limit
+        cool = temperature is None or temperature < self.temperature_limit - self.temperature_hysteresis
+
+        if hot or period > self.target_period or latency > self.latency_budget:
+            self._good = 0
+            if self.index + 1 < len(self.ladder):
+                if hot:
+                    reason = f"SoC at {temperature:.0f}C"
+                elif period > self.target_period:
+                    reason = f"{fps:.1f} fps is under target {1 / self.target_period:.1f}"
+                else:
+                    reason = f"latency {latency * 1000:.0f}ms is over budget {self.latency_budget * 1000:.0f}ms"
+                return self._change(self.index + 1, reason, fps, latency, temperature)
+        elif cool and latency < self.latency_budget * self.headroom:
+            self._good += 1
+            if self._good >= self.up_after and self.index > 0:
+                return self._change(self.index - 1, "headroom", fps, latency, temperature)
+        else:
+            self._good = 0
+        self._periods.clear()
+        self._latencies.clear()
+        return None
+
+    def _change(self, index, reason, fps, latency, temperature):
+        self.index = index
+        self._good = 0
+        self.reset()
+        decision = Decision(index, self.level, reason, fps, latency, temperature)
+        self.history.append(decision)
+        if self.verbose:
+            size = 'x'.join(map(str, self.level.size))
+            print(f"Quality level {index} ({size}, blur {self.level.blur_ksize}, "
+                  f"ROI pad {self.level.roi_pad}): {reason}")
+        return decision
@@ -0,0 +1,152 @@
+"""
+Capture-to-actuation latency histograms.
+
+What matters for closed-loop control isn't how fast the loop runs but how
+old a frame is by the time we act on it. Every Frame carries t_capture
+(time.monotonic_ns() when it was published, see frames.py); a
+LatencyTracker records the frame's age at each stage it passes through
+(e.g. dequeued, detection done, motor command sent) into a histogram per
+stage.
+
+Histograms have fixed, log-spaced buckets (each 25% wider than the last,
+from 100us to about 10s), so recording is a bisect and an increment, and
+memory doesn't grow. Percentiles are read from the buckets, interpolating
+within the bucket, so they're accurate to within a bucket width, and never
+more than the largest sample seen.
+
+Every log_interval seconds the tracker prints percentiles for the interval
+just past. Totals since start (or reset()) are available from percentiles().
+Stages may be recorded from different threads; a report that races a record
+can miss that one sample, which is fine for monitoring.
+
+Example:
+latency = LatencyTracker(['dequeue', 'detect', 'command'])
+frame = source.wait_next(...)
+latency.record('dequeue', frame.t_capture)
+...
+latency.record('command', frame.t_capture)
+latency.percentiles()  # {'command': {'count': ..., 'p50_ms': ..., 'p99_ms': ...}, ...}
+"""
+
+import json
+import time
+import array
+import bisect
+
+# bucket upper edges in ns: 100us * 1.25^i, up to ~10s. Anything longer goes in the last bucket.
+EDGES = tuple(int(100_000 * 1.25 ** i) for i in range(52))
+PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = array.array('q', bytes(8 * (len(EDGES) + 1)))
+        self.n = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.counts[bisect.bisect_left(EDGES, ns)] += 1
+        self.n += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def add(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.n += other.n
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def clear(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.n = self.total_ns = self.max_ns = 0
+
+    def percentile(self, q):
+        """The q-th percentile in ns, interpolated within its bucket (None if empty)."""
+        if not self.n:
+            return None
+        rank = q / 100 * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = EDGES[i - 1] if i else 0
+                upper = min(EDGES[i] if i < len(EDGES) else self.max_ns, self.max_ns)
+                lower = min(lower, upper)
+                return lower + (upper - lower) * max(0.0, rank - seen) / c
+            seen += c
+        return self.max_ns
+
+    def stats(self):
+        if not self.n:
+            return {'count': 0}
+        out = {'count': self.n, 'mean_ms': round(self.total_ns / self.n / 1E6, 2)}
+        for q in PERCENTILES:
+            out[f'p{q}_ms'] = round(self.percentile(q) / 1E6, 2)
+        out['max_ms'] = round(self.max_ns / 1E6, 2)
+        return out
+
+
+class LatencyTracker:
+    def __init__(self, stages, log_interval=10.0, name='latency'):
+        """
+        stages: names of the points frame age is measured at, in pipeline order
+        log_interval: seconds between printed reports, or None to never print
+        """
+        self.stages = tuple(stages)
+        self.name = name
+        self.interval = {stage: LatencyHistogram() for stage in self.stages}  # since the last report
+        self.totals = {stage: LatencyHistogram() for stage in self.stages}
+        self.last = dict.fromkeys(self.stages, 0)  # ns, the most recent frame's age at each stage
+        self.log_interval_ns = None if log_interval is None else int(log_interval * 1E9)
+        self._next_log = None if log_interval is None else time.monotonic_ns() + self.log_interval_ns
+
+    def record(self, stage, t_capture, now=None):
+        """Record the age of a frame captured at t_capture (monotonic ns) as it reaches stage."""
+        now = time.monotonic_ns() if now is None else now
+        self.last[stage] = age = now - t_capture
+        self.interval[stage].record(age)
+        if self._next_log is not None and now >= self._next_log:
+            self._next_log = now + self.log_interval_ns
+            self.log()
+
+    def rollup(self):
+        """Fold the interval histograms into the totals, and return the interval's stats."""
+        stats = {}
+        for stage in self.stages:
+            hist = self.interval[stage]
+            stats[stage] = hist.stats()
+            self.totals[stage].add(hist)
+            hist.clear()
+        return stats
+
+    def log(self):
+        stats = self.rollup()
+        parts = []
+        for stage in self.stages:
+            s = stats[stage]
+            if s['count']:
+                parts.append(f"{stage} p50 {s['p50_ms']:.1f} p95 {s['p95_ms']:.1f} p99 {s['p99_ms']:.1f}")
+        if parts:
+            print(f"{self.name} (ms since capture): " + ", ".join(parts))
+
+    def percentiles(self):
+        """Stats per stage since start, including the current interval."""
+        out = {}
+        for stage in self.stages:
+            hist = LatencyHistogram()
+            hist.add(self.totals[stage])
+            hist.add(self.interval[stage])
+            out[stage] = hist.stats()
+        return out
+
+    def report(self):
+        """percentiles() as compact JSON bytes, small enough for a UDP reply."""
+        return json.dumps(self.percentiles(), separators=(',', ':')).encode('utf-8')
+
+    def reset(self):
+        for stage in self.stages:
+            self.interval[stage].clear()
+            self.totals[stage].clear()
@@ -0,0 +1,209 @@
+"""
+MJPEG preview stream over HTTP, for robots without a display.
+
+MjpegServer is a render.Renderer consumer. Point a browser at
+http://<robot>:<port>/ to watch the annotated preview, or fetch
+/stream.mjpg (multipart/x-mixed-replace) or /snapshot.jpg directly.
+
+The control loop only ever pays for a frame copy: consume() copies the
+canvas into a buffer, and JPEG encoding happens in a background thread, at
+most max_fps times a second. While no client is connected the server is
+inactive, so the renderer doesn't draw at all and nothing is encoded.
+
+That means the last JPEG can be from long ago (e.g. before the last client
+left), so a JPEG is only served while its frame is less than max_age
+seconds old. A new client waits for the first fresh one, which its
+connecting asks the renderer for.
+
+Example:
+server = MjpegServer(port=8080, max_fps=10, quality=70)
+server.start()
+renderer.subscribe(server)
+...
+server.close()
+"""
+
+import threading
+import time
+from http import server as http
+
+import cv2
+import numpy as np
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>TurboPi preview</title></head>
+<body style="margin:0;background:#222"><img src="/stream.mjpg" style="display:block;margin:auto"></body></html>
+"""
+BOUNDARY = b'frame'
+
+
+class _Handler(http.BaseHTTPRequestHandler):
+    server_version = 'TurboPiMJPEG/0.1'
+
+    def log_message(self, format, *args):
+        pass  # don't print a line per request
+
+    def do_GET(self):
+        stream = self.server.stream
+        path = self.path.split('?', 1)[0]
+        if path in ('/', '/index.html'):
+            self._send(200, 'text/html', PAGE)
+        elif path == '/snapshot.jpg':
+            with stream.client():
+                jpeg = stream.wait_jpeg(0, timeout=2.0, max_age=stream.max_age)[1]
+            if jpeg is None:
+                self.send_error(503, "No recent frame available")
+            else:
+                self._send(200, 'image/jpeg', jpeg)
+        elif path == '/stream.mjpg':
+            self.send_response(200)
+            self.send_header('Cache-Control', 'no-cache, private')
+            self.send_header('Pragma', 'no-cache')
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY.decode())
+            self.end_headers()
+            with stream.client():
+                seq = 0
+                while not stream.closed:
+                    seq, jpeg = stream.wait_jpeg(seq, timeout=1.0, max_age=stream.max_age)
+                    if jpeg is None:
+                        continue
+                    try:
+                        self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                                         + b'Content-Length: %d\r\n\r\n' % len(jpeg) + jpeg + b'\r\n')
+                    except (BrokenPipeError, ConnectionResetError):
+                        break  # client went away
+        else:
+            self.send_error(404)
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Client:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __enter__(self):
+        with self.stream._cond:
+            self.stream.clients += 1
+
+    def __exit__(self, *exc):
+        with self.stream._cond:
+            self.stream.clients -= 1
+
+
+class MjpegServer:
+    def __init__(self, port=8080, host='', max_fps=10.0, quality=70, max_age=1.0):
+        """
+        host: interface to listen on. '' is every interface, '127.0.0.1' is this machine only.
+        max_fps: most frames per second to encode and send
+        quality: JPEG quality, 0-100
+        max_age: seconds since its frame was drawn that a JPEG is still sent to clients
+        """
+        self.address = (host, port)
+        self.min_interval_ns = int(1E9 / max_fps) if max_fps else 0
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.max_age = max_age
+        self.clients = 0
+        self.closed = False
+        self.encoded = 0  # frames encoded so far
+        self._cond = threading.Condition()
+        self._frame = None  # latest raw frame, waiting to be encoded
+        self._pending = False
+        self._t_last = 0  # time.monotonic_ns() of the last frame taken for encoding
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._jpeg_t = 0  # time.monotonic_ns() when the frame in self._jpeg was consumed
+        self.httpd = None
+        self._threads = []
+
+    @property
+    def active(self):
+        # only ask for frames when someone's watching and the encoder is due for one
+        return (self.clients > 0 and not self._pending
+                and time.monotonic_ns() - self._t_last >= self.min_interval_ns)
+
+    def client(self):
+        """Context manager that counts a connected client."""
+        return _Client(self)
+
+    def start(self):
+        self.httpd = http.ThreadingHTTPServer(self.address, _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stream = self
+        self._threads = [
+            threading.Thread(target=self.httpd.serve_forever, name='mjpeg-http', daemon=True),
+            threading.Thread(target=self._encode_loop, name='mjpeg-encode', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1] if self.httpd else self.address[1]
+
+    def consume(self, image):
+        with self._cond:
+            if self._frame is None or self._frame.shape != image.shape:
+                self._frame = np.empty_like(image)
+            np.copyto(self._frame, image)
+            self._pending = True
+            self._t_last = time.monotonic_ns()
+            self._cond.notify_all()
+
+    def _encode_loop(self):
+        frame = None
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self.closed)
+                if self.closed:
+                    return
+                # swap buffers, so consume() can fill the other one while we encode
+                frame, self._frame = self._frame, frame
+                t_frame = self._t_last
+                self._pending = False
+            ok, jpeg = cv2.imencode('.jpg', frame, self.encode_params)
+            if not ok:
+                continue
+            with self._cond:
+                self._jpeg = jpeg.tobytes()
+                self._jpeg_seq += 1
+                self._jpeg_t = t_frame
+                self.encoded += 1
+                self._cond.notify_all()
+
+    def wait_jpeg(self, after_seq, timeout=None, max_age=None):
+        """
+        Return (seq, jpeg bytes) of the newest frame newer than after_seq, or (after_seq, None) on timeout.
+
+        max_age: seconds. If the newest JPEG's frame is older than this, wait for a newer one.
+        """
+        max_age_ns = None if max_age is None else max_age * 1E9
+
+        def ready():
+            if self.closed:
+                return True
+            if self._jpeg_seq <= after_seq:
+                return False
+            return max_age_ns is None or time.monotonic_ns() - self._jpeg_t <= max_age_ns
+
+        with self._cond:
+            if not self._cond.wait_for(ready, timeout) or self.closed:
+                return after_seq, None
+            return self._jpeg_seq, self._jpeg
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        for thread in self._threads:
+            thread.join(1.0)
+        self._threads = []
@@ -0,0 +1,142 @@
+"""
+Threaded pipeline stages connected by single-slot queues.
+
+Each Stage runs in its own thread. Stages are connected by LatestSlots,
+which only ever hold the newest item: if a stage falls behind, the items it
+didn't get to are dropped rather than queued, so every stage always works on
+the freshest data. A slow stage therefore never delays the stages upstream of
+it, or its siblings.
+
+Most of our per-frame work is in cv2, which releases the GIL, so stages
+really do run in parallel on the Pi's cores.
+
+Example:
+frames, detections = LatestSlot(), LatestSlot()
+pipe = Pipeline()
+pipe.add('capture', camera.wait_frame, outboxes=[frames])  # source stage: takes no input
+pipe.add('process', detect, inbox=frames, outboxes=[detections])
+pipe.add('actuate', control, inbox=detections)
+pipe.start()
+"""
+
+import queue
+import threading
+
+
+class Closed(Exception):
+    pass
+
+
+class LatestSlot:
+    """Single-slot queue. put() never blocks; it replaces any item not yet taken."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._full = False
+        self.closed = False
+        self.dropped = 0  # items replaced before anyone took them
+
+    def put(self, item):
+        with self._cond:
+            if self._full:
+                self.dropped += 1
+            self._item = item
+            self._full = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Take the newest item. Raises queue.Empty on timeout, or Closed once closed."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._full or self.closed, timeout):
+                raise queue.Empty
+            if not self._full:
+                raise Closed
+            item, self._item, self._full = self._item, None, False
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Stage(threading.Thread):
+    """
+    Run func on the newest item from inbox, and put non-None results in every outbox.
+
+    A stage without an inbox is a source: func is called with no arguments
+    and is expected to block until it has something (or return None).
+    """
+
+    def __init__(self, name, func, inbox=None, outboxes=(), on_error=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outboxes = list(outboxes)
+        self.on_error = on_error
+        self.error = None
+        self.count = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.inbox is None:
+                    result = self.func()
+                else:
+                    try:
+                        item = self.inbox.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    result = self.func(item)
+            except Closed:
+                break
+            except BaseException as err:
+                self.error = err
+                if self.on_error:
+                    self.on_error(self, err)
+                break
+            self.count += 1
+            if result is not None:
+                for box in self.outboxes:
+                    box.put(result)
+        for box in self.outboxes:
+            box.close()
+
+    def stop(self):
+        self._stopping.set()
+        if self.inbox is not None:
+            self.inbox.close()
+
+
+class Pipeline:
+    def __init__(self):
+        self.stages = []
+        self.failed = threading.Event()
+        self.error = None
+
+    def add(self, name, func, inbox=None, outboxes=()):
+        stage = Stage(name, func, inbox, outboxes, on_error=self._stage_failed)
+        self.stages.append(stage)
+        return stage
+
+    def _stage_failed(self, stage, err):
+        if self.error is None:
+            self.error = err
+        self.failed.set()
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=1.0):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            if stage.is_alive() and stage is not threading.current_thread():
+                stage.join(timeout)
+
+    def dropped(self):
+        """Number of items dropped at each stage's inbox, by stage name."""
+        return {stage.name: stage.inbox.dropped for stage in self.stages if stage.inbox is not None}
@@ -0,0 +1,175 @@
+"""
+Process pool for per-frame vision work, over a shared-memory frame ring.
+
+The GIL and Python overhead keep a single process on one core. VisionPool
+runs a detection function in N worker processes instead. Frames are never
+pickled: the parent copies each frame into a free slot of a FrameRing (a
+multiprocessing.shared_memory block), and only (sequence number, slot) goes
+over the task queue. Workers send back small results, which are handed out
+in frame order no matter which worker finished first.
+
+Workers are forked (Linux only), so they inherit the ring and the detection
+function as-is, without pickling or re-importing anything. Create the pool
+before starting other threads if you can.
+
+If a worker dies (killed, or out of memory), the frame it was working on
+never comes back, and no later result could be handed out in order, so
+collect() raises WorkerError instead of waiting on it forever.
+
+Example:
+pool = VisionPool(find_target, workers=3, shape=(480, 640, 3))
+pool.start()
+while True:
+    if pool.free_slots:
+        pool.submit(camera.frame)
+    for seq, result in pool.collect(timeout=0.005):
+        control(result)
+pool.close()
+"""
+
+import queue
+import signal
+import collections
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """Fixed number of frame-sized slots in one shared memory block."""
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype, buffer=self.shm.buf)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def write(self, slot, frame):
+        dst = self.frames[slot]
+        if frame.shape == dst.shape:
+            np.copyto(dst, frame)
+        else:
+            cv2.resize(frame, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_NEAREST)
+
+    def close(self):
+        self.frames = None  # release our view of the buffer before closing it
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _worker(detect, ring, tasks, results):
+    # the parent handles signals and tells us when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, slot, args = task
+        try:
+            result = detect(ring.frames[slot], *args)
+        except Exception as err:
+            results.put((seq, slot, None, repr(err)))
+        else:
+            results.put((seq, slot, result, None))
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class VisionPool:
+    def __init__(self, detect, workers, shape, dtype=np.uint8, slots=None):
+        """
+        detect: called in a worker as detect(frame, *args) for each submitted frame.
+            frame is a view into shared memory, valid only until detect returns.
+        slots: frames that can be in flight at once. Default is two per worker.
+        """
+        self.ctx = mp.get_context('fork')
+        self.detect = detect
+        self.n_workers = workers
+        self.ring = FrameRing(slots or 2 * workers, shape, dtype)
+        self.tasks = self.ctx.SimpleQueue()
+        self.results = self.ctx.Queue()
+        self.processes = []
+        self.free = collections.deque(range(len(self.ring)))
+        self.next_seq = 0  # sequence number of the next submitted frame
+        self.next_out = 0  # sequence number of the next result to hand out
+        self.done = {}  # finished results waiting for earlier frames
+
+    @property
+    def free_slots(self):
+        return len(self.free)
+
+    @property
+    def in_flight(self):
+        return self.next_seq - self.next_out
+
+    def start(self):
+        for i in range(self.n_workers):
+            p = self.ctx.Process(target=_worker, name=f'vision-{i}', daemon=True,
+                                 args=(self.detect, self.ring, self.tasks, self.results))
+            p.start()
+            self.processes.append(p)
+
+    def submit(self, frame, *args):
+        """
+        Queue a frame for detection. args are passed to detect() and must be small and picklable.
+
+        Returns the frame's sequence number, or None if every slot is in use (the frame is dropped).
+        """
+        if not self.free:
+            return None
+        slot = self.free.popleft()
+        self.ring.write(slot, frame)
+        seq = self.next_seq
+        self.next_seq += 1
+        self.tasks.put((seq, slot, args))
+        return seq
+
+    def check_workers(self):
+        """Raise WorkerError if a worker has exited."""
+        for p in self.processes:
+            if p.exitcode is not None:
+                raise WorkerError(f"Vision worker {p.name} exited with code {p.exitcode}")
+
+    def collect(self, timeout=0.0):
+        """
+        Return finished (seq, result) pairs, in frame order. Waits up to timeout for the first one.
+
+        Raises WorkerError if a worker failed on a frame, or has died.
+        """
+        block = timeout is not None and timeout > 0
+        while self.in_flight:
+            try:
+                seq, slot, result, err = self.results.get(block=block, timeout=timeout if block else None)
+            except queue.Empty:
+                self.check_workers()  # nothing's coming back from a dead worker
+                break
+            block = False  # only wait for the first one
+            self.free.append(slot)
+            if err is not None:
+                raise WorkerError(f"Vision worker failed on frame {seq}: {err}")
+            self.done[seq] = result
+        out = []
+        while self.next_out in self.done:
+            out.append((self.next_out, self.done.pop(self.next_out)))
+            self.next_out += 1
+        return out
+
+    def close(self, timeout=1.0):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for p in self.processes:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
+        self.results.close()
+        self.ring.close()
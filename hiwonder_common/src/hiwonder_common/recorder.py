@@ -0,0 +1,252 @@
+"""
+Session recording: what the robot saw, decided and was told, in one file.
+
+A Recorder appends records to a memory-mapped, append-only binary log:
+
+    file:    FILE_HEADER | record | record | ...
+    record:  RECORD (kind, payload length, time.monotonic_ns()) | payload
+
+Kinds of record:
+- CONFIG: the lab config and detection settings (JSON), at the start and on every reload
+- FRAME: a camera frame's sequence number and quality level, then the frame as a JPEG
+- DETECTION: a frame's sequence number, and what was detected in it
+- COMMAND: a chassis command, as asked for by control()
+- EVENT: a remote command (opcode and payload), as it arrived
+
+Callers only queue records, so recording never holds up the control loop.
+A background thread JPEG-encodes frames and copies records into the map,
+growing the file a chunk at a time. If the queue is full, records are
+dropped and counted, rather than waited on. The file's unwritten tail is
+zeros, so a recording cut short (even by a crash) reads up to its last
+complete record.
+
+read() yields the records back, and replay.py runs a recording back
+through the vision and control code, as fast as it will go.
+
+Example:
+rec = Recorder('/home/pi/recordings/run1.tplog').start()
+rec.frame(frame.image, frame.seq, quality=0, t_ns=frame.t_capture)
+rec.close()
+
+for record in read('/home/pi/recordings/run1.tplog'):
+    if record.kind == FRAME:
+        seq, quality, image = decode_frame(record.payload)
+"""
+
+import os
+import json
+import mmap
+import time
+import queue
+import struct
+import threading
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+MAGIC = b'TPrec\x00\x00\x01'
+FILE_HEADER = struct.Struct('<8sqq')  # magic, time.time_ns() and time.monotonic_ns() when recording started
+RECORD = struct.Struct('<BxxxIq')  # kind, payload length, time.monotonic_ns()
+
+# record kinds. 0 marks the end of the log.
+CONFIG, FRAME, DETECTION, COMMAND, EVENT = range(1, 6)
+KIND_NAMES = {CONFIG: 'config', FRAME: 'frame', DETECTION: 'detection', COMMAND: 'command', EVENT: 'event'}
+
+FRAME_HEADER = struct.Struct('<IB')  # seq, quality level. Followed by the JPEG.
+DETECTION_RECORD = struct.Struct('<I?ff')  # seq, detected, smoothed, area
+COMMAND_RECORD = struct.Struct('<fff')  # velocity, direction, angular rate
+EVENT_HEADER = struct.Struct('<B')  # opcode. Followed by the command's payload.
+
+
+class Record(NamedTuple):
+    kind: int
+    t_ns: int  # time.monotonic_ns() on the recording machine
+    payload: bytes
+
+
+class Recorder:
+    def __init__(self, path, jpeg_quality=90, queue_size=64, chunk_size=64 << 20):
+        """
+        jpeg_quality: for frames (0-100). Detections near a threshold can come out differently on replay.
+        queue_size: records waiting to be written before new ones are dropped
+        chunk_size: the file grows this many bytes at a time
+        """
+        self.path = path
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(queue_size)
+        self.written = self.dropped = 0  # records
+        self.file = open(path, 'w+b')
+        self.size = 0  # bytes of log written
+        self.map = None
+        self._grow(FILE_HEADER.size)
+        self._put(FILE_HEADER.pack(MAGIC, time.time_ns(), time.monotonic_ns()))
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='recorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def _grow(self, needed):
+        if self.map is not None and self.size + needed <= len(self.map):
+            return
+        capacity = (self.size + needed + self.chunk_size - 1) // self.chunk_size * self.chunk_size
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(capacity)  # zero filled
+        self.map = mmap.mmap(self.file.fileno(), capacity)
+
+    def _put(self, data):
+        self.map[self.size:self.size + len(data)] = data
+        self.size += len(data)
+
+    def append(self, kind, payload, t_ns):
+        # in the writer thread
+        self._grow(RECORD.size + len(payload))
+        self._put(RECORD.pack(kind, len(payload), t_ns))
+        self._put(payload)
+        self.written += 1
+
+    def run(self):
+        while (item := self.queue.get()) is not None:
+            kind, payload, t_ns = item
+            if kind == FRAME:
+                seq, quality, image = payload
+                ok, jpeg = cv2.imencode('.jpg', image, self.jpeg_params)
+                if not ok:
+                    self.dropped += 1
+                    continue
+                payload = FRAME_HEADER.pack(seq, quality) + jpeg.tobytes()
+            self.append(kind, payload, t_ns)
+
+    def write(self, kind, payload, t_ns=None):
+        """Queue a record. Returns False if it was dropped because the writer is behind."""
+        try:
+            self.queue.put_nowait((kind, payload, time.monotonic_ns() if t_ns is None else t_ns))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def config(self, settings):
+        return self.write(CONFIG, json.dumps(settings).encode('utf-8'))
+
+    def frame(self, image, seq, quality=0, t_ns=None):
+        # copied, since frame buffers are recycled (see frames.py) before the writer gets to them
+        if self.queue.full():
+            self.dropped += 1
+            return False
+        return self.write(FRAME, (seq, quality, image.copy()), t_ns)
+
+    def detection(self, seq, detected, smoothed, area):
+        return self.write(DETECTION, DETECTION_RECORD.pack(seq, bool(detected), smoothed, area))
+
+    def command(self, velocity, direction, angular_rate):
+        return self.write(COMMAND, COMMAND_RECORD.pack(velocity, direction, angular_rate))
+
+    def event(self, opcode, payload=b''):
+        return self.write(EVENT, EVENT_HEADER.pack(opcode) + bytes(payload))
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'bytes': self.size}
+
+    def close(self):
+        """Write out everything queued, and trim the file to what was written."""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.file.truncate(self.size)
+            self.file.close()
+
+
+class RecordingChassis:
+    """In front of a chassis (e.g. actuators.CoalescingChassis): records each command, then passes it on."""
+
+    def __init__(self, chassis, recorder):
+        self.chassis = chassis
+        self.recorder = recorder
+
+    def set_velocity(self, velocity, direction, angular_rate):
+        self.recorder.command(velocity, direction, angular_rate)
+        return self.chassis.set_velocity(velocity, direction, angular_rate)
+
+    def stop(self, force=False):
+        self.recorder.command(0, 0, 0)
+        return self.chassis.stop(force)
+
+    def flush(self):
+        return self.chassis.flush()
+
+    def stats(self):
+        return self.chassis.stats()
+
+
+def recording_handlers(handlers, recorder):
+    """commands.CommandServer handlers that record each command before running it."""
+    def recording(opcode, handler):
+        def handle(payload):
+            recorder.event(opcode, payload)
+            return handler(payload)
+        return handle
+    return {opcode: recording(opcode, handler) for opcode, handler in handlers.items()}
+
+
+def read(path):
+    """Yield the Records in a log, up to the end of the last complete one."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < FILE_HEADER.size:
+            raise ValueError(f"{path} is too short to be a recording")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            magic, _, _ = FILE_HEADER.unpack_from(m)
+            if magic != MAGIC:
+                raise ValueError(f"{path} isn't a recording (of this version)")
+            offset = FILE_HEADER.size
+            while offset + RECORD.size <= len(m):
+                kind, length, t_ns = RECORD.unpack_from(m, offset)
+                start = offset + RECORD.size
+                if kind == 0 or start + length > len(m):
+                    return
+                yield Record(kind, t_ns, m[start:start + length])
+                offset = start + length
+
+
+def start_time(path):
+    """(time.time_ns(), time.monotonic_ns()) when the recording started, for putting wall times to records."""
+    with open(path, 'rb') as f:
+        magic, wall_ns, monotonic_ns = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} isn't a recording (of this version)")
+    return wall_ns, monotonic_ns
+
+
+def decode_frame(payload):
+    """(seq, quality level, BGR image)"""
+    seq, quality = FRAME_HEADER.unpack_from(payload)
+    image = cv2.imdecode(np.frombuffer(payload, np.uint8, offset=FRAME_HEADER.size), cv2.IMREAD_COLOR)
+    return seq, quality, image
+
+
+def decode_detection(payload):
+    """(seq, detected, smoothed, area)"""
+    return DETECTION_RECORD.unpack(payload)
+
+
+def decode_command(payload):
+    """(velocity, direction, angular rate)"""
+    return COMMAND_RECORD.unpack(payload)
+
+
+def decode_event(payload):
+    """(opcode, payload)"""
+    return payload[0], payload[EVENT_HEADER.size:]
+
+
+def decode_config(payload):
+    return json.loads(payload)
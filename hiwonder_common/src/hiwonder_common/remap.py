@@ -0,0 +1,133 @@
+"""
+Fused fisheye undistortion and resize, as a single cv2.remap().
+
+With correction=True, Camera.Camera resizes every captured frame and then
+remaps it at full resolution to undo the lens distortion. Detection then
+resizes it again to its processing resolution. That's three full-frame
+passes where one will do: a remap can sample the distorted camera frame
+directly at the (undistorted) output pixel positions, at any output size.
+
+UndistortRemap builds those maps from the camera calibration (the same
+k_array/d_array/dim_array that Camera.Camera loads) in fixed point
+(CV_16SC2), which is what cv2.remap() is fastest with. Maps are cached on
+disk keyed by the calibration and both frame sizes, so restarts skip the
+rebuild.
+
+A window of the output can be remapped on its own, since the maps for it are
+just a slice of the full maps.
+
+Example:
+undistort = UndistortRemap.from_calibration(CALIBRATION_PATH, src_size=(640, 480), dst_size=(320, 240))
+camera.camera_open(correction=False)  # we'll do it ourselves
+small = undistort.apply(camera.frame)  # undistorted and downscaled in one pass
+"""
+
+import os
+import json
+import hashlib
+import pathlib as pl
+
+import cv2
+import numpy as np
+
+from .colorlut import default_cache_dir
+
+
+def load_calibration(calibration):
+    """Return (K, D, dim) from a calibration .npz path or an already-loaded np.load() of it."""
+    if isinstance(calibration, (str, os.PathLike)):
+        with np.load(calibration) as data:
+            return load_calibration(data)
+    k = np.array(calibration['k_array'].tolist(), np.float64)
+    d = np.array(calibration['d_array'].tolist(), np.float64)
+    dim = tuple(int(x) for x in calibration['dim_array'])
+    return k, d, dim
+
+
+def maps_hash(k, d, dim, src_size, dst_size, scale):
+    key = json.dumps([k.tolist(), d.tolist(), dim, src_size, dst_size, scale, cv2.__version__])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _scaled(matrix, from_size, to_size):
+    # camera matrix for the same lens at another resolution
+    matrix = matrix.copy()
+    matrix[0] *= to_size[0] / from_size[0]
+    matrix[1] *= to_size[1] / from_size[1]
+    matrix[2] = (0, 0, 1)
+    return matrix
+
+
+def build_maps(k, d, dim, src_size, dst_size, scale=1.0):
+    """
+    Fixed-point maps from a dst_size undistorted frame to a src_size distorted one.
+
+    The undistorted view is the one Camera.Camera's correction gives (the
+    same new camera matrix, with focal length multiplied by scale), just
+    rendered at dst_size.
+    """
+    knew = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(k, d, dim, None)
+    knew[(0, 1), (0, 1)] *= scale
+    return cv2.fisheye.initUndistortRectifyMap(
+        _scaled(k, dim, src_size), d, np.eye(3), _scaled(knew, dim, dst_size), dst_size, cv2.CV_16SC2)
+
+
+class UndistortRemap:
+    def __init__(self, map1, map2, calibration=None, src_size=None, scale=1.0):
+        self.map1 = map1  # (h, w, 2) int16 source pixel positions
+        self.map2 = map2  # (h, w) uint16 interpolation table indices
+        self.calibration = calibration  # (K, D, dim), for resized()
+        self.src_size = src_size
+        self.scale = scale
+
+    @property
+    def dst_size(self):
+        return self.map1.shape[1], self.map1.shape[0]
+
+    @classmethod
+    def from_calibration(cls, calibration, src_size, dst_size, scale=1.0, cache_dir=None):
+        """
+        Load the maps for this calibration and these sizes from the disk cache, building them if needed.
+
+        calibration: path to the calibration .npz, its np.load(), or (K, D, dim)
+        src_size: (width, height) of the camera frames that will be remapped
+        dst_size: (width, height) of the undistorted output
+        """
+        if not isinstance(calibration, tuple):
+            calibration = load_calibration(calibration)
+        k, d, dim = calibration
+        src_size, dst_size = tuple(src_size), tuple(dst_size)
+        cache_dir = default_cache_dir() if cache_dir is None else pl.Path(cache_dir)
+        path = cache_dir / f"undistort-{maps_hash(k, d, dim, src_size, dst_size, scale)}.npz"
+        try:
+            with np.load(path) as cached:
+                map1, map2 = cached['map1'], cached['map2']
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            map1, map2 = build_maps(k, d, dim, src_size, dst_size, scale)
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmp, 'wb') as f:
+                    np.savez(f, map1=map1, map2=map2)
+                os.replace(tmp, path)  # atomic, so half-written maps are never loaded
+            except OSError as err:
+                print(f"Couldn't cache undistortion maps to {path}: {err}")
+        return cls(map1, map2, calibration, src_size, scale)
+
+    def resized(self, dst_size, cache_dir=None):
+        """The same undistortion, rendered at another output size."""
+        if tuple(dst_size) == self.dst_size:
+            return self
+        return self.from_calibration(self.calibration, self.src_size, dst_size, self.scale, cache_dir)
+
+    def apply(self, src, dst=None, window=None, interpolation=cv2.INTER_LINEAR):
+        """
+        Undistort and resize src in one pass.
+
+        window: optional (x, y, w, h) of the output to produce, instead of all of it.
+        """
+        map1, map2 = self.map1, self.map2
+        if window is not None:
+            x, y, w, h = window
+            map1, map2 = map1[y:y + h, x:x + w], map2[y:y + h, x:x + w]
+        return cv2.remap(src, map1, map2, interpolation, dst=dst, borderMode=cv2.BORDER_CONSTANT)
@@ -0,0 +1,108 @@
+"""
+Annotation rendering that only happens when someone is watching.
+
+Drawing the detection overlay (copying the frame, fitting a rect, text, the
+resize to preview size) costs real time every frame, and on a headless robot
+nobody ever sees it. A Renderer keeps a list of consumers (a preview window,
+a stream, a recorder...) and only draws when at least one of them is active.
+
+When it does draw, it draws at display resolution: the camera frame is
+resized straight into a preallocated canvas, and the overlay is drawn on that
+with coordinates scaled to match, instead of annotating the full frame and
+shrinking the result.
+
+A consumer is anything with:
+- an `active` attribute or property: whether it wants frames right now.
+- a `consume(image)` method. image is the renderer's canvas, and is only
+  valid during the call: copy it if you need to keep it.
+
+Example:
+renderer = Renderer(display_size=(320, 240), frame_size=(640, 480))
+renderer.subscribe(WindowConsumer('frame'))
+canvas = renderer.canvas(camera_frame)  # None if nobody is watching
+if canvas is not None:
+    draw_overlay(canvas, renderer.scale_for(processing_size))  # the frame size the overlay's coordinates are in
+    renderer.publish(canvas)
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+
+class WindowConsumer:
+    """Show frames in a cv2 window. Needs a GUI backend, see BinaryProgram.can_show_windows()."""
+
+    def __init__(self, name='frame'):
+        self.name = name
+        self.active = True
+        self.last_key = -1
+
+    def consume(self, image):
+        cv2.imshow(self.name, image)
+        self.last_key = cv2.waitKey(1)
+
+    def close(self):
+        self.active = False
+        cv2.destroyWindow(self.name)
+
+
+class Renderer:
+    def __init__(self, display_size=(320, 240), frame_size=(640, 480), remap=None):
+        """
+        display_size: (width, height) of the frames handed to consumers
+        frame_size: (width, height) of the coordinate space the overlay is given in
+        remap: optional remap.UndistortRemap from camera frames to display_size, if the
+            camera frames aren't undistorted already
+        """
+        self.display_size = tuple(display_size)
+        self.remap = remap
+        self.set_frame_size(frame_size)
+        dw, dh = self.display_size
+        self._canvas = np.empty((dh, dw, 3), np.uint8)
+        self._lock = threading.Lock()
+        self.consumers = []
+
+    def set_frame_size(self, frame_size):
+        """Change the default coordinate space the overlay is given in."""
+        self.frame_size = tuple(frame_size)
+        self.scale = self.scale_for(self.frame_size)
+
+    def scale_for(self, frame_size):
+        """(x, y) factors from frame_size coordinates to the canvas, e.g. for each frame's processing resolution."""
+        return self.display_size[0] / frame_size[0], self.display_size[1] / frame_size[1]
+
+    def subscribe(self, consumer):
+        with self._lock:
+            self.consumers = self.consumers + [consumer]  # copy, so publish() can iterate without the lock
+        return consumer
+
+    def unsubscribe(self, consumer):
+        with self._lock:
+            self.consumers = [c for c in self.consumers if c is not consumer]
+
+    @property
+    def active(self):
+        """Whether anyone wants frames. If not, don't bother drawing."""
+        return any(consumer.active for consumer in self.consumers)
+
+    def canvas(self, raw):
+        """Return raw resized to display_size, ready to draw on, or None if no consumer is active."""
+        if not self.active:
+            return None
+        if self.remap is not None:
+            return self.remap.apply(raw, dst=self._canvas)
+        return cv2.resize(raw, self.display_size, dst=self._canvas)
+
+    def publish(self, canvas):
+        for consumer in self.consumers:
+            if consumer.active:
+                consumer.consume(canvas)
+
+    def close(self):
+        for consumer in self.consumers:
+            close = getattr(consumer, 'close', None)
+            if close is not None:
+                close()
+        self.consumers = []
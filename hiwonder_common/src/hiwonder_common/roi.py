@@ -0,0 +1,111 @@
+"""
+Region-of-interest tracking.
+
+Once we've found a target, it won't be far from where it was last frame, so
+there's no need to blur, convert and threshold the whole frame to find it
+again. RoiTracker keeps a padded window around the last detection:
+
+- If the target is lost, the window grows around where it was last seen,
+  until max_misses frames go by and we go back to scanning the full frame.
+- If the target touches the edge of the window, it's probably leaving it,
+  so the next frame is a full-frame scan.
+- Every full_scan_every frames we do a full-frame scan anyway, so that a
+  bigger target elsewhere in the frame isn't missed for long.
+
+Example:
+tracker = RoiTracker((640, 480))
+while True:
+    window = tracker.window()  # (x, y, w, h), or None for the full frame
+    box = find_target(frame, window)  # (x, y, w, h) in frame coordinates, or None
+    tracker.update(box)
+
+When frames are searched out of order with window() (e.g. several in flight
+in worker processes), pass each frame's window back with its box:
+tracker.update(box, window).
+"""
+
+_CURRENT = object()  # update()'s default: the window last handed out by window()
+
+
+class RoiTracker:
+    def __init__(self, frame_size, pad=0.5, min_pad=16, grow=1.5, max_misses=5, full_scan_every=30):
+        """
+        frame_size: (width, height) of the frames being searched
+        pad: padding on each side of the target, as a fraction of its larger dimension
+        min_pad: minimum padding in pixels
+        grow: window scale factor for each frame the target is lost
+        """
+        self.frame_size = tuple(frame_size)
+        self.pad = pad
+        self.min_pad = min_pad
+        self.grow = grow
+        self.max_misses = max_misses
+        self.full_scan_every = full_scan_every
+        self.reset()
+
+    def reset(self):
+        self._window = None
+        self._current = None
+        self.misses = 0
+        self.since_full_scan = 0
+
+    @property
+    def locked(self):
+        return self._window is not None
+
+    def window(self):
+        """Return the window to search this frame, or None to search the full frame."""
+        if self._window is not None and self.since_full_scan >= self.full_scan_every:
+            self._current = None
+        else:
+            self._current = self._window
+        return self._current
+
+    def update(self, box, window=_CURRENT):
+        """
+        Report the target's bounding box (x, y, w, h) for this frame, or None if it wasn't found.
+        window: the window the frame was searched in, if not the one window() last returned
+        """
+        if window is _CURRENT:
+            window = self._current
+        self.since_full_scan = 0 if window is None else self.since_full_scan + 1
+        if box is not None:
+            self.misses = 0
+            if window is not None and self._touches_edge(box, window):
+                self._window = None  # target is leaving the window; look everywhere next frame
+            else:
+                self._window = self._padded(box)
+        elif window is None:
+            self._window = None  # nothing in the whole frame
+        else:
+            self.misses += 1
+            self._window = None if self.misses > self.max_misses else self._grown(window)
+
+    def _clip(self, x0, y0, x1, y1):
+        fw, fh = self.frame_size
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(fw, int(x1)), min(fh, int(y1))
+        if x0 == 0 and y0 == 0 and x1 == fw and y1 == fh:
+            return None  # that's just the full frame
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def _padded(self, box):
+        x, y, w, h = box
+        p = max(self.min_pad, self.pad * max(w, h))
+        return self._clip(x - p, y - p, x + w + p, y + h + p)
+
+    def _grown(self, window):
+        x, y, w, h = window
+        cx, cy = x + w / 2, y + h / 2
+        w, h = w * self.grow / 2, h * self.grow / 2
+        return self._clip(cx - w, cy - h, cx + w, cy + h)
+
+    def _touches_edge(self, box, window):
+        fw, fh = self.frame_size
+        x, y, w, h = box
+        wx, wy, ww, wh = window
+        # only count window edges that aren't also frame edges
+        return ((x <= wx and wx > 0)
+             or (y <= wy and wy > 0)
+             or (x + w >= wx + ww and wx + ww < fw)
+             or (y + h >= wy + wh and wy + wh < fh))
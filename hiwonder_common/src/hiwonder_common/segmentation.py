@@ -0,0 +1,102 @@
+"""
+Single-pass multi-color segmentation.
+
+A ColorLUT gives us the per-pixel bitmask of every color in lab_config.yaml
+with one indexing pass, so looking at another color costs no extra
+conversion or thresholding of the frame. This module wraps that in a
+per-frame Segmentation that hands out cleaned masks and blob statistics
+(a label image, and area, centroid and bounding box per blob, from
+cv2.connectedComponentsWithStats) for any color, computed the first time
+the color is asked for and cached for the rest of the frame.
+
+A VisionPipeline thresholding through a ColorLUT builds one for every frame
+from the codes it computes anyway (see vision.py).
+
+Example:
+seg = Segmentation(lut.codes(blurred_bgr_frame), lut, open_kernel=np.ones((3, 3), np.uint8), min_area=50)
+seg.blobs('green').areas  # largest first
+seg.blobs('red')[0]  # Blob(area, centroid, box) of the largest red blob
+"""
+
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+
+class Blob(NamedTuple):
+    area: int
+    centroid: tuple  # (x, y)
+    box: tuple  # (x, y, w, h)
+
+
+class Blobs(NamedTuple):
+    """Connected components of one color, sorted largest to smallest."""
+    labels: np.ndarray  # component label image; 0 is background
+    ids: np.ndarray  # label of each blob in `labels`
+    areas: np.ndarray  # pixel count
+    centroids: np.ndarray  # (n, 2) x, y in frame coordinates
+    boxes: np.ndarray  # (n, 4) x, y, w, h in frame coordinates
+
+    def __len__(self):
+        return len(self.areas)
+
+    def __getitem__(self, i):
+        return Blob(int(self.areas[i]), tuple(self.centroids[i]), tuple(self.boxes[i]))
+
+
+class Segmentation:
+    """
+    Segmentation of one frame into every color of a lookup table.
+
+    `codes` is the color label image: bit i of each pixel is set if the pixel
+    is within the threshold of lut.colors[i]. Masks and blobs are computed
+    from it the first time they're asked for.
+
+    If the frame was a crop of a bigger image, pass its top-left corner as
+    `offset` and centroids/boxes will be reported in full-image coordinates.
+    """
+
+    def __init__(self, codes, lut, open_kernel=None, close_kernel=None, min_area=0, offset=(0, 0)):
+        self.codes = codes
+        self.lut = lut
+        self.open_kernel = open_kernel
+        self.close_kernel = close_kernel
+        self.min_area = min_area
+        self.offset = offset
+        self._masks = {}
+        self._blobs = {}
+
+    @property
+    def colors(self):
+        return self.lut.colors
+
+    def mask(self, color):
+        """0/255 mask of color with the opening and closing applied."""
+        if color not in self._masks:
+            mask = self.lut.mask(None, color, codes=self.codes)
+            if self.open_kernel is not None:
+                mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.open_kernel)
+            if self.close_kernel is not None:
+                mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.close_kernel)
+            self._masks[color] = mask
+        return self._masks[color]
+
+    def seed_mask(self, color, mask):
+        """Use an already cleaned mask for color, e.g. one a VisionPipeline computed anyway."""
+        self._masks[color] = mask
+
+    def blobs(self, color):
+        """Connected components of color's mask, with stats, largest first."""
+        if color not in self._blobs:
+            mask = self.mask(color)
+            n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            ids = np.flatnonzero(areas >= self.min_area)
+            ids = ids[np.argsort(areas[ids])[::-1]] + 1  # largest first, skipping background label 0
+            x0, y0 = self.offset
+            boxes = stats[ids, :4] + (x0, y0, 0, 0)
+            self._blobs[color] = Blobs(labels, ids, stats[ids, cv2.CC_STAT_AREA],
+                                       centroids[ids] + (x0, y0), boxes)
+        return self._blobs[color]
+
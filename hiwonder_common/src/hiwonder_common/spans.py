@@ -0,0 +1,105 @@
+"""
+Low-overhead timing spans for the hot path.
+
+A SpanRing records (stage, start, duration) for every timed stage of every
+loop into fixed-size arrays allocated up front, overwriting the oldest spans
+once full. Recording a span is one perf_counter_ns() call and three array
+stores (about a microsecond all told), so it can stay on in the field, where it
+answers "which stage got slow?" after the fact. The arrays are stdlib
+array.arrays, since storing a Python int into one is several times cheaper
+than into a numpy array; they're viewed as numpy arrays for analysis.
+
+Stages are registered by name up front and recorded by integer id. Spans can
+be recorded from several threads: the write position comes from an
+itertools.count, whose next() is atomic under the GIL.
+
+Example:
+spans = SpanRing(['wait', 'detect', 'control'])
+WAIT, DETECT, CONTROL = range(3)
+t = spans.now()
+frame = wait_for_frame()
+t = spans.lap(WAIT, t)  # records the span since t, and returns the end of it
+detect(frame)
+t = spans.lap(DETECT, t)
+...
+spans.summary()  # {'detect': {'count': ..., 'mean_us': ..., 'p95_us': ...}, ...}
+spans.dump('spans.npz')
+"""
+
+import json
+import time
+import array
+import itertools
+
+import numpy as np
+
+
+class SpanRing:
+    def __init__(self, names, capacity=4096):
+        self.names = tuple(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.capacity = capacity
+        self.stage = array.array('H', bytes(2 * capacity))
+        self.start = array.array('q', bytes(8 * capacity))  # perf_counter_ns()
+        self.duration = array.array('q', bytes(8 * capacity))  # ns
+        self._counter = itertools.count()
+        self._written = 0  # lower bound on spans written; exact when no record() is in progress
+
+    now = staticmethod(time.perf_counter_ns)
+
+    def record(self, stage, start, end):
+        n = next(self._counter)
+        i = n % self.capacity
+        self.stage[i] = stage
+        self.start[i] = start
+        self.duration[i] = end - start
+        self._written = n + 1
+
+    def lap(self, stage, start):
+        """Record stage as running from start until now. Returns now, to start the next span."""
+        end = time.perf_counter_ns()
+        self.record(stage, start, end)
+        return end
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    def snapshot(self):
+        """Return (stage, start, duration) copies of the recorded spans, oldest first."""
+        n = self._written
+        stage, start, duration = (np.frombuffer(a, a.typecode) for a in (self.stage, self.start, self.duration))
+        if n <= self.capacity:
+            return stage[:n].copy(), start[:n].copy(), duration[:n].copy()
+        order = np.roll(np.arange(self.capacity), -(n % self.capacity))
+        return stage[order], start[order], duration[order]
+
+    def summary(self):
+        """Per-stage count and duration statistics (microseconds) over the recorded spans."""
+        stage, start, duration = self.snapshot()
+        out = {}
+        for i, name in enumerate(self.names):
+            d = duration[stage == i] / 1E3
+            if not len(d):
+                continue
+            p50, p95, p99 = np.percentile(d, (50, 95, 99))
+            out[name] = {
+                'count': int(len(d)),
+                'mean_us': round(float(d.mean()), 1),
+                'p50_us': round(float(p50), 1),
+                'p95_us': round(float(p95), 1),
+                'p99_us': round(float(p99), 1),
+                'max_us': round(float(d.max()), 1),
+                'total_ms': round(float(d.sum()) / 1E3, 2),
+            }
+        return out
+
+    def report(self):
+        """summary() as compact JSON bytes, small enough for a UDP reply."""
+        return json.dumps(self.summary(), separators=(',', ':')).encode('utf-8')
+
+    def dump(self, path):
+        """Save the recorded spans to an .npz file, oldest first."""
+        stage, start, duration = self.snapshot()
+        with open(path, 'wb') as f:
+            np.savez(f, names=np.array(self.names), stage=stage, start_ns=start, duration_ns=duration)
+        return path
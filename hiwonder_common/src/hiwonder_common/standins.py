@@ -0,0 +1,181 @@
+"""
+Stand-ins for TurboPi hardware, for running programs without the robot's peripherals.
+
+StandInCamera has the same interface as TurboPi's Camera.Camera: a capture
+thread that assigns a new image to .frame, camera_open() and camera_close().
+Its frames are a synthetic scene: a green target sweeping back and forth
+across a grey background, so detection, control and previews have something
+to work on.
+
+install() goes further, for running on a plain Linux box (benchmarks, CI):
+any of Camera, HiwonderSDK.Board, HiwonderSDK.mecanum and RPi.GPIO that
+can't be imported is replaced in sys.modules by a module of stand-ins that
+record what was asked of them and do nothing else. Call it before importing
+the program.
+
+Example:
+camera = frames.publishing_camera(StandInCamera)()
+camera.camera_open()
+
+standins.install()
+import milling_controller
+"""
+
+import sys
+import time
+import types
+import importlib
+import threading
+
+import numpy as np
+
+
+class StandInCamera:
+    def __init__(self, resolution=(640, 480), fps=30.0, target_bgr=(40, 200, 40), background_bgr=(128, 128, 128)):
+        self.width, self.height = resolution
+        self.fps = fps
+        self.target_bgr = target_bgr
+        self.background_bgr = background_bgr
+        self.frame = None
+        self.opened = False
+        self.correction = False
+        self.n_frames = 0
+        self.th = threading.Thread(target=self.camera_task, name='standin-camera', daemon=True)
+        self.th.start()
+
+    def camera_open(self, correction=False):
+        self.correction = correction  # there's no lens to correct; accepted for compatibility
+        self.opened = True
+
+    def camera_close(self):
+        self.opened = False
+        self.frame = None
+
+    def render(self, i, out=None):
+        """The i-th frame of the scene, drawn into out if given."""
+        img = np.empty((self.height, self.width, 3), np.uint8) if out is None else out
+        img[:] = self.background_bgr
+        size = self.height // 6
+        span = self.width - size
+        x = i * 8 % (2 * span)
+        x = x if x < span else 2 * span - x  # bounce off the edges
+        y = (self.height - size) // 2
+        img[y:y + size, x:x + size] = self.target_bgr
+        return img
+
+    def camera_task(self):
+        period = 1 / self.fps
+        t_next = time.monotonic()
+        while True:
+            if self.opened:
+                # straight into a recycled buffer, if frames go to a FrameSource (see frames.publishing_camera)
+                source = getattr(self, 'frame_source', None)
+                out = source.acquire((self.height, self.width, 3)) if source is not None else None
+                self.frame = self.render(self.n_frames, out)
+                self.n_frames += 1
+            t_next = max(t_next + period, time.monotonic())
+            time.sleep(max(0.0, t_next - time.monotonic()))
+
+
+class StandInChassis:
+    """HiwonderSDK.mecanum.MecanumChassis look-alike."""
+
+    def __init__(self, *args, **kwargs):
+        self.velocity = (0, 0, 0)
+        self.commands = 0
+
+    def set_velocity(self, velocity, direction, angular_rate, fake=False):
+        self.velocity = (velocity, direction, angular_rate)
+        self.commands += 1
+
+    def reset_motors(self):
+        self.set_velocity(0, 0, 0)
+
+
+class StandInPixels:
+    """Board.RGB look-alike: the expansion board's two RGB LEDs."""
+
+    def __init__(self, n=2):
+        self.pixels = [0] * n
+        self.shows = 0
+
+    def setPixelColor(self, i, color):
+        self.pixels[i] = color
+
+    def show(self):
+        self.shows += 1
+
+
+def make_board_module():
+    board = types.ModuleType('HiwonderSDK.Board')
+    board.RGB = StandInPixels()
+    board.PixelColor = lambda r, g, b: (r << 16) | (g << 8) | b
+    board.servo_pulses = {}
+    board.setPWMServoPulse = lambda servo, pulse, use_time=1000: board.servo_pulses.__setitem__(servo, pulse)
+    board.setBuzzer = lambda state: None
+    board.getBattery = lambda: 8000  # mV
+    return board
+
+
+def make_mecanum_module():
+    mecanum = types.ModuleType('HiwonderSDK.mecanum')
+    mecanum.MecanumChassis = StandInChassis
+    return mecanum
+
+
+def make_gpio_module():
+    gpio = types.ModuleType('RPi.GPIO')
+    gpio.BOARD, gpio.BCM = 10, 11
+    gpio.IN, gpio.OUT = 1, 0
+    gpio.LOW, gpio.HIGH = 0, 1
+    gpio.PUD_OFF, gpio.PUD_DOWN, gpio.PUD_UP = 20, 21, 22
+    gpio.RISING, gpio.FALLING, gpio.BOTH = 31, 32, 33
+    gpio.levels = {}  # pin -> level, for outputs and for tests to set inputs
+    gpio.setmode = gpio.setwarnings = gpio.cleanup = lambda *args, **kwargs: None
+    gpio.setup = lambda pin, mode, pull_up_down=None, initial=None: gpio.levels.setdefault(pin, gpio.HIGH)
+    gpio.output = lambda pin, value: gpio.levels.__setitem__(pin, int(value))
+    gpio.input = lambda pin: gpio.levels.get(pin, gpio.HIGH)
+    gpio.add_event_detect = gpio.remove_event_detect = lambda *args, **kwargs: None
+    return gpio
+
+
+def make_camera_module():
+    camera = types.ModuleType('Camera')
+    camera.Camera = StandInCamera
+    return camera
+
+
+def _package(name, **children):
+    package = types.ModuleType(name)
+    package.__path__ = []
+    for child, module in children.items():
+        setattr(package, child, module)
+        sys.modules[f"{name}.{child}"] = module
+    sys.modules[name] = package
+
+
+def _importable(name):
+    try:
+        importlib.import_module(name)
+    except Exception:  # RPi.GPIO raises RuntimeError when it's not on a Pi, for one
+        return False
+    return True
+
+
+def install(force=False):
+    """
+    Put stand-ins in sys.modules for any hardware modules that can't be imported.
+
+    With force=True, stand-ins replace the real modules too. Returns the names replaced.
+    """
+    replaced = []
+    if force or not _importable('Camera'):
+        sys.modules['Camera'] = make_camera_module()
+        replaced.append('Camera')
+    if force or not (_importable('HiwonderSDK.Board') and _importable('HiwonderSDK.mecanum')):
+        _package('HiwonderSDK', Board=make_board_module(), mecanum=make_mecanum_module())
+        replaced.append('HiwonderSDK')
+    if force or not _importable('RPi.GPIO'):
+        _package('RPi', GPIO=make_gpio_module())
+        replaced.append('RPi.GPIO')
+    return replaced
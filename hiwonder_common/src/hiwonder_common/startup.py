@@ -0,0 +1,150 @@
+"""
+Helpers for starting up quickly, and for measuring how quickly we did.
+
+The time that matters is from the button press to the robot moving. Most of
+it is spent importing, probing hardware and waiting on things that could
+happen at the same time. This module has the pieces to avoid that:
+
+- lazy_import(): a module that's only imported when first used, for
+  modules that only some options need.
+- in_background(): run slow setup (opening the camera, registering with
+  buttonman) in a thread, and pick up its result (or exception) later.
+- display_available(): cache the slow "can we open a window?" probe, keyed
+  by the display and opencv version.
+- PhaseTimer: times each startup phase from process start, including the
+  interpreter's own startup and imports (or from the fork, in a forked
+  child).
+
+Example:
+timer = PhaseTimer()  # as early as possible
+mecanum = lazy_import('HiwonderSDK.mecanum')
+camera = in_background(open_camera)
+with timer.phase('config'):
+    load_config()
+camera = camera.result()  # raises if opening the camera did
+timer.mark('ready')
+print(timer.report())
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import importlib.util
+import concurrent.futures
+
+
+def lazy_import(name):
+    """Return module name, which will be imported on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def in_background(func, *args, name=None, **kwargs):
+    """Start func(*args, **kwargs) in a daemon thread. Returns a concurrent.futures.Future of its result."""
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as err:
+            future.set_exception(err)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+def process_age():
+    """Seconds since this process started (to within a clock tick), or None if unknown."""
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name (field 2) may contain spaces, so count fields from after it
+            starttime = int(f.read().rpartition(')')[2].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - starttime / os.sysconf('SC_CLK_TCK'))
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.restart()
+        # A forked child (e.g. from buttonman's zygote) started at the fork, not when we did.
+        os.register_at_fork(after_in_child=self.restart)
+
+    def restart(self):
+        age = process_age()
+        self.t0 = time.perf_counter() - (age or 0.0)  # process start, on the perf_counter() clock
+        self.phases = []  # (name, seconds since start, duration or None)
+        self._lock = threading.Lock()  # in case it was held at a fork
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def mark(self, name):
+        """Note that name happened now."""
+        with self._lock:
+            self.phases.append((name, self.elapsed(), None))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of the with block as phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append((name, end - self.t0, end - start))
+
+    def report(self):
+        parts = []
+        for name, at, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            parts.append(f"{name} {at:.2f}" if duration is None else f"{name} {at:.2f} ({duration:.2f})")
+        return "Startup (s since process start, (phase duration)): " + ", ".join(parts)
+
+
+def display_available(probe, cache_dir=None):
+    """
+    Whether windows can be shown, from probe() or a cached result of it.
+
+    Without $DISPLAY or $WAYLAND_DISPLAY there's nothing to show windows on,
+    so probe() isn't called at all. Otherwise its result is cached per
+    display and opencv version.
+    """
+    display = os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')
+    if not display and sys.platform.startswith('linux'):
+        return False
+    import cv2  # already imported by whoever's asking, if they want windows
+    from .colorlut import default_cache_dir
+
+    key = hashlib.sha1(json.dumps([display, cv2.__version__]).encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(default_cache_dir() if cache_dir is None else cache_dir, f"display-{key}.json")
+    try:
+        with open(path) as f:
+            return bool(json.load(f))
+    except (OSError, ValueError):
+        pass
+    available = bool(probe())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(available, f)
+    except OSError as err:
+        print(f"Couldn't cache display check to {path}: {err}")
+    return available
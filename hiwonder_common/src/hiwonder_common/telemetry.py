@@ -0,0 +1,185 @@
+"""
+Fleet telemetry: each robot multicasts a small fixed-size status datagram.
+
+A TelemetrySender runs in its own thread. A few times a second it calls a
+snapshot function for the robot's current state, packs it into a STATUS
+struct (53 bytes), and sends it to a multicast group with a non-blocking
+socket. The control loop doesn't call anything: the snapshot just reads
+attributes it already keeps. A send that would block, or fails because the
+network is down, is counted and dropped.
+
+A TelemetryReceiver joins the group and unpacks what arrives. See
+swarm_monitor.py for a live table of the whole fleet.
+
+Example:
+sender = TelemetrySender(lambda: {'fps': program.fps, 'detected': program.detected}, rate=2.0)
+sender.start()
+
+receiver = TelemetryReceiver()
+addr, status = receiver.recv(timeout=1.0)  # (None, None) on timeout
+print(status.name, status.fps, status.battery_mv)
+"""
+
+import time
+import socket
+import struct
+import threading
+from typing import NamedTuple
+
+GROUP = '239.27.27.27'
+PORT = 27273
+MAGIC = b'TPst'
+VERSION = 1
+
+# magic, version, flags, name, seq, time_ns, smoothed, fps, latency_ms, battery_mv, quality, area
+STATUS = struct.Struct('!4sBB16sIQfffHBI')
+
+# flags
+DETECTED, RUNNING, DRY_RUN = 1, 2, 4
+
+
+class Status(NamedTuple):
+    name: str  # hostname, up to 16 bytes
+    seq: int  # counts up from 0 with every datagram from this sender
+    time_ns: int  # sender's wall clock (time.time_ns()) when sent
+    detected: bool
+    running: bool  # False while paused
+    dry_run: bool
+    smoothed: float  # low-pass filtered detection, 0-1
+    fps: float
+    latency_ms: float  # capture to detection, for the newest frame
+    battery_mv: int  # 0 if unknown
+    quality: int  # quality level index, see governor.py
+    area: int  # target area in pixels, at the processing resolution
+
+
+FIELDS = Status._fields
+
+
+def pack(status):
+    flags = (DETECTED * bool(status.detected)) | (RUNNING * bool(status.running)) | (DRY_RUN * bool(status.dry_run))
+    return STATUS.pack(MAGIC, VERSION, flags, status.name.encode('utf-8')[:16], status.seq & 0xFFFFFFFF,
+                       status.time_ns, status.smoothed, status.fps, status.latency_ms,
+                       max(0, min(int(status.battery_mv), 0xFFFF)), status.quality & 0xFF,
+                       max(0, min(int(status.area), 0xFFFFFFFF)))
+
+
+def unpack(data):
+    """A Status, or None if data isn't a status datagram (of this version)."""
+    if len(data) != STATUS.size or not data.startswith(MAGIC):
+        return None
+    (_, version, flags, name, seq, time_ns, smoothed, fps, latency_ms,
+     battery_mv, quality, area) = STATUS.unpack(data)
+    if version != VERSION:
+        return None
+    return Status(name.rstrip(b'\0').decode('utf-8', 'replace'), seq, time_ns,
+                  bool(flags & DETECTED), bool(flags & RUNNING), bool(flags & DRY_RUN),
+                  smoothed, fps, latency_ms, battery_mv, quality, area)
+
+
+class TelemetrySender:
+    def __init__(self, snapshot, rate=2.0, group=GROUP, port=PORT, name=None, ttl=1, battery=None,
+                 battery_interval=5.0):
+        """
+        snapshot: returns a dict of Status fields (any left out are zero). Called from the sender thread.
+        rate: datagrams per second
+        name: defaults to the hostname
+        ttl: multicast hops. 1 keeps it on the local network.
+        battery: returns the battery voltage in mV (e.g. Board.getBattery), read every battery_interval seconds
+        """
+        self.snapshot = snapshot
+        self.period = 1 / rate
+        self.address = (group, port)
+        self.name = name or socket.gethostname()
+        self.battery = battery
+        self.battery_interval = battery_interval
+        self.battery_mv = 0
+        self.sent = self.dropped = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # so a monitor on the robot sees it
+        self.sock.setblocking(False)
+        self._seq = 0
+        self._t_battery = float('-inf')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def status(self):
+        fields = dict.fromkeys(FIELDS, 0)
+        fields.update(self.snapshot())
+        fields.update(name=self.name, seq=self._seq, time_ns=time.time_ns(), battery_mv=self.read_battery())
+        return Status(**fields)
+
+    def read_battery(self):
+        now = time.monotonic()
+        if self.battery is not None and now - self._t_battery >= self.battery_interval:
+            self._t_battery = now
+            try:
+                self.battery_mv = int(self.battery())
+            except Exception:  # e.g. the I2C read failed. Try again next interval.
+                pass
+        return self.battery_mv
+
+    def send(self):
+        data = pack(self.status())
+        self._seq += 1
+        try:
+            self.sock.sendto(data, self.address)
+        except OSError:  # would block, or no network. Telemetry is best effort.
+            self.dropped += 1
+            return False
+        self.sent += 1
+        return True
+
+    def run(self):
+        t_next = time.monotonic()
+        while not self._stop.wait(max(0.0, t_next - time.monotonic())):
+            t_next = max(t_next + self.period, time.monotonic())  # don't burst to catch up after a stall
+            try:
+                self.send()
+            except Exception as err:  # a bad snapshot shouldn't take the robot down
+                self.dropped += 1
+                print(f"Telemetry: {type(err).__name__}: {err}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self.sock.close()
+
+
+class TelemetryReceiver:
+    def __init__(self, group=GROUP, port=PORT, interface='0.0.0.0'):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # several monitors on one machine
+        self.sock.bind(('', port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+    def recv(self, timeout=None):
+        """(sender address, Status) for the next status datagram, or (None, None) on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                self.sock.settimeout(None)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, None
+                self.sock.settimeout(remaining)
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                return None, None
+            status = unpack(data)
+            if status is not None:
+                return addr, status
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,178 @@
+"""
+Allocation-free vision pipeline for color target detection.
+
+Doing the resize -> blur -> threshold -> open/close -> contours sequence with
+plain cv2 calls allocates a new array at every step, every frame. On the Pi,
+that allocator churn (and the GC pauses it brings) shows up as fps jitter.
+
+A VisionPipeline is built once from config. It caches the structuring
+elements and threshold tuples, and owns a buffer for every stage, which it
+passes to cv2 as dst= so that, once warmed up, a frame allocates nothing but
+the contours that cv2.findContours() returns.
+
+Buffers are sized for the full processing resolution. When only a window of
+the frame is processed (see roi.py), each stage uses a contiguous prefix of
+its buffer, so nothing is reallocated when the window changes size.
+
+The pipeline's buffers are reused every frame, so anything it returns that
+isn't a contour (masks, the segmentation) is only valid until the next frame.
+Use one pipeline per thread.
+
+Example:
+vision = VisionPipeline.from_config(lab_data, lut=ColorLUT.from_config(lab_data))
+target_contours = vision.find_target(camera_frame, 'green')  # [(contour, area)] of the largest blob, if any
+"""
+
+import math
+import operator
+
+import cv2
+import numpy as np
+
+from . import colorlut
+from . import segmentation as seg
+
+
+def find_contours(mask, offset=(0, 0), top_k=1):
+    """
+    Return [(contour, area), ...] of the top_k largest external contours in mask, largest first.
+
+    top_k=None returns every contour. Contours are compressed
+    (CHAIN_APPROX_SIMPLE): the area, bounding box and fitted rect are the same
+    as from the full chain, with far fewer points. Only the top_k are sorted,
+    so a noisy mask with hundreds of specks doesn't cost a full sort.
+
+    offset is added to the contour points, so that contours found in a
+    cropped window are in full-frame coordinates.
+    """
+    if not cv2.countNonZero(mask):
+        return []
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)[-2]
+    n = len(contours)
+    areas = np.fromiter((cv2.contourArea(contour) for contour in contours), np.float64, n)
+    if top_k is None or top_k >= n:
+        order = np.argsort(areas)[::-1]
+    elif top_k == 1:
+        order = (int(np.argmax(areas)),)
+    else:
+        order = np.argpartition(areas, n - top_k)[n - top_k:]  # the top_k, unordered
+        order = order[np.argsort(areas[order])[::-1]]
+    return [(contours[i], float(areas[i])) for i in order]
+
+
+class Buffer:
+    """Preallocated array that hands out contiguous views of any shape up to its size."""
+
+    def __init__(self, shape, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.flat = np.empty(int(np.prod(self.shape)), dtype)
+
+    def view(self, h, w):
+        return self.flat[:h * w * int(np.prod(self.shape[2:]))].reshape((h, w) + self.shape[2:])
+
+
+class VisionPipeline:
+    def __init__(self,
+        thresholds,
+        size=(640, 480),
+        blur_ksize=(3, 3),
+        blur_sigma=3,
+        open_kernel=None,
+        close_kernel=None,
+        lut=None,
+        remap=None,
+    ):
+        """
+        thresholds: {color: ((L, A, B) min, (L, A, B) max)}, see colorlut.lab_thresholds()
+        size: (width, height) frames are resized to before detection
+        blur_ksize: Gaussian blur kernel size, or None to skip the blur
+        lut: optional colorlut.ColorLUT. If given, colors in it are thresholded through it
+            instead of cvtColor() + inRange(), and every color is segmented at once.
+        remap: optional remap.UndistortRemap from camera frames to size. If given, frames are
+            undistorted and resized in one cv2.remap() instead of just resized.
+        """
+        self.thresholds = {color: (tuple(lo), tuple(hi)) for color, (lo, hi) in thresholds.items()}
+        self.size = tuple(size)
+        self.blur_ksize = None if blur_ksize is None else tuple(blur_ksize)
+        self.blur_sigma = blur_sigma
+        self.open_kernel = open_kernel
+        self.close_kernel = close_kernel
+        self.lut = lut
+        self.remap = remap
+        self.segmentation = None  # of the last frame, if thresholded through the lut
+
+        w, h = self.size
+        self.resized = Buffer((h, w, 3))
+        self.blurred = Buffer((h, w, 3))
+        self.lab = Buffer((h, w, 3))
+        self.mask = Buffer((h, w))
+        self.opened = Buffer((h, w))
+        self.closed = Buffer((h, w))
+        if lut is not None:
+            self.codes = Buffer((h, w), lut.table.dtype)
+            self.code_bits = Buffer((h, w), lut.table.dtype)
+            self.index = Buffer((h, w), np.intp)
+            self.channel = Buffer((h, w), np.intp)
+
+    @classmethod
+    def from_config(cls, lab_data, **kwargs):
+        kwargs.setdefault('open_kernel', np.ones((3, 3), np.uint8))
+        kwargs.setdefault('close_kernel', np.ones((3, 3), np.uint8))
+        return cls(colorlut.lab_thresholds(lab_data), **kwargs)
+
+    def prepare(self, raw, window=None):
+        """Resize raw (or just the window (x, y, w, h) of it, in resized coordinates) and blur it."""
+        w, h = self.size if window is None else window[2:]
+        resized = self.resized.view(h, w)
+        if self.remap is not None:
+            self.remap.apply(raw, dst=resized, window=window)
+        elif window is None:
+            cv2.resize(raw, self.size, dst=resized, interpolation=cv2.INTER_NEAREST)
+        else:
+            x, y = window[:2]
+            sx, sy = raw.shape[1] / self.size[0], raw.shape[0] / self.size[1]
+            crop = raw[round(y * sy):round((y + h) * sy), round(x * sx):round((x + w) * sx)]
+            if crop.shape[:2] == (h, w):
+                resized = crop  # no resize needed, blur straight from the camera frame
+            else:
+                cv2.resize(crop, (w, h), dst=resized, interpolation=cv2.INTER_NEAREST)
+        if self.blur_ksize is None:
+            return resized
+        return cv2.GaussianBlur(resized, self.blur_ksize, self.blur_sigma, dst=self.blurred.view(h, w))
+
+    def threshold(self, blurred, color, offset=(0, 0)):
+        """Return the 0/255 mask of color in a blurred BGR frame from prepare()."""
+        h, w = blurred.shape[:2]
+        mask = self.mask.view(h, w)
+        if self.lut is not None and color in self.lut:
+            codes = self.lut.codes(blurred, out=self.codes.view(h, w), index=self.index.view(h, w),
+                                   scratch=self.channel.view(h, w))
+            self.segmentation = seg.Segmentation(codes, self.lut, self.open_kernel, self.close_kernel,
+                                                 offset=offset)
+            return self.lut.mask(None, color, codes=codes, out=mask, scratch=self.code_bits.view(h, w))
+        self.segmentation = None
+        lab = cv2.cvtColor(blurred, cv2.COLOR_BGR2LAB, dst=self.lab.view(h, w))
+        return cv2.inRange(lab, *self.thresholds[color], dst=mask)
+
+    def clean(self, mask):
+        """Opening and closing on the mask."""
+        # https://youtu.be/1owu136z1zI?feature=shared&t=34
+        h, w = mask.shape
+        if self.open_kernel is not None:
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.open_kernel, dst=self.opened.view(h, w))
+        if self.close_kernel is not None:
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.close_kernel, dst=self.closed.view(h, w))
+        return mask
+
+    def find_target(self, raw, color, window=None, top_k=1):
+        """
+        Return [(contour, area), ...] of the top_k blobs of color in raw, largest first.
+
+        Contours are in resized-frame coordinates. top_k=None returns every blob.
+        """
+        offset = (0, 0) if window is None else tuple(window[:2])
+        blurred = self.prepare(raw, window)
+        mask = self.clean(self.threshold(blurred, color, offset))
+        if self.segmentation is not None:
+            self.segmentation.seed_mask(color, mask)
+        return find_contours(mask, offset, top_k)
@@ -5,17 +5,16 @@ import sys
 
 sys.path.append('/home/pi/TurboPi/')
 sys.path.append('/home/pi/boot/')
+import hiwonder_common.startup as startup
+startup_timer = startup.PhaseTimer()  # before the slow imports, so they're counted
+
 import os
 import cv2
 import time
-import math
 import signal
 import Camera
-import yaml
 import numpy as np
-import operator
 import argparse
-import socket
 import threading
 import RPi.GPIO as GPIO
 
@@ -24,18 +23,36 @@ import HiwonderSDK.Board as Board
 import HiwonderSDK.mecanum as mecanum
 
 import hiwonder_common.statistics_tools as st
+import hiwonder_common.colorlut as colorlut
+import hiwonder_common.segmentation as segmentation
+import hiwonder_common.roi as roi
+import hiwonder_common.pipeline as pipeline
+import hiwonder_common.frames as frames
+import hiwonder_common.vision as vision
+import hiwonder_common.render as render
+import hiwonder_common.remap as remap
+import hiwonder_common.governor as governor
+import hiwonder_common.spans as spans
+import hiwonder_common.latency as latency
+import hiwonder_common.config as config
+import hiwonder_common.actuators as actuators
+import hiwonder_common.commands as commands
+import hiwonder_common.telemetry as telemetry
+import hiwonder_common.clocksync as clocksync
+# only some options need these, so they're imported on first use
+procpool = startup.lazy_import('hiwonder_common.procpool')
+mjpeg = startup.lazy_import('hiwonder_common.mjpeg')
+standins = startup.lazy_import('hiwonder_common.standins')
+recorder = startup.lazy_import('hiwonder_common.recorder')
 
 # typing
-from typing import Any
+from typing import Any, NamedTuple
 
 import warnings
-try:
-    import buttonman as buttonman
-    buttonman.TaskManager.register_stoppable()
-except ImportError:
-    buttonman = None
-    warnings.warn("buttonman was not imported, so no processes can be registered. This means the process can't be stopped by buttonman.",  # noqa: E501
-                  ImportWarning, stacklevel=2)
+# imported (with psutil) in the background by BinaryProgram.register_buttonman(), as it's slow to import
+buttonman = None
+
+startup_timer.mark('imports')
 
 
 KEY1_PIN = 33  # board numbering
@@ -46,52 +63,22 @@ BUZZER_PIN = 31
 # path = '/home/pi/TurboPi/'
 THRESHOLD_CFG_PATH = '/home/pi/TurboPi/lab_config.yaml'
 SERVO_CFG_PATH = '/home/pi/TurboPi/servo_config.yaml'
+CALIBRATION_PATH = '/home/pi/TurboPi/CameraCalibration/calibration_param.npz'
 
-UDP_PORT = 27272
-MAGIC = b'pi__F00#VML'
-
-listener_run = True
-
+UDP_PORT = 27272  # remote control, see hiwonder_common/commands.py
+MAGIC = commands.MAGIC
 
-def udp_listener(program):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # create UDP socket
-    s.settimeout(1)
-    s.bind(('', UDP_PORT))
+MIN_TARGET_AREA = 300  # pixels, at 640x480. Scaled with the processing resolution.
 
-    def act(data, addr):
-        split = data.split(b"cmd:\n", 1)
-        try:
-            cmd = split[1]
-        except IndexError:
-            return
-
-        if b'halt' in cmd or b'stop' in cmd:
-            global listener_run
-            listener_run = False
-            program._run = False
-            program._stop_soon = True
-            return True
-        if b'unpause' in cmd or b'resume' in cmd:
-            program.resume()
-        elif b'pause' in cmd:
-            program.pause()
-
-    while listener_run:
-        try:
-            data, addr = s.recvfrom(1024)  # wait for a packet
-        except socket.timeout:
-            continue
-        if data.startswith(MAGIC):
-            stop = act(data[len(MAGIC):], addr)
-            if stop:
-                return
+# hot-path stages timed into BinaryProgram.spans, see hiwonder_common/spans.py
+SPAN_NAMES = ('wait', 'detect', 'control', 'rgb', 'chassis', 'render', 'submit', 'collect')
+SPAN_WAIT, SPAN_DETECT, SPAN_CONTROL, SPAN_RGB, SPAN_CHASSIS, SPAN_RENDER, SPAN_SUBMIT, SPAN_COLLECT = \
+    range(len(SPAN_NAMES))
 
 
 def get_yaml_data(yaml_file):
-    with open(yaml_file, 'r', encoding='utf-8') as file:
-        file_data = file.read()
-
-    return yaml.load(file_data, Loader=yaml.FullLoader)
+    # parsed with libyaml if available, and cached until the file changes. see hiwonder_common/config.py
+    return config.load_yaml(yaml_file)
 
 
 range_bgr = {
@@ -103,6 +90,13 @@ range_bgr = {
 }
 
 
+class Detection(NamedTuple):
+    contour: np.ndarray  # biggest contour of the target color, or None
+    area: float
+    detected: bool
+    smoothed: float  # low-pass filtered detection
+
+
 class BinaryProgram:
     def __init__(self,
         dry_run: bool = False,
@@ -111,27 +105,125 @@ class BinaryProgram:
         servo_cfg_path=SERVO_CFG_PATH,
         pause=False,
         startup_beep=True,
-        exit_on_stop=True
+        exit_on_stop=True,
+        lab_lut=True,
+        roi_tracking=False,
+        backend='serial',
+        workers=3,
+        preview_port=None,
+        preview_host='',
+        preview_fps=10.0,
+        preview_quality=70,
+        standin_camera=False,
+        fused_undistort=True,
+        calibration_path=CALIBRATION_PATH,
+        target_fps=None,
+        latency_budget=0.1,
+        span_capacity=4096,
+        spans_path=None,
+        latency_log_interval=10.0,
+        watch_config=True,
+        fast_start=False,
+        chassis_interval=0.03,
+        rgb_interval=0.1,
+        command_port=UDP_PORT,
+        telemetry_rate=0,
+        telemetry_group=telemetry.GROUP,
+        telemetry_port=telemetry.PORT,
+        record_path=None,
+        record_quality=90,
     ) -> None:
         self._run = not pause
-        self._stop_soon = False
-        self.listener = None
-        self.preview_size = (640, 480)
+        self.stop_requested = threading.Event()  # set by request_stop(), e.g. from a remote command
+        self._wake = threading.Event()  # set on resume or stop, so a paused loop notices straight away
+        # RESUME_AT/PAUSE_AT commands, run at a time synchronized across the fleet. see hiwonder_common/clocksync.py
+        self.scheduler = clocksync.Scheduler()
+        self.command_port = command_port  # None for no remote control
+        self.command_server: commands.CommandServer | None = None
+        # status multicast to the fleet, see hiwonder_common/telemetry.py and swarm_monitor.py
+        self.telemetry_rate = telemetry_rate  # per second, or None/0 for no telemetry
+        self.telemetry_address = (telemetry_group, telemetry_port)
+        self.telemetry: telemetry.TelemetrySender | None = None
+        # frames, detections and commands, for replay.py. see hiwonder_common/recorder.py
+        self.record_path = record_path
+        self.record_quality = record_quality  # JPEG quality of recorded frames
+        self.recorder: recorder.Recorder | None = None
+        self.backend = backend  # 'serial': one loop does everything. 'threaded': see build_pipeline()
+        self.workers = workers  # vision processes for the 'processes' backend
+        self.pipeline: pipeline.Pipeline | None = None
+        self.frames: frames.FrameSource | None = None  # self.camera's frames
+        self._last_seq = 0  # sequence number of the last frame we worked on
+        self.camera_size = (640, 480)  # Camera.Camera() default resolution
+        self.vision_pool: procpool.VisionPool | None = None
+
+        # Processing resolution, blur and ROI padding. The governor steps down this ladder when we
+        # can't keep up with target_fps or latency_budget, and back up when we can.
+        # see hiwonder_common/governor.py
+        self.quality_ladder = governor.DEFAULT_LADDER
+        self.quality = 0  # index into self.quality_ladder
+        self.governor: governor.QualityGovernor | None = None
+        if target_fps:
+            self.governor = governor.QualityGovernor(target_fps, latency_budget, self.quality_ladder)
+        self.preview_size = self.quality_level.size
+        self.min_target_area = MIN_TARGET_AREA
+        # the last span_capacity stage timings, queryable over UDP ('spans') and dumped to spans_path on stop
+        self.spans = spans.SpanRing(SPAN_NAMES, span_capacity)
+        self.spans_path = spans_path
+        # how old each frame is (since capture) when we pick it up, start and finish detecting it,
+        # and act on it. see hiwonder_common/latency.py
+        self.latency = latency.LatencyTracker(('capture', 'dequeue', 'detect', 'command'),
+                                              latency_log_interval or None)
 
         self.target_color = ('green')
-        self.chassis = mecanum.MecanumChassis()
+        # search only around the last detection, see hiwonder_common/roi.py
+        self.roi = roi.RoiTracker(self.preview_size, self.quality_level.roi_pad) if roi_tracking else None
+        # Repeated motor and LED commands are dropped, and writes are rate limited (except stops).
+        # see hiwonder_common/actuators.py
+        self.chassis = actuators.CoalescingChassis(mecanum.MecanumChassis(), chassis_interval)
 
         self.camera: Camera.Camera | None = None
+        self.standin_camera = standin_camera  # synthetic frames instead of the real camera
+        # undistort and resize to preview_size in one remap, see hiwonder_common/remap.py
+        # If None, the camera does its own (full-resolution) distortion correction.
+        self.undistort: remap.UndistortRemap | None = None
+        self.undistort_maps: dict[tuple[int, int], remap.UndistortRemap] = {}  # by processing resolution
+        if fused_undistort and not standin_camera:  # the stand-in camera has no lens to correct
+            with startup_timer.phase('undistort maps'):
+                self.undistort = self.load_undistort(calibration_path)
+                if self.undistort and self.governor:
+                    # for every level up front (they're cached on disk), so a step down doesn't stall on them
+                    for level in self.quality_ladder:
+                        self.undistort_for(level.size)
+
+        # fast_start: open the camera while we load everything else, and trust the cached display check.
+        # The processes backend has to fork its workers before the camera thread starts, so it can't.
+        self.fast_start = fast_start
+        self._camera_opening = None  # Future of open_camera(), if it's running in the background
+        if fast_start and backend != 'processes':
+            self._camera_opening = startup.in_background(self.open_camera, name='camera-open')
 
         self.lab_cfg_path = lab_cfg_path
         self.servo_cfg_path = servo_cfg_path
+        # reload the configs when they change on disk, see reload_config()
+        self.watch_config = watch_config
+        self.config_watcher: config.ConfigWatcher | None = None
+        self._config_lock = threading.RLock()  # held while swapping in anything derived from lab_data
+        self.lab_config_stamp = None  # config.file_stamp() of the loaded lab config
+        self.servo_config_stamp = None  # and of the servo config
 
         self.lab_data: dict[str, Any]
         self.servo_data: dict[str, Any]
-        self.load_lab_config(lab_cfg_path)
-        self.load_servo_config(servo_cfg_path)
+        self.use_lab_lut = lab_lut
+        self.lab_lut: colorlut.ColorLUT | None = None
+        self.vision: vision.VisionPipeline
+        self.segmentation: segmentation.Segmentation | None = None
+        with startup_timer.phase('lab config'):
+            self.load_lab_config(lab_cfg_path)
+        with startup_timer.phase('servo config'):
+            self.load_servo_config(servo_cfg_path)
 
         self.board = Board if board is None else board
+        self.leds = actuators.CoalescingPixels(self.board, min_interval=rgb_interval)
 
         self.servo1: int
         self.servo2: int
@@ -140,33 +232,67 @@ class BinaryProgram:
         self.fps = 0.0
         self.fps_averager = st.Average(10)
         self.detected = False
+        self.smoothed_detected = 0.0
+        self.target_area = 0
         self.boolean_detection_averager = st.Average(10)
 
-        self.show = self.can_show_windows()
-        if not self.show:
+        # annotated previews are only drawn while something is subscribed, see hiwonder_common/render.py
+        display_size = (320, 240)
+        self.renderer = render.Renderer(display_size, frame_size=self.preview_size,
+                                        remap=self.undistort.resized(display_size) if self.undistort else None)
+        with startup_timer.phase('display check'):
+            self.show = startup.display_available(self.can_show_windows) if fast_start else self.can_show_windows()
+        if self.show:
+            self.renderer.subscribe(render.WindowConsumer('frame'))
+        else:
             print("Failed to create test window.")
             print("I'll assuming you're running headless; I won't show image previews.")
+        self.preview_server: mjpeg.MjpegServer | None = None
+        if preview_port is not None:
+            # encodes only while a client is connected, in its own thread
+            self.preview_server = mjpeg.MjpegServer(preview_port, preview_host, preview_fps, preview_quality)
 
         GPIO.setup(KEY1_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
-        if buttonman:
-            self.key1_debouncer = buttonman.ButtonDebouncer(KEY1_PIN, self.btn1, bouncetime=50)
-            self.key1_debouncer.start()
-            GPIO.add_event_detect(KEY1_PIN, GPIO.BOTH, callback=self.key1_debouncer)
+        self.key1_debouncer = None
+        self._buttonman_registration = startup.in_background(self.register_buttonman, name='buttonman')
 
         if startup_beep:
             self.startup_beep()
 
         self.exit_on_stop = exit_on_stop
+        self._reported_startup = False
+
+    def register_buttonman(self):
+        # So buttonman can stop us, and KEY1 can pause us. Runs in the background at startup.
+        global buttonman
+        try:
+            import buttonman as _buttonman
+        except ImportError:
+            warnings.warn("buttonman was not imported, so no processes can be registered. This means the process can't be stopped by buttonman.",  # noqa: E501
+                          ImportWarning, stacklevel=2)
+            return
+        try:
+            _buttonman.TaskManager.register_stoppable()
+        except Exception as err:  # e.g. no psutil. Not worth failing to start over.
+            print(f"Couldn't register with buttonman: {type(err).__name__}: {err}")
+            return
+        buttonman = _buttonman
+        self.key1_debouncer = buttonman.ButtonDebouncer(KEY1_PIN, self.btn1, bouncetime=50)
+        self.key1_debouncer.start()
+        GPIO.add_event_detect(KEY1_PIN, GPIO.BOTH, callback=self.key1_debouncer)
+        startup_timer.mark('buttonman registered')
 
     def startup_beep(self):
-        self.buzzfor(0.05)
+        # in the background, so startup doesn't wait on it
+        threading.Thread(target=self.buzzfor, args=(0.05,), name='beep', daemon=True).start()
 
     def btn1(self, channel, event):
         if event == KUP:
             if self.dry_run or not self._run:
                 self.dry_run = False
                 self._run = True
+                self._wake.set()
             else:
                 self.dry_run = True
                 self.kill_motors()
@@ -180,7 +306,9 @@ class BinaryProgram:
             key = cv2.waitKey(1)
             cv2.destroyAllWindows()
         except BaseException as err:
-            if "Can't initialize GTK backend" in err.msg:
+            msg = getattr(err, 'msg', '')
+            # "The function is not implemented" is what headless builds of opencv say
+            if "Can't initialize GTK backend" in msg or "The function is not implemented" in msg:
                 return False
             else:
                 raise
@@ -188,41 +316,223 @@ class BinaryProgram:
             return True
 
     def init_move(self):
-        servo_data = get_yaml_data(SERVO_CFG_PATH)
-        self.servo1 = int(servo_data['servo1'])
-        self.servo2 = int(servo_data['servo2'])
+        self.servo1 = int(self.servo_data['servo1'])
+        self.servo2 = int(self.servo_data['servo2'])
         Board.setPWMServoPulse(1, self.servo1, 1000)
         Board.setPWMServoPulse(2, self.servo2, 1000)
 
     def load_lab_config(self, threshold_cfg_path):
-        self.lab_data = get_yaml_data(threshold_cfg_path)
+        stamp = config.file_stamp(threshold_cfg_path)  # before reading, so a write during it isn't missed
+        lab_data = get_yaml_data(threshold_cfg_path)
+        # BGR -> LAB -> threshold lookup table. Cached on disk, so this is only slow once per config.
+        lab_lut = colorlut.ColorLUT.from_config(lab_data) if self.use_lab_lut else None
+        with self._config_lock:
+            self.lab_data, self.lab_lut = lab_data, lab_lut
+            self.lab_config_stamp = stamp
+            self.build_vision()
+
+    def build_vision(self):
+        # owns all the per-frame buffers, structuring elements and thresholds
+        with self._config_lock:
+            self.vision = vision.VisionPipeline.from_config(
+                self.lab_data,
+                size=self.preview_size,
+                blur_ksize=self.quality_level.blur_ksize,
+                lut=self.lab_lut,
+                remap=self.undistort_for(self.preview_size),
+            )
+
+    def undistort_for(self, size):
+        # self.undistort at processing resolution size, or None if we're not undistorting
+        if self.undistort is None:
+            return None
+        if size not in self.undistort_maps:
+            self.undistort_maps[size] = self.undistort.resized(size)
+        return self.undistort_maps[size]
+
+    def reload_config(self, path):
+        # Called from self.config_watcher's thread when a config file changes. The new vision
+        # pipeline is built aside and swapped in whole, so detection never sees half of a change.
+        # Vision worker processes pick up lab config changes from the stamp sent with each frame.
+        if path == self.lab_cfg_path:
+            self.load_lab_config(path)
+            self.record_config()
+            print(f"Reloaded color thresholds from {path}")
+        elif path == self.servo_cfg_path:
+            self.load_servo_config(path)
+            self.init_move()
+            print(f"Reloaded servo positions from {path}")
+
+    @property
+    def quality_level(self):
+        return self.quality_ladder[self.quality]
+
+    def set_quality(self, index):
+        # Switch processing resolution, blur and ROI padding. Call from the thread that runs detect().
+        self.quality = index
+        level = self.quality_level
+        self.preview_size = level.size
+        w, h = level.size
+        self.min_target_area = MIN_TARGET_AREA * (w * h) / (640 * 480)
+        self.build_vision()
+        if self.roi:
+            self.roi = roi.RoiTracker(self.preview_size, level.roi_pad)
+
+    def govern(self, frame):
+        # feed the governor this frame's capture-to-detection latency, and apply its decision
+        if self.governor is None:
+            return
+        decision = self.governor.record(time.monotonic_ns() - frame.t_capture)
+        if decision is not None:
+            self.set_quality(decision.index)
+
+    def load_undistort(self, calibration_path):
+        try:
+            return remap.UndistortRemap.from_calibration(calibration_path, self.camera_size, self.preview_size)
+        except FileNotFoundError:
+            print(f"No camera calibration at {calibration_path}. Falling back to the camera's own correction.")
+            return None
 
     def load_servo_config(self, servo_cfg_path):
+        stamp = config.file_stamp(servo_cfg_path)  # before reading, as in load_lab_config()
         self.servo_data = get_yaml_data(servo_cfg_path)
+        self.servo_config_stamp = stamp
+
+    def color_blobs(self, color):
+        # Blob stats for any color in lab_config.yaml, from the current frame's segmentation.
+        # None unless detection runs through the lookup table, in this process (not the processes backend).
+        if self.segmentation is None:
+            return None
+        return self.segmentation.blobs(color)
 
     def kill_motors(self):
-        self.chassis.set_velocity(0, 0, 0)
+        self.chassis.stop()  # only written if they might be moving, so it's cheap to call every loop
 
     def pause(self):
         self._run = False
-        self.chassis.set_velocity(0, 0, 0)
+        self.chassis.stop(force=True)
         print(f"ColorDetect Paused w/ PID: {os.getpid()} Camera still open...")
 
     def resume(self):
         self._run = True
+        self._wake.set()
+        if self.governor:
+            self.governor.reset()  # don't count the time we were paused
         print("ColorDetect Resumed")
 
+    def request_stop(self):
+        # Stop the motors now, and have the main loop stop everything else as soon as it can.
+        self._run = False
+        self.stop_requested.set()
+        self._wake.set()
+        self.chassis.stop(force=True)
+
+    def flush_actuators(self):
+        # send any command held back by the rate limits (see hiwonder_common/actuators.py),
+        # for when control() isn't being called to send it along with the next one
+        self.chassis.flush()
+        self.leds.flush()
+
+    def idle(self):
+        # while paused: wait for a resume or stop, but not so long that kill_motors() goes stale
+        self.flush_actuators()
+        if self._wake.wait(0.1):
+            self._wake.clear()
+
+    def run_now(self, action):
+        # a remote command to pause, resume or stop now overrides anything scheduled
+        self.scheduler.cancel()
+        return action()
+
+    def schedule(self, payload, action):
+        # RESUME_AT/PAUSE_AT: payload is when, on our clock (the sender corrects for the offset)
+        return {'in_ms': round(self.scheduler.at(clocksync.decode_time(payload), action) / 1E6, 3)}
+
+    def command_handlers(self):
+        # what remote commands do, see hiwonder_common/commands.py. These run in the command server's thread.
+        return {
+            commands.PING: lambda payload: {'pid': os.getpid(), 'running': self._run, 'fps': round(self.fps, 1)},
+            commands.PAUSE: lambda payload: self.run_now(self.pause),
+            commands.RESUME: lambda payload: self.run_now(self.resume),
+            commands.STOP: lambda payload: self.run_now(self.request_stop),
+            commands.CLOCK: clocksync.clock_reply,
+            commands.RESUME_AT: lambda payload: self.schedule(payload, self.resume),
+            commands.PAUSE_AT: lambda payload: self.schedule(payload, self.pause),
+            commands.SPANS: lambda payload: self.spans.report(),  # per-stage timing summary, as JSON
+            commands.LATENCY: lambda payload: self.latency.report(),  # frame age percentiles per stage, as JSON
+            commands.DUMPSPANS: lambda payload: str(self.dump_spans()),
+        }
+
+    def start_recording(self, path):
+        self.recorder = recorder.Recorder(path, self.record_quality).start()
+        self.chassis = recorder.RecordingChassis(self.chassis, self.recorder)
+        self.record_config()
+        print(f"Recording to {path}")
+
+    def record_config(self):
+        # what replay.py needs to set up detection the way it was
+        if self.recorder:
+            self.recorder.config({
+                'lab_data': self.lab_data,
+                'target_color': self.target_color,
+                'min_target_area': self.min_target_area,
+                'lab_lut': self.use_lab_lut,
+                'roi_tracking': self.roi is not None,
+                'fused_undistort': self.undistort is not None,
+                'dry_run': self.dry_run,
+            })
+
+    def telemetry_snapshot(self):
+        # Called from the telemetry thread, a few times a second. Only reads what the loop keeps anyway.
+        return {
+            'detected': self.detected,
+            'running': self._run,
+            'dry_run': self.dry_run,
+            'smoothed': float(self.smoothed_detected),
+            'fps': self.fps,
+            'latency_ms': self.latency.last['detect'] / 1E6,
+            'quality': self.quality,
+            'area': int(self.target_area),
+        }
+
     def stop(self):
-        global listener_run
         self._run = False
-        self.chassis.set_velocity(0, 0, 0)
+        self.chassis.stop(force=True)  # first, in case we're stopping because vision failed
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.vision_pool:
+            self.vision_pool.close()
+            self.vision_pool = None
         if self.camera:
             self.camera.camera_close()
-        self.set_rgb('None')
-        cv2.destroyAllWindows()
-        listener_run = False
+        if self.frames:
+            self.frames.close()
+        if self.config_watcher:
+            self.config_watcher.close()
+            self.config_watcher = None
+        if self.command_server:
+            self.command_server.close()
+            self.command_server = None
+        self.scheduler.close()
+        if self.telemetry:
+            self.telemetry.close()
+            self.telemetry = None
+        if self.recorder:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.stats()} to {self.record_path}")
+            self.recorder = None
+            self.chassis = self.chassis.chassis
+        if self.spans_path:
+            print(f"Saved stage timings to {self.dump_spans()}")
+        self.set_rgb('None', force=True)
+        self.renderer.close()
+        if self.show:
+            cv2.destroyAllWindows()  # raises on headless builds of opencv
         print("ColorDetect Stop")
+        # registration may still be running in the background; let it finish so it's undone below
+        self._buttonman_registration.result()
         if buttonman:
+            GPIO.remove_event_detect(KEY1_PIN)
             buttonman.TaskManager.unregister()
         if self.exit_on_stop:
             sys.exit()  # exit the python script immediately
@@ -238,80 +548,190 @@ class BinaryProgram:
         cls.buzzer(0)
         time.sleep(dtoff)
 
-    def set_rgb(self, color):
+    def set_rgb(self, color, force=False):
         # Set the RGB light color of the expansion board to match the color you want to track
+        # Only written when it changes, at most every rgb_interval seconds (unless forced).
         if color not in range_bgr:
             color = "black"
         b, g, r = range_bgr[color]
-        self.board.RGB.setPixelColor(0, self.board.PixelColor(r, g, b))
-        self.board.RGB.setPixelColor(1, self.board.PixelColor(r, g, b))
-        self.board.RGB.show()
+        self.leds.set_all((r, g, b), force)
 
-    def control(self):
+    def control(self, t_capture=None):
+        # t_capture: capture time of the frame this acts on, for latency accounting
+        t = self.spans.now()
         self.set_rgb('green' if bool(self.smoothed_detected) else 'red')
+        t = self.spans.lap(SPAN_RGB, t)
         if not self.dry_run:
             if self.smoothed_detected:  # smoothed_detected is a low-pass filtered detection
                 self.chassis.set_velocity(100, 90, -0.5)  # Control robot movement function
                 # linear speed 50 (0~100), direction angle 90 (0~360), yaw angular speed 0 (-2~2)
             else:
                 self.chassis.set_velocity(100, 90, 0.5)
+            self.spans.lap(SPAN_CHASSIS, t)
+            if t_capture is not None:
+                self.latency.record('command', t_capture)
+        if not self._reported_startup:
+            self._reported_startup = True
+            startup_timer.mark('first command')
+            print(startup_timer.report())
+
+    def dump_spans(self, path=None):
+        path = path or self.spans_path or f"/tmp/turbopi-spans-{os.getpid()}.npz"
+        return self.spans.dump(path)
+
+    def next_frame(self, timeout=0.1):
+        # Block until the camera has a frame we haven't seen yet. Returns None on timeout.
+        frame = self.frames.wait_next(self._last_seq, timeout)
+        if frame is not None:
+            self._last_seq = frame.seq
+            self.latency.record('capture', frame.t_capture)
+            if self.recorder:
+                self.recorder.frame(frame.image, frame.seq, self.quality, frame.t_capture)
+        return frame
 
     def main_loop(self):
         avg_fps = self.fps_averager(self.fps)  # feed the averager
-        raw_img = self.camera.frame
-        if raw_img is None:
-            time.sleep(0.01)
+        t = self.spans.now()
+        frame = self.next_frame()
+        if frame is None:
+            self.flush_actuators()
             return
-
-        # prep a resized, blurred version of the frame for contour detection
-        frame = raw_img.copy()
-        frame_clean = cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_NEAREST)
-        frame_clean = cv2.GaussianBlur(frame_clean, (3, 3), 3)
-        frame_clean = cv2.cvtColor(frame_clean, cv2.COLOR_BGR2LAB)  # convert to LAB space
-
-        # prep a copy to be annotated
-        annotated_image = raw_img.copy()
-
-        # If we're calling target_contours() multiple times, some args will
-        # be the same. Let's put them here to re-use them.
-        contour_args = {
-            'open_kernel': np.ones((3, 3), np.uint8),
-            'close_kernel': np.ones((3, 3), np.uint8),
-        }
-        # extract the LAB threshold
-        threshold = (tuple(self.lab_data[self.target_color][key]) for key in ['min', 'max'])
-        # breakpoint()
-        # run contour detection
-        target_contours = self.color_contour_detection(
-            frame_clean,
-            tuple(threshold),
-            **contour_args
-        )
-        # The output of color_contour_detection() is sorted highest to lowest
-        biggest_contour, biggest_contour_area = target_contours[0] if target_contours else (None, 0)
-        self.detected: bool = biggest_contour_area > 300  # did we detect something of interest?
+        raw_img = frame.image  # read-only, shared with the camera
+        t = self.spans.lap(SPAN_WAIT, t)
+
+        self.latency.record('dequeue', frame.t_capture)
+        detection = self.detect(raw_img)
+        self.latency.record('detect', frame.t_capture)
+        self.record_detection(frame, detection)
+        self.govern(frame)
+        t = self.spans.lap(SPAN_DETECT, t)
+
+        self.control(frame.t_capture)  # ################################
+        t = self.spans.lap(SPAN_CONTROL, t)
+
+        self.render(raw_img, detection, avg_fps, self.preview_size)
+        self.spans.lap(SPAN_RENDER, t)
+
+    def detect(self, raw_img):
+        window = self.roi.window() if self.roi else None
+        return self.update_detection(*self.find_target(raw_img, window))
+
+    def find_target(self, raw_img, window=None, quality=None, lab_config=None):
+        # Returns (biggest_contour, area) of the target color, or (None, 0).
+        # Doesn't touch any detection state, so this can run in a worker process.
+        # Worker processes are told which quality level and lab config stamp the frame was submitted with.
+        if lab_config is not None and lab_config != self.lab_config_stamp:
+            self.load_lab_config(self.lab_cfg_path)
+            self.lab_config_stamp = lab_config  # don't reload again until the parent has
+        if quality is not None and quality != self.quality:
+            self.set_quality(quality)
+        # If the lookup table is in use, every color is thresholded at once and
+        # can be queried from self.segmentation without touching the frame again.
+        pipe = self.vision  # may be swapped by reload_config() at any time
+        target_contours = pipe.find_target(raw_img, self.target_color, window)
+        self.segmentation = pipe.segmentation
+        # find_target() only returns the largest blob (if any)
+        return target_contours[0] if target_contours else (None, 0)
+
+    def update_detection(self, biggest_contour, biggest_contour_area, *window):
+        # window: the ROI window the frame was searched in, if it isn't the tracker's latest (see main_processes)
+        self.detected: bool = biggest_contour_area > self.min_target_area  # did we detect something of interest?
+        self.target_area = biggest_contour_area
+        if self.roi:
+            self.roi.update(cv2.boundingRect(biggest_contour) if self.detected else None, *window)
 
         self.smoothed_detected = self.boolean_detection_averager(self.detected)  # feed the averager
 
         # print(bool(smoothed_detected), smoothed_detected)
+        return Detection(biggest_contour, biggest_contour_area, self.detected, self.smoothed_detected)
 
-        self.control()  # ################################
+    def record_detection(self, frame, detection):
+        if self.recorder:
+            self.recorder.detection(frame.seq, detection.detected, detection.smoothed, detection.area)
+
+    def render(self, raw_img, detection, avg_fps, frame_size):
+        # draw the annotations at display size, straight onto the resized frame
+        # frame_size: the processing resolution detection was done at, which the governor may since have changed
+        annotated_image = self.renderer.canvas(raw_img)
+        if annotated_image is None:
+            return  # nobody's watching
+        scale = self.renderer.scale_for(frame_size)
 
         # draw annotations of detected contours
-        if self.detected:
-            self.draw_fitted_rect(annotated_image, biggest_contour, range_bgr[self.target_color])
-            self.draw_text(annotated_image, range_bgr[self.target_color], self.target_color)
+        if detection.detected:
+            self.draw_fitted_rect(annotated_image, detection.contour, range_bgr[self.target_color], scale)
+            self.draw_text(annotated_image, range_bgr[self.target_color], self.target_color, scale[1])
         else:
-            self.draw_text(annotated_image, range_bgr['black'], 'None')
-        self.draw_fps(annotated_image, range_bgr['black'], avg_fps)
-        frame_resize = cv2.resize(annotated_image, (320, 240))
-        if self.show:
-            cv2.imshow('frame', frame_resize)
-            key = cv2.waitKey(1)
-            if key == 27:
-                return
-        else:
-            time.sleep(1E-3)
+            self.draw_text(annotated_image, range_bgr['black'], 'None', scale[1])
+        self.draw_fps(annotated_image, range_bgr['black'], avg_fps, scale[1])
+        self.renderer.publish(annotated_image)
+
+    def build_pipeline(self):
+        # capture -> process -> actuate
+        #                    \-> render
+        # Each stage is a thread, and only ever works on the newest frame. Actuation happens as
+        # soon as detection is done, and doesn't wait on annotation or display. Frames are only
+        # sent to render while self.renderer has an active consumer.
+        captured = pipeline.LatestSlot()
+        detections = pipeline.LatestSlot()
+        renders = pipeline.LatestSlot()
+        t_last = time.time_ns()
+
+        def capture():
+            if not self._run:
+                self.idle()
+                return None
+            t = self.spans.now()
+            frame = self.next_frame()
+            self.spans.lap(SPAN_WAIT, t)
+            return frame
+
+        def process(frame):
+            nonlocal t_last
+            avg_fps = self.fps_averager(self.fps)
+            raw_img = frame.image
+            t = self.spans.now()
+            self.latency.record('dequeue', frame.t_capture)
+            detection = self.detect(raw_img)
+            self.latency.record('detect', frame.t_capture)
+            self.record_detection(frame, detection)
+            self.govern(frame)
+            self.spans.lap(SPAN_DETECT, t)
+            t_now = time.time_ns()
+            self.fps = 1 / ((t_now - t_last) / (10 ** 9))
+            t_last = t_now
+            if self.renderer.active:
+                renders.put((raw_img, detection, avg_fps, self.preview_size))
+            return frame  # control() works from self.smoothed_detected, and only needs the capture time
+
+        def actuate(frame):
+            if self._run:
+                t = self.spans.now()
+                self.control(frame.t_capture)
+                self.spans.lap(SPAN_CONTROL, t)
+
+        def render(item):
+            t = self.spans.now()
+            self.render(*item)
+            self.spans.lap(SPAN_RENDER, t)
+
+        pipe = pipeline.Pipeline()
+        pipe.add('capture', capture, outboxes=[captured])
+        pipe.add('process', process, inbox=captured, outboxes=[detections])
+        pipe.add('actuate', actuate, inbox=detections)
+        pipe.add('render', render, inbox=renders)
+        return pipe
+
+    def open_camera(self):
+        # captured frames are handed to self.frames as they arrive, see hiwonder_common/frames.py
+        with startup_timer.phase('camera open'):
+            camera_class = standins.StandInCamera if self.standin_camera else Camera.Camera
+            camera = frames.publishing_camera(camera_class)()
+            if self.vision_pool:  # frames wait in the pool's slots for their results: start with enough buffers
+                camera.frame_source.pool_size = len(self.vision_pool.ring) + 2
+            # Enable distortion correction, not enabled by default, unless we're doing it ourselves
+            camera.camera_open(correction=self.undistort is None)
+        self.camera, self.frames = camera, camera.frame_source
 
     def main(self):
 
@@ -324,17 +744,64 @@ class BinaryProgram:
         def sigcont_handler(sig, frame):
             self.resume()
 
-        self.init_move()
-        self.camera = Camera.Camera()
-        self.camera.camera_open(correction=True)  # Enable distortion correction, not enabled by default
+        with startup_timer.phase('servos'):
+            self.init_move()
+        if self.backend == 'processes':
+            # fork the vision workers before the camera thread exists (and once buttonman's done)
+            self._buttonman_registration.result()
+            shape = (self.camera_size[1], self.camera_size[0], 3)
+            self.vision_pool = procpool.VisionPool(self.find_target, self.workers, shape)
+            self.vision_pool.start()
+        if self.preview_server:
+            self.preview_server.start()
+            self.renderer.subscribe(self.preview_server)
+            print(f"Serving preview at http://{self.preview_server.address[0] or '0.0.0.0'}:{self.preview_server.port}/")
+        if self._camera_opening is not None:
+            self._camera_opening.result()  # re-raises anything open_camera() raised
+        else:
+            self.open_camera()
+
+        if self.watch_config:  # after forking any workers, so they don't inherit the thread
+            # from the stamps the configs were loaded at, so an edit since then isn't missed
+            stamps = {self.lab_cfg_path: self.lab_config_stamp, self.servo_cfg_path: self.servo_config_stamp}
+            self.config_watcher = config.ConfigWatcher(list(stamps), self.reload_config, stamps=stamps)
+            self.config_watcher.start()
+        if self.record_path:  # after forking any workers too
+            self.start_recording(self.record_path)
 
         signal.signal(signal.SIGINT, sigint_handler)
         signal.signal(signal.SIGTERM, sigint_handler)
         signal.signal(signal.SIGTSTP, sigtstp_handler)
         signal.signal(signal.SIGCONT, sigcont_handler)
 
-        self.listener = threading.Thread(target=udp_listener, args=(self,))
-        self.listener.start()
+        self.scheduler.start()
+        if self.command_port is not None:
+            try:
+                handlers = self.command_handlers()
+                if self.recorder:
+                    handlers = recorder.recording_handlers(handlers, self.recorder)
+                self.command_server = commands.CommandServer(handlers, self.command_port, magic=MAGIC)
+                self.command_server.start()
+            except OSError as err:
+                print(f"Couldn't listen for commands on UDP port {self.command_port}: {err}")
+                self.command_server = None
+        if self.telemetry_rate:
+            try:
+                self.telemetry = telemetry.TelemetrySender(
+                    self.telemetry_snapshot, self.telemetry_rate, *self.telemetry_address,
+                    battery=getattr(self.board, 'getBattery', None))
+                self.telemetry.start()
+            except OSError as err:
+                print(f"Couldn't start telemetry to {self.telemetry_address}: {err}")
+                self.telemetry = None
+        startup_timer.mark('ready')
+
+        if self.backend == 'threaded':
+            self.main_pipelined()
+            return
+        if self.backend == 'processes':
+            self.main_processes()
+            return
 
         def loop():
             t_start = time.time_ns()
@@ -364,68 +831,173 @@ class BinaryProgram:
                     raise
             else:
                 self.kill_motors()
-                time.sleep(0.01)
-            if self._stop_soon:
-                self.stop()
+                self.idle()
+            if self.stop_requested.is_set():
+                break
 
         self.stop()
 
-    @staticmethod
-    def color_contour_detection(
-        frame,
-        threshold: tuple[tuple[int, int, int], tuple[int, int, int]],
-        open_kernel: np.array = None,
-        close_kernel: np.array = None,
-    ):
-        # Image Processing
-        # mask the colors we want
-        threshold = [tuple(li) for li in threshold]  # cast to tuple to make cv2 happy
-        frame_mask = cv2.inRange(frame, *threshold)
-        # Perform an opening and closing operation on the mask
-        # https://youtu.be/1owu136z1zI?feature=shared&t=34
-        frame = frame_mask.copy()
-        if open_kernel is not None:
-            frame = cv2.morphologyEx(frame, cv2.MORPH_OPEN, open_kernel)
-        if close_kernel is not None:
-            frame = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
-        # find contours (blobs) in the mask
-        contours = cv2.findContours(frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
-        areas = [math.fabs(cv2.contourArea(contour)) for contour in contours]
-        # zip to provide pairs of (contour, area)
-        zipped = zip(contours, areas)
-        # return largest-to-smallest contour
-        return sorted(zipped, key=operator.itemgetter(1), reverse=True)
+    def main_pipelined(self):
+        self.pipeline = self.build_pipeline()
+        self.pipeline.start()
+        try:
+            # the stages do the work. We just keep the motors off while paused.
+            while not self.pipeline.failed.wait(0.01):
+                if not self._run:
+                    self.kill_motors()
+                self.flush_actuators()
+                if self.stop_requested.is_set():
+                    break
+        except KeyboardInterrupt:
+            print('Received KeyboardInterrupt')
+            self.exit_on_stop = True
+        if self.pipeline.error is not None:
+            print("An error occurred in a pipeline stage.")
+            print(self.pipeline.error)
+            self.exit_on_stop = False
+            self.stop()
+            raise self.pipeline.error
+        self.stop()
+
+    def main_processes(self):
+        # Vision runs in self.vision_pool's worker processes, on alternating frames.
+        # Everything else (detection smoothing, control, display) happens here, in frame order.
+        pool = self.vision_pool
+        in_flight = {}  # seq -> (camera frame, quality level and ROI window it was submitted with)
+        t_last = None  # t_capture of the last frame worked on
+        try:
+            while not self.stop_requested.is_set():
+                if not self._run:
+                    self.kill_motors()
+                    self.idle()
+                    continue
+                # only block on the camera if there's nothing else to wait for
+                t = self.spans.now()
+                frame = self.next_frame(timeout=0 if pool.in_flight else 0.1) if pool.free_slots else None
+                if frame is not None:
+                    t = self.spans.lap(SPAN_WAIT, t)
+                    window = self.roi.window() if self.roi else None
+                    seq = pool.submit(frame.image, window, self.quality, self.lab_config_stamp)
+                    in_flight[seq] = (frame, self.quality, window)
+                    self.latency.record('dequeue', frame.t_capture)  # handed to a worker
+                    t = self.spans.lap(SPAN_SUBMIT, t)
+                results = pool.collect(timeout=2E-3)
+                t = self.spans.lap(SPAN_COLLECT, t)
+                if not results:
+                    self.flush_actuators()
+                for seq, (contour, area) in results:
+                    frame, quality, window = in_flight.pop(seq)
+                    if quality != self.quality:
+                        continue  # submitted before the last quality change, so in the wrong coordinates
+                    avg_fps = self.fps_averager(self.fps)
+                    detection = self.update_detection(contour, area, window)
+                    self.latency.record('detect', frame.t_capture)
+                    self.record_detection(frame, detection)
+                    self.govern(frame)
+                    # from capture times, as one collect() can return several results at once
+                    if t_last is not None and frame.t_capture > t_last:
+                        self.fps = 1 / ((frame.t_capture - t_last) / (10 ** 9))
+                    t_last = frame.t_capture
+                    t = self.spans.now()
+                    self.control(frame.t_capture)
+                    t = self.spans.lap(SPAN_CONTROL, t)
+                    self.render(frame.image, detection, avg_fps, self.preview_size)
+                    self.spans.lap(SPAN_RENDER, t)
+        except KeyboardInterrupt:
+            print('Received KeyboardInterrupt')
+            self.exit_on_stop = True
+        except BaseException as err:
+            print("An error occurred in the vision workers.")
+            print(err)
+            self.exit_on_stop = False
+            self.stop()
+            raise
+        self.stop()
 
     @staticmethod
-    def draw_fitted_rect(img, contour, color):
+    def draw_fitted_rect(img, contour, color, scale=(1.0, 1.0)):
         # draw rotated fitted rectangle around contour
+        # scale maps contour coordinates to img coordinates
         rect = cv2.minAreaRect(contour)
-        box = np.int0(cv2.boxPoints(rect))
+        box = np.intp(cv2.boxPoints(rect) * scale)  # np.int0 is gone in numpy 2
         cv2.drawContours(img, [box], -1, color, 2)
 
     @staticmethod
-    def draw_text(img, color, name):
+    def draw_text(img, color, name, scale=1.0):
         # Print the detected color on the screen
-        cv2.putText(img, f"Color: {name}", (10, img.shape[0] - 10),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2)
+        cv2.putText(img, f"Color: {name}", (10, img.shape[0] - round(10 * scale)),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.65 * scale, color, max(1, round(2 * scale)))
 
     @staticmethod
-    def draw_fps(img, color, fps):
+    def draw_fps(img, color, fps, scale=1.0):
         # Print the detected color on the screen
-        cv2.putText(img, f"fps: {fps:.3}", (10, 20),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2)
+        cv2.putText(img, f"fps: {fps:.3}", (10, round(20 * scale)),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.65 * scale, color, max(1, round(2 * scale)))
 
 
 def get_parser(parser, subparsers=None):
     parser.add_argument("--dry_run", action='store_true')
     parser.add_argument("--startpaused", action='store_true')
+    parser.add_argument("--no_lut", action='store_true', help="threshold with cvtColor() + inRange() every frame")
+    parser.add_argument("--roi", action='store_true', help="once a target is found, only search the area around it")
+    parser.add_argument("--backend", choices=['serial', 'threaded', 'processes'], default='serial',
+                        help="threaded: run capture, vision, actuation and display in parallel stages. "
+                             "processes: run vision in a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=3, help="number of vision processes for --backend processes")
+    parser.add_argument("--preview_port", type=int, default=None,
+                        help="serve the annotated preview as MJPEG over HTTP on this port")
+    parser.add_argument("--preview_host", default='', help="interface for the preview server (default: all)")
+    parser.add_argument("--preview_fps", type=float, default=10.0, help="max preview frames per second")
+    parser.add_argument("--preview_quality", type=int, default=70, help="preview JPEG quality (0-100)")
+    parser.add_argument("--standin_camera", action='store_true', help="use synthetic frames instead of the camera")
+    parser.add_argument("--target_fps", type=float, default=None,
+                        help="lower processing quality when the loop can't keep this rate (default: off)")
+    parser.add_argument("--latency_budget", type=float, default=100,
+                        help="with --target_fps, max capture-to-detection latency in ms")
+    parser.add_argument("--latency_log_interval", type=float, default=10.0,
+                        help="seconds between frame latency reports (0 for none)")
+    parser.add_argument("--spans_path", default=None, help="save hot-path stage timings here (.npz) on exit")
+    parser.add_argument("--no_fused_undistort", action='store_true',
+                        help="let the camera correct distortion at full resolution, then resize")
+    parser.add_argument("--fast_start", action='store_true',
+                        help="open the camera while loading configs, and reuse the cached display check")
+    parser.add_argument("--chassis_interval", type=float, default=30,
+                        help="min ms between motor commands (stops always go straight out)")
+    parser.add_argument("--rgb_interval", type=float, default=100, help="min ms between RGB LED updates")
+    parser.add_argument("--command_port", type=int, default=UDP_PORT, help="UDP port for remote commands")
+    parser.add_argument("--telemetry_rate", type=float, default=0,
+                        help="status datagrams per second to the fleet multicast group, e.g. 2 (default 0: none)")
+    parser.add_argument("--telemetry_group", default=telemetry.GROUP, help="multicast group for telemetry")
+    parser.add_argument("--telemetry_port", type=int, default=telemetry.PORT, help="UDP port for telemetry")
+    parser.add_argument("--no_watch_config", action='store_true',
+                        help="don't reload lab_config.yaml and servo_config.yaml when they change")
+    parser.add_argument("--record", default=None,
+                        help="record frames, detections and commands to this file, for replay.py")
+    parser.add_argument("--record_quality", type=int, default=90, help="JPEG quality of recorded frames")
     return parser, subparsers
 
 
-if __name__ == '__main__':
+def cli(argv=None):
+    # command line entry point, also called by buttonman's zygote (see boot/zygote.py)
     parser = argparse.ArgumentParser()
     get_parser(parser)
-    args = parser.parse_args()
-
-    program = BinaryProgram(dry_run=args.dry_run, pause=args.startpaused)
+    args = parser.parse_args(argv)
+
+    program = BinaryProgram(dry_run=args.dry_run, pause=args.startpaused, lab_lut=not args.no_lut,
+                            roi_tracking=args.roi, backend=args.backend,
+                            workers=args.workers, preview_port=args.preview_port,
+                            preview_host=args.preview_host, preview_fps=args.preview_fps,
+                            preview_quality=args.preview_quality, standin_camera=args.standin_camera,
+                            fused_undistort=not args.no_fused_undistort, target_fps=args.target_fps,
+                            latency_budget=args.latency_budget / 1000, spans_path=args.spans_path,
+                            latency_log_interval=args.latency_log_interval,
+                            watch_config=not args.no_watch_config, fast_start=args.fast_start,
+                            chassis_interval=args.chassis_interval / 1000, rgb_interval=args.rgb_interval / 1000,
+                            command_port=args.command_port, telemetry_rate=args.telemetry_rate,
+                            telemetry_group=args.telemetry_group, telemetry_port=args.telemetry_port,
+                            record_path=args.record, record_quality=args.record_quality)
     program.main()
+
+
+if __name__ == '__main__':
+    cli()
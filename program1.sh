@@ -1,2 +1,2 @@
 #!/bin/bash
-python /home/pi/milling_controller.py --startpaused
\ No newline at end of file
+python /home/pi/milling_controller.py --startpaused --fast_start
\ No newline at end of file
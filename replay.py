@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Replay a recorded session (milling_controller.py --record) through the
+detection and control code, as fast as it will go.
+
+Every recorded frame is fed to BinaryProgram.main_loop(), at the quality
+level it was recorded at, with stand-ins for the camera, chassis and board
+(see hiwonder_common/standins.py), so nothing moves. Frames are decoded
+ahead in --decoders threads. The program is set up with the recorded lab
+config (or --lab_config) and detection settings, and recorded config
+reloads are applied where they happened.
+
+Replayed detections are compared with the recorded ones, frame by frame,
+and the changes in what control() asks the chassis to do with the recorded
+ones, in order. Stops are left out of that: the recording has the stops
+sent while paused, and the replay never pauses. Remote commands in the
+recording are counted, not replayed: the recording only has the frames the
+program worked on, so pauses are already left out.
+
+Frames are recorded as JPEGs, so a detection right at the edge of a
+threshold can come out differently even with unchanged code.
+
+Examples:
+python3 replay.py run1.tplog
+python3 replay.py run1.tplog --lab_config new_lab_config.yaml --min_agreement 0.99  # exits 1 below that
+"""
+
+import sys
+import time
+import argparse
+import tempfile
+import collections
+import pathlib as pl
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+import numpy as np
+
+from hiwonder_common import standins
+from hiwonder_common import frames
+from hiwonder_common import recorder
+from hiwonder_common import commands
+
+OPCODE_NAMES = {opcode: name for name, opcode in commands.OPCODES.items()}
+
+
+class Commands:
+    # stands in for a Recorder, to collect the commands control() asks for
+    def __init__(self):
+        self.sent = []
+
+    def command(self, velocity, direction, angular_rate):
+        # through the record format, so they're rounded the same as the recorded ones
+        self.sent.append(recorder.decode_command(recorder.COMMAND_RECORD.pack(velocity, direction, angular_rate)))
+
+
+def decoded(records, pool, ahead):
+    # (record, future of decode_frame() for frames), with frames decoded ahead in pool's threads
+    pending = collections.deque()
+    for record in records:
+        future = pool.submit(recorder.decode_frame, record.payload) if record.kind == recorder.FRAME else None
+        pending.append((record, future))
+        if len(pending) > ahead:
+            yield pending.popleft()
+    yield from pending
+
+
+def changes(commands_sent):
+    # each command that differs from the one before, leaving out stops
+    changed = []
+    for command in commands_sent:
+        if any(command) and (not changed or command != changed[-1]):
+            changed.append(command)
+    return changed
+
+
+def write_lab_config(cfg_dir, lab_data):
+    path = cfg_dir / 'lab_config.yaml'
+    with open(path, 'w') as f:
+        yaml.safe_dump(lab_data, f)
+    return path
+
+
+def make_program(settings, cfg_dir, args):
+    import milling_controller as mc
+    lab_path = args.lab_config or write_lab_config(cfg_dir, settings['lab_data'])
+    servo_path = cfg_dir / 'servo_config.yaml'
+    with open(servo_path, 'w') as f:
+        yaml.safe_dump({'servo1': 1500, 'servo2': 1500}, f)
+    program = mc.BinaryProgram(lab_cfg_path=lab_path, servo_cfg_path=servo_path, startup_beep=False,
+                               exit_on_stop=False, dry_run=settings['dry_run'], lab_lut=settings['lab_lut'],
+                               roi_tracking=settings['roi_tracking'], fused_undistort=settings['fused_undistort'],
+                               calibration_path=args.calibration or mc.CALIBRATION_PATH, watch_config=False,
+                               command_port=None, telemetry_rate=0, latency_log_interval=0)
+    program.renderer.consumers = []  # no window, even if this machine could show one
+    program.target_color = settings['target_color']
+    program.min_target_area = settings['min_target_area']
+    program.frames = frames.FrameSource()
+    return program
+
+
+class Comparison:
+    def __init__(self):
+        self.replayed = {}  # seq -> (detected, area), until the recorded detection comes along
+        self.compared = self.agreed = 0
+        self.area_errors = []
+
+    def replay(self, seq, detected, area):
+        self.replayed[seq] = (detected, area)
+
+    def recorded(self, seq, detected, area):
+        replayed = self.replayed.pop(seq, None)
+        if replayed is None:
+            return  # e.g. the recorder dropped the frame
+        self.compared += 1
+        self.agreed += replayed[0] == detected
+        self.area_errors.append(abs(replayed[1] - area))
+
+
+def main(args):
+    standins.install(force=True)  # never drive real motors from a replay
+    wall_ns, _ = recorder.start_time(args.log)
+    print(f"Replaying {args.log}, recorded {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall_ns / 1E9))}")
+    comparison = Comparison()
+    recorded_commands = []
+    replayed_commands = Commands()
+    events = collections.Counter()
+    program = None
+    n_frames = 0
+    busy = 0  # ns in main_loop()
+    with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(args.decoders) as pool:
+        cfg_dir = pl.Path(tmp)
+        t0 = time.perf_counter()
+        for record, future in decoded(recorder.read(args.log), pool, args.decoders * 2):
+            if record.kind == recorder.CONFIG:
+                settings = recorder.decode_config(record.payload)
+                if program is None:
+                    program = make_program(settings, cfg_dir, args)
+                    program.chassis = recorder.RecordingChassis(program.chassis, replayed_commands)
+                elif not args.lab_config:
+                    program.load_lab_config(write_lab_config(cfg_dir, settings['lab_data']))
+            elif record.kind == recorder.FRAME:
+                if program is None:
+                    raise ValueError(f"{args.log} has frames before its config")
+                seq, quality, image = future.result()
+                if quality != program.quality:
+                    program.set_quality(quality)
+                t = time.perf_counter_ns()
+                program.frames.publish(image)
+                program.main_loop()
+                busy += time.perf_counter_ns() - t
+                comparison.replay(seq, program.detected, program.target_area)
+                n_frames += 1
+                if n_frames == args.limit:
+                    break
+            elif record.kind == recorder.DETECTION:
+                seq, detected, _, area = recorder.decode_detection(record.payload)
+                comparison.recorded(seq, detected, area)
+            elif record.kind == recorder.COMMAND:
+                recorded_commands.append(recorder.decode_command(record.payload))
+            elif record.kind == recorder.EVENT:
+                opcode, _ = recorder.decode_event(record.payload)
+                events[OPCODE_NAMES.get(opcode, str(opcode))] += 1
+        elapsed = time.perf_counter() - t0
+
+    if not n_frames:
+        print("No frames recorded.")
+        return 1
+    print(f"{n_frames} frames in {elapsed:.2f} s: {n_frames / elapsed:.1f} fps "
+          f"({busy / 1E6 / n_frames:.2f} ms per frame in main_loop)")
+    agreement = comparison.agreed / comparison.compared if comparison.compared else float('nan')
+    if comparison.compared:
+        print(f"detections: {comparison.agreed}/{comparison.compared} agree ({agreement:.2%}), "
+              f"area error mean {np.mean(comparison.area_errors):.1f} max {np.max(comparison.area_errors):.1f} px")
+    recorded, replayed = changes(recorded_commands), changes(replayed_commands.sent)
+    n = min(len(recorded), len(replayed))  # the replay may have stopped early
+    diverged = next((i for i in range(n) if recorded[i] != replayed[i]), None)
+    print(f"chassis command changes: {len(recorded)} recorded, {len(replayed)} replayed, "
+          + ("the same" if diverged is None else f"differing from change {diverged}") + f" over the first {n}")
+    if events:
+        print("remote commands: " + ', '.join(f"{name} x{count}" for name, count in events.most_common()))
+    if args.min_agreement is not None and not agreement >= args.min_agreement:
+        print(f"Detection agreement is below {args.min_agreement:.2%}")
+        return 1
+    return 0
+
+
+def get_parser(parser, subparsers=None):
+    parser.add_argument("log", help="a recording from milling_controller.py --record")
+    parser.add_argument("--lab_config", default=None, help="use this lab_config.yaml instead of the recorded one")
+    parser.add_argument("--calibration", default=None,
+                        help="camera calibration, if the recording used fused undistortion (default: the robot's)")
+    parser.add_argument("--decoders", type=int, default=2, help="threads decoding frames ahead")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--min_agreement", type=float, default=None,
+                        help="exit 1 if fewer than this fraction of detections agree with the recording")
+    return parser, subparsers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded session through main_loop().")
+    get_parser(parser)
+    sys.exit(main(parser.parse_args()))
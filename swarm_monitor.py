@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# coding=utf8
+"""
+Watch the whole fleet: a live table of every robot's telemetry.
+
+Each robot running milling_controller.py with --telemetry_rate (off by
+default) multicasts a status datagram that many times a second (see
+hiwonder_common/telemetry.py). This joins the group and
+keeps the newest status from each robot, redrawing a table every --refresh
+seconds. Robots not heard from in --stale seconds are marked stale.
+
+With --log, every datagram is also appended to a columnar log, one column
+per field: CSV, or Parquet (written a row group at a time) if the path ends
+in .parquet and pyarrow is installed.
+
+Examples:
+python3 swarm_monitor.py
+python3 swarm_monitor.py --log fleet.parquet --duration 600
+"""
+
+import csv
+import sys
+import time
+import argparse
+
+from hiwonder_common import telemetry
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ('recv_time', 'addr') + telemetry.FIELDS
+
+
+class CsvLog:
+    def __init__(self, path):
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(COLUMNS)
+
+    def append(self, row):
+        self.writer.writerow(row)
+
+    def flush(self, force=False):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetLog:
+    def __init__(self, path, rows_per_group=10000):
+        self.path = path
+        self.rows_per_group = rows_per_group
+        self.columns = {name: [] for name in COLUMNS}
+        self.writer = None
+
+    def append(self, row):
+        for name, value in zip(COLUMNS, row):
+            self.columns[name].append(value)
+
+    def flush(self, force=False):
+        rows = len(self.columns['recv_time'])
+        if not rows or (rows < self.rows_per_group and not force):
+            return
+        table = pyarrow.table(self.columns)
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)  # one row group
+        self.columns = {name: [] for name in COLUMNS}
+
+    def close(self):
+        self.flush(force=True)
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_log(path):
+    if path.endswith('.parquet'):
+        if pyarrow is not None:
+            return ParquetLog(path)
+        print("pyarrow isn't installed, so logging as CSV instead.", file=sys.stderr)
+        path = path[:-len('.parquet')] + '.csv'
+    return CsvLog(path)
+
+
+class Robot:
+    # what we know about one robot
+    def __init__(self, addr):
+        self.addr = addr
+        self.status = None
+        self.t_seen = 0.0
+        self.received = 0
+        self.lost = 0  # sequence numbers we never saw
+
+    def update(self, status, now):
+        if self.status is not None:
+            gap = (status.seq - self.status.seq - 1) & 0xFFFFFFFF
+            if gap < 1000:  # otherwise it restarted
+                self.lost += gap
+        self.status = status
+        self.t_seen = now
+        self.received += 1
+
+
+def table(robots, now, stale):
+    lines = [f"{'robot':<16} {'address':<15} {'state':<7} {'det':>3} {'smooth':>6} {'fps':>5} "
+             f"{'lat ms':>6} {'batt V':>6} {'qual':>4} {'area':>6} {'loss':>5} {'seen':>5}"]
+    for key in sorted(robots, key=lambda key: (robots[key].status.name, key)):
+        robot = robots[key]
+        s = robot.status
+        age = now - robot.t_seen
+        state = 'stale' if age > stale else 'dry' if s.dry_run and s.running else 'run' if s.running else 'paused'
+        loss = robot.lost / (robot.lost + robot.received)
+        battery = f"{s.battery_mv / 1000:6.2f}" if s.battery_mv else f"{'?':>6}"
+        lines.append(f"{s.name:<16} {robot.addr[0]:<15} {state:<7} {'yes' if s.detected else 'no':>3} "
+                     f"{s.smoothed:6.2f} {s.fps:5.1f} {s.latency_ms:6.1f} {battery} {s.quality:4d} "
+                     f"{s.area:6d} {loss:5.0%} {age:4.1f}s")
+    return '\n'.join(lines)
+
+
+def get_parser(parser, subparsers=None):
+    parser.add_argument("--group", default=telemetry.GROUP, help="telemetry multicast group")
+    parser.add_argument("--port", type=int, default=telemetry.PORT, help="telemetry UDP port")
+    parser.add_argument("--log", default=None, help="append every status to this .csv or .parquet file")
+    parser.add_argument("--refresh", type=float, default=1.0, help="seconds between table redraws")
+    parser.add_argument("--stale", type=float, default=3.0, help="seconds of silence before a robot is stale")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--plain", action='store_true', help="print each table instead of redrawing in place")
+    return parser, subparsers
+
+
+def main(args):
+    receiver = telemetry.TelemetryReceiver(args.group, args.port)
+    log = open_log(args.log) if args.log else None
+    robots = {}  # (address, name) -> Robot
+    t_start = time.monotonic()
+    t_draw = t_start
+    try:
+        while args.duration is None or time.monotonic() - t_start < args.duration:
+            addr, status = receiver.recv(timeout=max(0.0, t_draw - time.monotonic()))
+            now = time.monotonic()
+            if status is not None:
+                key = (addr[0], status.name)
+                robot = robots.get(key) or robots.setdefault(key, Robot(addr))
+                robot.update(status, now)
+                if log is not None:
+                    log.append((time.time(), addr[0]) + tuple(status))
+            if now >= t_draw:
+                t_draw = now + args.refresh
+                text = table(robots, now, args.stale) if robots else "Waiting for telemetry..."
+                print(text if args.plain else "\x1b[H\x1b[2J" + text, flush=True)
+                if log is not None:
+                    log.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        if log is not None:
+            log.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    get_parser(parser)
+    main(parser.parse_args())
@@ -0,0 +1,9 @@
+# Run from the repo root: python -m pytest tests
+# hiwonder_common is used from its source tree, and the programs (fleet.py, ...) from the repo root.
+import sys
+import pathlib as pl
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+for path in (ROOT / 'hiwonder_common' / 'src', ROOT):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
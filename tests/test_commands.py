@@ -0,0 +1,119 @@
+"""CommandServer over loopback: the binary protocol, the legacy text commands, and the reply cache."""
+
+import socket
+
+import pytest
+
+from hiwonder_common import commands
+
+
+@pytest.fixture
+def server():
+    calls = []
+
+    def handler(name, reply=None):
+        def handle(payload):
+            calls.append((name, bytes(payload)))
+            return reply
+        return handle
+
+    server = commands.CommandServer({
+        commands.PING: handler('ping', {'ok': True}),
+        commands.PAUSE: handler('pause'),
+        commands.SPANS: handler('spans', b'{"wait":1}'),
+    }, 0, '127.0.0.1', remember=2, senders=2).start()
+    server.calls = calls
+    yield server
+    server.close()
+
+
+def udp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    return sock
+
+
+def send(sock, server, data):
+    sock.sendto(data, ('127.0.0.1', server.port))
+    return sock.recvfrom(65536)[0]
+
+
+def test_ack_echoes_the_header(server):
+    with udp_socket() as sock:
+        reply = send(sock, server, commands.encode(commands.PAUSE, 1234, b'xy'))
+    assert reply == commands.MAGIC + commands.HEADER.pack(commands.VERSION, commands.OK, 1234)
+    assert server.calls == [('pause', b'xy')]
+
+
+def test_query_replies_with_its_payload(server):
+    with udp_socket() as sock:
+        version, status, seq, payload = commands.decode(send(sock, server, commands.encode(commands.PING, 7)))
+    assert (version, status, seq, payload) == (commands.VERSION, commands.OK, 7, b'{"ok":true}')
+
+
+def test_unknown_opcode_and_bad_version(server):
+    with udp_socket() as sock:
+        _, status, seq, _ = commands.decode(send(sock, server, commands.encode(99, 1)))
+        assert (status, seq) == (commands.UNKNOWN, 1)
+        bad = commands.MAGIC + commands.HEADER.pack(commands.VERSION + 1, commands.PAUSE, 2)
+        _, status, seq, _ = commands.decode(send(sock, server, bad))
+        assert (status, seq) == (commands.BAD_VERSION, 2)
+    assert server.calls == []
+
+
+def test_resent_command_is_acked_but_not_run_again(server):
+    with udp_socket() as sock:
+        first = send(sock, server, commands.encode(commands.PAUSE, 5))
+        again = send(sock, server, commands.encode(commands.PAUSE, 5))
+    assert again == first
+    assert server.calls == [('pause', b'')]
+    assert server.duplicates == 1
+
+
+def test_replies_kept_per_sender_are_bounded(server):
+    # remember=2: the oldest reply is forgotten, so resending it runs the command again
+    with udp_socket() as sock:
+        for seq in (1, 2, 3):
+            send(sock, server, commands.encode(commands.PAUSE, seq))
+        send(sock, server, commands.encode(commands.PAUSE, 3))
+        assert len(server.calls) == 3
+        send(sock, server, commands.encode(commands.PAUSE, 1))
+        assert len(server.calls) == 4
+
+
+def test_least_recent_sender_is_forgotten(server):
+    # senders=2: a third sender evicts the first one's replies
+    socks = [udp_socket() for _ in range(3)]
+    try:
+        for sock in socks:
+            send(sock, server, commands.encode(commands.PAUSE, 1))
+        assert len(server.replies) == 2
+        send(socks[2], server, commands.encode(commands.PAUSE, 1))
+        assert len(server.calls) == 3  # still remembered
+        send(socks[0], server, commands.encode(commands.PAUSE, 1))
+        assert len(server.calls) == 4  # forgotten, so run again
+    finally:
+        for sock in socks:
+            sock.close()
+
+
+def test_legacy_query_gets_a_bare_reply(server):
+    with udp_socket() as sock:
+        reply = send(sock, server, commands.MAGIC + commands.LEGACY_PREFIX + b'spans')
+    assert reply == b'{"wait":1}'
+
+
+def test_legacy_command_runs_without_a_reply(server):
+    with udp_socket() as sock:
+        sock.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            send(sock, server, commands.MAGIC + commands.LEGACY_PREFIX + b'pause')
+    assert server.calls == [('pause', b'')]
+
+
+def test_client_round_trip(server):
+    with commands.CommandClient(('127.0.0.1', server.port)) as client:
+        assert client.send(commands.PING) == b'{"ok":true}'
+        with pytest.raises(commands.CommandError):
+            client.send(99)
@@ -0,0 +1,47 @@
+"""fleet.py against stand-in robots on loopback (--local)."""
+
+import asyncio
+import argparse
+
+import fleet
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    fleet.get_parser(parser)
+    return parser.parse_args(argv)
+
+
+def test_ping(capsys):
+    assert fleet.main(parse('--local', '3', 'ping')) == 0
+    out = capsys.readouterr().out
+    assert out.count(': ok in ') == 3
+
+
+def test_repeat_reports_percentiles(capsys):
+    assert fleet.main(parse('--local', '2', '--repeat', '20', 'ping')) == 0
+    out = capsys.readouterr().out
+    assert out.count('20/20 acked') == 2
+
+
+def test_stress(capsys):
+    assert fleet.main(parse('--local', '2', '--stress', '0.5', '--window', '4', 'ping')) == 0
+    out = capsys.readouterr().out
+    assert 'fleet: ' in out and ' 0 lost' in out
+
+
+def test_resume_at_the_same_time():
+    standins = [fleet.StandIn() for _ in range(3)]
+    try:
+        args = parse('--at', '0.3', 'resume')
+        assert asyncio.run(fleet.amain(args, [standin.addr for standin in standins], standins))
+        fired = [t for standin in standins for t in standin.fired]
+        assert len(fired) == 3  # each ran it once
+        assert (max(fired) - min(fired)) / 1E6 < 20  # ms apart
+    finally:
+        for standin in standins:
+            standin.close()
+
+
+def test_only_pause_and_resume_can_be_scheduled():
+    assert fleet.main(parse('--local', '1', '--at', '0.1', 'stop')) == 2
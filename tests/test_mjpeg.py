@@ -0,0 +1,130 @@
+"""MjpegServer over loopback, fed from the stand-in camera, read with http.client."""
+
+import time
+import threading
+import http.client
+
+import cv2
+import numpy as np
+import pytest
+
+from hiwonder_common import frames
+from hiwonder_common import mjpeg
+from hiwonder_common import render
+from hiwonder_common import standins
+
+MAX_AGE = 0.3
+
+
+class Feeder:
+    # renders the stand-in camera's frames to the server, while feeding is set (as the control loop would)
+    def __init__(self, renderer):
+        self.camera = frames.publishing_camera(standins.StandInCamera)(resolution=(160, 120), fps=60)
+        self.camera.camera_open()
+        self.renderer = renderer
+        self.feeding = threading.Event()
+        self.feeding.set()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        seq = None
+        while not self.stopped:
+            frame = self.camera.frame_source.wait_next(seq, timeout=0.1)
+            if frame is None:
+                continue
+            seq = frame.seq
+            if self.feeding.is_set():
+                canvas = self.renderer.canvas(frame.image)
+                if canvas is not None:
+                    self.renderer.publish(canvas)
+
+    def close(self):
+        self.stopped = True
+        self.thread.join(1.0)
+        self.camera.camera_close()
+
+
+@pytest.fixture
+def preview():
+    server = mjpeg.MjpegServer(port=0, host='127.0.0.1', max_fps=0, max_age=MAX_AGE).start()
+    renderer = render.Renderer(display_size=(80, 60), frame_size=(160, 120))
+    renderer.subscribe(server)
+    feeder = Feeder(renderer)
+    yield server, feeder
+    feeder.close()
+    server.close()
+
+
+def get(server, path):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    return conn, response
+
+
+def snapshot(server):
+    conn, response = get(server, '/snapshot.jpg')
+    try:
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def first_part(server):
+    # the first JPEG of /stream.mjpg
+    conn, response = get(server, '/stream.mjpg')
+    try:
+        assert response.status == 200
+        assert response.getheader('Content-Type').startswith('multipart/x-mixed-replace')
+        length = None
+        while True:
+            line = response.fp.readline().strip()
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+            elif not line and length is not None:
+                return response.fp.read(length)
+    finally:
+        conn.close()
+
+
+def decode(jpeg):
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_snapshot(preview):
+    server, _ = preview
+    status, jpeg = snapshot(server)
+    assert status == 200
+    assert decode(jpeg).shape == (60, 80, 3)
+
+
+def test_stale_frame_is_not_served(preview):
+    server, feeder = preview
+    status, old = snapshot(server)
+    assert status == 200
+    feeder.feeding.clear()  # e.g. paused: nothing is rendered
+    time.sleep(MAX_AGE * 2)
+    status, _ = snapshot(server)
+    assert status == 503  # rather than the old frame
+
+
+def test_new_clients_wait_for_a_fresh_frame(preview):
+    server, feeder = preview
+    status, old = snapshot(server)
+    assert status == 200
+    feeder.feeding.clear()
+    time.sleep(MAX_AGE * 2)
+    threading.Timer(0.2, feeder.feeding.set).start()
+    t0 = time.monotonic()
+    status, jpeg = snapshot(server)
+    assert status == 200 and jpeg != old
+    assert time.monotonic() - t0 >= 0.15  # waited for the feeder, not served from the cache
+
+    feeder.feeding.clear()
+    time.sleep(MAX_AGE * 2)
+    threading.Timer(0.2, feeder.feeding.set).start()
+    part = first_part(server)
+    assert part != jpeg
+    assert decode(part).shape == (60, 80, 3)